@@ -0,0 +1,6 @@
+"""
+Load generation and benchmarks for the predictor's socket protocol.
+
+Run from the predictor_container_deepbiccn2 folder:
+    python -m benchmark.run_benchmark --help
+"""
@@ -0,0 +1,102 @@
+import gzip
+import json
+import struct
+import socket
+import time
+
+try:  # zstd compressed messages need the zstandard package
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class PredictorClient:
+    """
+    Minimal Evaluator speaking the predictor's 4-byte length-prefixed protocol.
+    """
+
+    def __init__(self, host, port, timeout=600):
+        self.socket = socket.create_connection((host, port), timeout=timeout)
+
+    def _recv_exact(self, n_bytes):
+        buffer = bytearray(n_bytes)
+        view = memoryview(buffer)
+        received = 0
+        while received < n_bytes:
+            n = self.socket.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("predictor closed the connection")
+            received += n
+        return buffer
+
+    def send_payload(self, payload):
+        self.socket.sendall(struct.pack(">I", len(payload)) + payload)
+
+    def recv_payload(self):
+        (msglen,) = struct.unpack(">I", self._recv_exact(4))
+        return self._recv_exact(msglen)
+
+    def request(self, payload):
+        """
+        Sends one encoded request and returns the raw response, the latency in seconds
+        and the number of bytes sent and received.
+        """
+        start = time.perf_counter()
+        self.send_payload(payload)
+        response = self.recv_payload()
+        return (
+            response,
+            time.perf_counter() - start,
+            len(payload) + 4,
+            len(response) + 4,
+        )
+
+    def request_json(self, evaluator_json):
+        response, _, _, _ = self.request(json.dumps(evaluator_json).encode("utf-8"))
+        return json.loads(response)
+
+    def close(self):
+        self.socket.close()
+
+
+def compress_payload(payload, codec):
+    """
+    Compresses a request with "gzip" or "zstd", the predictor recognizes compressed messages.
+    """
+    if codec == "gzip":
+        return gzip.compress(payload)
+    if zstandard is None:
+        raise RuntimeError("zstd compression needs the zstandard package")
+    return zstandard.ZstdCompressor().compress(payload)
+
+
+def decompress_payload(payload):
+    """
+    Returns a response as sent by the predictor, decompressed if it was compressed.
+    """
+    payload = bytes(payload)
+    if payload[:2] == b"\x1f\x8b":
+        return gzip.decompress(payload)
+    if payload[:4] == b"\x28\xb5\x2f\xfd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+    return payload
+
+
+def wait_for_predictor(host, port, timeout=600, process=None):
+    """
+    Blocks until the predictor accepts connections, it only listens once the model is warmed up.
+    `process` is the predictor's subprocess when it was started locally.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=5).close()
+            return
+        except OSError:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(
+                    f"predictor exited with code {process.returncode} before listening"
+                )
+            if time.time() > deadline:
+                raise TimeoutError(f"predictor on {host}:{port} did not come up")
+            time.sleep(0.5)
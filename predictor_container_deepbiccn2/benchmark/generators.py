@@ -0,0 +1,87 @@
+import numpy as np
+
+# Sequence length the predictor accepts, after flanking
+INPUT_LENGTH = 2114
+
+# Cell types of deepbiccn2, in the order of deepbiccn2_output_classes.tsv
+CELL_TYPES = [
+    "Astro",
+    "Endo",
+    "L2_3IT",
+    "L5ET",
+    "L5IT",
+    "L5_6NP",
+    "L6CT",
+    "L6IT",
+    "L6b",
+    "Lamp5",
+    "Micro_PVM",
+    "OPC",
+    "Oligo",
+    "Pvalb",
+    "Sncg",
+    "Sst",
+    "SstChodl",
+    "VLMC",
+    "Vip",
+]
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+def random_sequences(n_sequences, length, rng):
+    """
+    Returns `n_sequences` random ACGT strings of `length` bases.
+    """
+    codes = BASES[rng.integers(0, 4, size=(n_sequences, length))]
+    return [row.tobytes().decode("ascii") for row in codes]
+
+
+def make_prediction_tasks(n_tasks):
+    """
+    Returns `n_tasks` accessibility tasks, cycling through the cell types.
+    """
+    return [
+        {
+            "name": f"task_{i}",
+            "type": "accessibility",
+            "cell_type": CELL_TYPES[i % len(CELL_TYPES)],
+            "species": "mus_musculus",
+        }
+        for i in range(n_tasks)
+    ]
+
+
+def make_request(
+    n_sequences,
+    n_tasks=1,
+    flank_length=0,
+    prediction_range=None,
+    seed=0,
+    id_prefix="seq",
+):
+    """
+    Builds a predict request with `n_sequences` synthetic sequences that are 2114 bp long
+    once `flank_length` bases of upstream and downstream flank are added by the predictor.
+    `prediction_range` is an optional inclusive [start, end] applied to every sequence.
+    """
+    rng = np.random.default_rng(seed)
+    core_length = INPUT_LENGTH - 2 * flank_length
+    if core_length <= 0:
+        raise ValueError(f"flank_length {flank_length} leaves no room for a sequence")
+    seqs = random_sequences(n_sequences, core_length, rng)
+    request = {
+        "request": "predict",
+        "readout": "point",
+        "prediction_tasks": make_prediction_tasks(n_tasks),
+        "sequences": {f"{id_prefix}_{i}": seq for i, seq in enumerate(seqs)},
+    }
+    if flank_length:
+        upstream, downstream = random_sequences(2, flank_length, rng)
+        request["upstream_seq"] = upstream
+        request["downstream_seq"] = downstream
+    if prediction_range is not None:
+        request["prediction_ranges"] = {
+            seq_id: list(prediction_range) for seq_id in request["sequences"]
+        }
+    return request
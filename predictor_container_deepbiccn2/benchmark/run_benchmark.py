@@ -0,0 +1,360 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import platform
+import threading
+import itertools
+import subprocess
+
+import numpy as np
+
+from .client import (
+    PredictorClient,
+    wait_for_predictor,
+    compress_payload,
+    decompress_payload,
+)
+from .generators import make_request
+from .standin_model import write_standin_model_dir
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+PREDICTOR_SCRIPT = os.path.join(
+    BENCHMARK_PATH, "..", "script_and_utils", "crested_predictor_api.py"
+)
+RSS_SAMPLE_INTERVAL_S = 0.05
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def read_proc_status_bytes(pid, field):
+    """
+    Reads a memory field such as VmRSS or VmHWM of a local process, None where /proc is unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    """
+    Samples the resident set size of the predictor process in the background
+    and keeps the peak seen since the last `reset`.
+    """
+
+    def __init__(self, pid, interval=RSS_SAMPLE_INTERVAL_S):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = read_proc_status_bytes(self.pid, "VmRSS")
+        if rss is not None:
+            self.peak = rss if self.peak is None else max(self.peak, rss)
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def reset(self):
+        self.peak = None
+        self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def start_predictor(host, port, model_dir, extra_env, log_file):
+    """
+    Starts the predictor as a subprocess serving the model in `model_dir`.
+    """
+    env = dict(os.environ)
+    env["PREDICTOR_MODEL_DIR"] = os.path.abspath(model_dir)
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, PREDICTOR_SCRIPT, host, str(port)],
+        cwd=os.path.dirname(PREDICTOR_SCRIPT),
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def response_failed(response):
+    # predictor errors come back as a JSON object keyed by the error kind
+    response = decompress_payload(response)
+    if response[:1] != b"{":
+        return False
+    parsed = json.loads(response)
+    return "bad_prediction_request" in parsed or "prediction_request_failed" in parsed
+
+
+def run_case(host, port, case, args, rss_sampler):
+    """
+    Runs `case["concurrency"]` clients that each send `args.requests_per_client` requests
+    back to back, and returns throughput, latency percentiles and peak RSS of the case.
+    """
+    # distinct payloads per case, built (and compressed) before the clock starts
+    payloads = []
+    for seed in range(args.payload_pool):
+        request = make_request(
+            case["sequences_per_request"],
+            n_tasks=case["tasks_per_request"],
+            flank_length=args.flank_length,
+            prediction_range=args.prediction_range,
+            seed=seed,
+            id_prefix=f"seq{seed}",
+        )
+        if args.compression:
+            request["compression"] = args.compression
+        payload = json.dumps(request).encode("utf-8")
+        if args.compression:
+            payload = compress_payload(payload, args.compression)
+        payloads.append(payload)
+    latencies = []
+    errors = []
+    bytes_sent = [0]
+    bytes_received = [0]
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(case["concurrency"] + 1)
+
+    def client_worker(worker_id):
+        client_latencies = []
+        client_errors = 0
+        sent = received = 0
+        client = PredictorClient(host, port, timeout=args.timeout)
+        try:
+            start_barrier.wait()
+            for i in range(args.requests_per_client):
+                payload = payloads[(worker_id + i) % len(payloads)]
+                response, latency, n_sent, n_received = client.request(payload)
+                client_latencies.append(latency)
+                client_errors += response_failed(response)
+                sent += n_sent
+                received += n_received
+        finally:
+            client.close()
+        with lock:
+            latencies.extend(client_latencies)
+            errors.append(client_errors)
+            bytes_sent[0] += sent
+            bytes_received[0] += received
+
+    threads = [
+        threading.Thread(target=client_worker, args=(worker_id,))
+        for worker_id in range(case["concurrency"])
+    ]
+    for thread in threads:
+        thread.start()
+    if rss_sampler is not None:
+        rss_sampler.reset()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+
+    n_requests = len(latencies)
+    n_sequences = n_requests * case["sequences_per_request"]
+    latencies = np.array(latencies)
+    result = dict(case)
+    result.update(
+        {
+            "requests": n_requests,
+            "failed_requests": int(sum(errors)),
+            "sequences": n_sequences,
+            "wall_time_s": wall_time,
+            "requests_per_s": n_requests / wall_time,
+            "sequences_per_s": n_sequences / wall_time,
+            "latency_s": {
+                "mean": float(latencies.mean()),
+                "p50": float(np.percentile(latencies, 50)),
+                "p95": float(np.percentile(latencies, 95)),
+                "p99": float(np.percentile(latencies, 99)),
+                "max": float(latencies.max()),
+            },
+            "bytes_sent": bytes_sent[0],
+            "bytes_received": bytes_received[0],
+            "peak_rss_bytes": rss_sampler.peak if rss_sampler is not None else None,
+        }
+    )
+    return result
+
+
+def run_benchmark(args):
+    host = args.host
+    server = None
+    log_file = None
+    tmp_dir = None
+    pid = args.server_pid
+    if args.port is None:
+        # serve a local predictor, on the stand-in model unless a model folder is given
+        port = free_port(host)
+        model_dir = args.model_dir
+        if model_dir is None:
+            tmp_dir = tempfile.TemporaryDirectory(prefix="predictor_benchmark_")
+            model_dir = write_standin_model_dir(tmp_dir.name)
+        extra_env = {"PREDICTOR_CACHE_BYTES": str(args.cache_bytes)}
+        log_file = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+        server = start_predictor(host, port, model_dir, extra_env, log_file)
+        pid = server.pid
+    else:
+        port = args.port
+
+    rss_sampler = None
+    try:
+        wait_for_predictor(host, port, timeout=args.startup_timeout, process=server)
+        if pid is not None and read_proc_status_bytes(pid, "VmRSS") is not None:
+            rss_sampler = RssSampler(pid).start()
+        startup_rss = rss_sampler.peak if rss_sampler is not None else None
+
+        # untimed requests so the first case does not pay for lazy initialization
+        warmup_client = PredictorClient(host, port, timeout=args.timeout)
+        for seed in range(args.warmup_requests):
+            warmup_client.request_json(make_request(1, seed=seed, id_prefix="warmup"))
+        warmup_client.close()
+
+        cases = []
+        for concurrency, n_sequences, n_tasks in itertools.product(
+            args.concurrency, args.sequences, args.tasks
+        ):
+            case = {
+                "concurrency": concurrency,
+                "sequences_per_request": n_sequences,
+                "tasks_per_request": n_tasks,
+            }
+            result = run_case(host, port, case, args, rss_sampler)
+            print(
+                f"concurrency={concurrency:<4} sequences={n_sequences:<6} tasks={n_tasks:<3}"
+                f" {result['sequences_per_s']:10.1f} seq/s"
+                f"  p50={result['latency_s']['p50'] * 1e3:8.1f} ms"
+                f"  p99={result['latency_s']['p99'] * 1e3:8.1f} ms",
+                file=sys.stderr,
+            )
+            cases.append(result)
+
+        metrics_client = PredictorClient(host, port, timeout=args.timeout)
+        server_metrics = metrics_client.request_json({"request": "metrics"})
+        metrics_client.close()
+        # high water mark of the predictor's resident memory over its lifetime
+        peak_rss = read_proc_status_bytes(pid, "VmHWM") if pid is not None else None
+    finally:
+        if rss_sampler is not None:
+            rss_sampler.stop()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if log_file not in (None, subprocess.DEVNULL):
+            log_file.close()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    return {
+        "benchmark": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "model": args.model_dir or ("stand-in" if args.port is None else None),
+            "requests_per_client": args.requests_per_client,
+            "flank_length": args.flank_length,
+            "prediction_range": args.prediction_range,
+            "compression": args.compression,
+            "startup_rss_bytes": startup_rss,
+            "peak_rss_bytes": peak_rss,
+        },
+        "cases": cases,
+        "server_metrics": server_metrics,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure throughput, latency and memory of the predictor over its socket protocol. "
+        "Without --port a predictor is started on a stand-in model with the deepbiccn2 shapes."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port", type=int, help="benchmark an already running predictor"
+    )
+    parser.add_argument(
+        "--server-pid",
+        type=int,
+        help="pid of the running predictor, to report its RSS when using --port",
+    )
+    parser.add_argument(
+        "--model-dir",
+        help="model folder to serve instead of the stand-in model, e.g. ../model",
+    )
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 4, 16])
+    parser.add_argument("--sequences", type=parse_int_list, default=[1, 32, 256])
+    parser.add_argument("--tasks", type=parse_int_list, default=[1, 19])
+    parser.add_argument("--requests-per-client", type=int, default=10)
+    parser.add_argument(
+        "--payload-pool",
+        type=int,
+        default=4,
+        help="distinct requests generated per case, clients cycle through them",
+    )
+    parser.add_argument("--flank-length", type=int, default=0)
+    parser.add_argument(
+        "--prediction-range",
+        type=parse_int_list,
+        help="inclusive start,end applied to every sequence, e.g. 0,2113",
+    )
+    parser.add_argument(
+        "--compression",
+        choices=["gzip", "zstd"],
+        help="compress the requests and negotiate compressed responses",
+    )
+    parser.add_argument("--warmup-requests", type=int, default=2)
+    parser.add_argument(
+        "--cache-bytes",
+        type=int,
+        default=0,
+        help="PREDICTOR_CACHE_BYTES of the started predictor, off by default so repeated payloads reach the model",
+    )
+    parser.add_argument("--server-log", help="file for the started predictor's output")
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    report_json = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report_json + "\n")
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
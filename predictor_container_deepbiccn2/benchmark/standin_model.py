@@ -0,0 +1,55 @@
+import os
+import shutil
+import argparse
+
+from .generators import INPUT_LENGTH, CELL_TYPES
+
+MODEL_NAME = "deepbiccn2"
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+TARGETS_FILE = os.path.join(
+    BENCHMARK_PATH, "..", "model", f"{MODEL_NAME}_output_classes.tsv"
+)
+
+
+def build_standin_model(n_filters=32, kernel_size=21, seed=0):
+    """
+    Returns a small untrained Keras model with the deepbiccn2 input and output shapes,
+    (2114, 4) one-hot sequence in, one value per cell type out. It only stands in for the
+    real weights when measuring the predictor, its predictions are meaningless.
+    """
+    import keras
+
+    keras.utils.set_random_seed(seed)
+    inputs = keras.Input(shape=(INPUT_LENGTH, 4), name="sequence")
+    x = keras.layers.Conv1D(n_filters, kernel_size, activation="relu")(inputs)
+    x = keras.layers.MaxPooling1D(8)(x)
+    x = keras.layers.Conv1D(n_filters, 7, activation="relu")(x)
+    x = keras.layers.GlobalAveragePooling1D()(x)
+    outputs = keras.layers.Dense(len(CELL_TYPES), activation="softplus")(x)
+    return keras.Model(inputs, outputs, name=f"{MODEL_NAME}_standin")
+
+
+def write_standin_model_dir(directory, **model_kwargs):
+    """
+    Saves the stand-in model and the deepbiccn2 output classes in `directory`,
+    laid out like the predictor's model folder so it can be served with PREDICTOR_MODEL_DIR.
+    """
+    os.makedirs(directory, exist_ok=True)
+    model = build_standin_model(**model_kwargs)
+    model.save(os.path.join(directory, f"{MODEL_NAME}.keras"))
+    targets_path = os.path.join(directory, f"{MODEL_NAME}_output_classes.tsv")
+    if os.path.exists(TARGETS_FILE):
+        shutil.copyfile(TARGETS_FILE, targets_path)
+    else:
+        with open(targets_path, "w") as f:
+            f.write("\n".join(CELL_TYPES) + "\n")
+    return directory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write a stand-in deepbiccn2 model folder for benchmarking"
+    )
+    parser.add_argument("directory")
+    args = parser.parse_args()
+    print(f"Stand-in model written to {write_standin_model_dir(args.directory)}")
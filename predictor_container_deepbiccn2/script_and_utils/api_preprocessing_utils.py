@@ -7,16 +7,143 @@ import tqdm
 
 
 ## model specific checks that cause a "prediction_request_failed" error
-def check_seqs_specifications(sequences, json_return_error_model):
-    required_length = 2114
-    for sequence in sequences:
-        value = sequences[sequence]
-        key = sequence
+REQUIRED_SEQUENCE_LENGTH = 2114
+# lookup of the ASCII bytes allowed in a sequence
+VALID_SEQUENCE_BYTES = np.zeros(256, dtype=bool)
+VALID_SEQUENCE_BYTES[np.frombuffer(b"ACGTNacgtn", dtype=np.uint8)] = True
 
-        if len(value) != required_length:
+
+def check_seqs_specifications(sequences, json_return_error_model, tiled=False):
+    # all sequences are checked at once on their concatenated bytes
+    # tiled sequences only need to hold at least one model-length window
+    required_length = REQUIRED_SEQUENCE_LENGTH
+    keys = list(sequences.keys())
+    values = list(sequences.values())
+    is_string = np.fromiter(
+        (isinstance(value, str) for value in values), dtype=bool, count=len(values)
+    )
+    if not is_string.all():
+        for i in np.flatnonzero(~is_string):
+            json_return_error_model["prediction_request_failed"].append(
+                f"sequence in {keys[i]} should be a string"
+            )
+        keys = [key for key, ok in zip(keys, is_string) if ok]
+        values = [value for value, ok in zip(values, is_string) if ok]
+
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    if tiled:
+        bad_length = lengths < required_length
+    else:
+        bad_length = lengths != required_length
+    # non-ASCII characters become "?" so every character stays one byte
+    seq_bytes = np.frombuffer(
+        "".join(values).encode("ascii", "replace"), dtype=np.uint8
+    )
+    bad_alphabet = np.zeros(len(values), dtype=bool)
+    invalid_positions = np.flatnonzero(~VALID_SEQUENCE_BYTES[seq_bytes])
+    if invalid_positions.size:
+        seq_index = np.searchsorted(np.cumsum(lengths), invalid_positions, side="right")
+        bad_alphabet[seq_index] = True
+
+    for i in np.flatnonzero(bad_length | bad_alphabet):
+        key = keys[i]
+        if bad_length[i] and tiled:
+            json_return_error_model["prediction_request_failed"].append(
+                f"length of a sequence in {key} is shorter than {required_length}"
+            )
+        elif bad_length[i]:
             json_return_error_model["prediction_request_failed"].append(
                 f"length of a sequence in {key} is not equal to {required_length}"
             )
+        if bad_alphabet[i]:
+            json_return_error_model["prediction_request_failed"].append(
+                f"sequence in {key} contains characters other than A, C, G, T or N"
+            )
+    return json_return_error_model
+
+
+def check_mutagenesis_specifications(
+    sequences, evaluator_json, json_return_error_model, upstream_length=0
+):
+    # mutagenesis positions count from the start of the sequence as sent, before flanking
+    positions = evaluator_json.get("mutagenesis_positions", {})
+    variants = evaluator_json.get("mutagenesis_variants", {})
+    downstream_length = len(evaluator_json.get("downstream_seq", ""))
+    for seq_id, sequence in sequences.items():
+        if not isinstance(sequence, str):
+            continue
+        sent_length = len(sequence) - upstream_length - downstream_length
+        if seq_id in variants:
+            seq_positions = np.array(
+                [position for position, _ in variants[seq_id]], dtype=np.int64
+            )
+        elif seq_id in positions:
+            seq_positions = np.array(positions[seq_id], dtype=np.int64)
+        else:
+            seq_positions = np.arange(sent_length)
+        if ((seq_positions < 0) | (seq_positions >= sent_length)).any():
+            json_return_error_model["prediction_request_failed"].append(
+                f"mutagenesis position out of range for sequence {seq_id}"
+            )
+            continue
+        if seq_id in variants:
+            # a variant has to change the base, the reference itself has no effect to predict
+            for position, base in variants[seq_id]:
+                if sequence[position + upstream_length].upper() == base:
+                    json_return_error_model["prediction_request_failed"].append(
+                        f"mutagenesis variant at position {position} of sequence {seq_id} is the reference base {base}"
+                    )
+        else:
+            # every base but the reference is tried, so the reference has to be a known base
+            seq_bytes = np.frombuffer(
+                sequence.encode("ascii", "replace"), dtype=np.uint8
+            )
+            if not np.isin(
+                seq_bytes[seq_positions + upstream_length],
+                np.frombuffer(b"ACGTacgt", dtype=np.uint8),
+            ).all():
+                json_return_error_model["prediction_request_failed"].append(
+                    f"sequence {seq_id} has a base other than A, C, G or T at a mutagenesis position"
+                )
+    return json_return_error_model
+
+
+def apply_flanks(sequences, upstream_seq, downstream_seq, progress=True):
+    # adds the upstream and downstream flanking sequences to every sequence, in place
+    items = sequences.items()
+    if progress:
+        items = tqdm.tqdm(
+            items,
+            desc="Flanking sequences",
+            unit="sequence",
+            total=len(sequences),
+            dynamic_ncols=True,
+        )
+    for seq_id, sequence in items:
+        sequences[seq_id] = f"{upstream_seq}{sequence}{downstream_seq}"
+    return sequences
+
+
+def apply_prediction_ranges(
+    sequences, prediction_ranges, json_return_error_model, verbose=True
+):
+    # trims sequences in place to their prediction range, start and end inclusive
+    for seq_id, pr in prediction_ranges.items():
+        # Only process non-empty ranges
+        if pr:
+            # Unpack start and end indices
+            start, end = pr
+            # Check that the end index does not exceed sequence length
+            if end >= len(sequences[seq_id]):
+                json_return_error_model["prediction_request_failed"].append(
+                    f"Prediction range for '{seq_id}' exceeds the sequence length!"
+                )
+            else:
+                sequences[seq_id] = sequences[seq_id][start : end + 1]
+                if verbose:
+                    print(
+                        f"Sequence '{seq_id}' trimmed to prediction range [{start}, {end}]."
+                    )
     return json_return_error_model
 
 
@@ -0,0 +1,82 @@
+import time
+
+import numpy as np
+
+
+def is_resource_exhausted(error):
+    """
+    Tells whether a forward pass failed because it ran out of (host or device) memory.
+    """
+    if isinstance(error, MemoryError):
+        return True
+    # tf.errors.ResourceExhaustedError, matched by name so TensorFlow is not imported here
+    if type(error).__name__ == "ResourceExhaustedError":
+        return True
+    message = str(error)
+    return "RESOURCE_EXHAUSTED" in message or "OOM when allocating" in message
+
+
+def activation_bytes_per_sequence(model, seq_length):
+    """
+    Estimates the memory one sequence takes in a forward pass: its float32 one-hot input plus
+    the two largest consecutive layer outputs that are alive at the same time.
+    """
+    largest = 0
+    for layer in getattr(model, "layers", []):
+        try:
+            shape = layer.output.shape[1:]
+        except (AttributeError, ValueError):
+            continue
+        if all(isinstance(dim, int) for dim in shape):
+            largest = max(largest, int(np.prod(shape)) * 4)
+    return seq_length * 4 * 4 + 2 * largest
+
+
+def autotune_batch_size(
+    predict_fn,
+    candidates,
+    seq_length,
+    bytes_per_sequence,
+    memory_bytes,
+    repeats=3,
+    min_gain=0.05,
+):
+    """
+    Times predict_fn on random one-hot batches of each candidate size, smallest first, and
+    returns the size with the highest throughput along with {batch_size: sequences per second}.
+    Candidates whose estimated memory exceeds `memory_bytes` are not tried, and the sweep stops
+    at the first size that runs out of memory or after two sizes no `min_gain` faster than the best.
+    """
+    candidates = sorted(set(candidates))
+    fitting = [
+        size for size in candidates if size * bytes_per_sequence <= memory_bytes
+    ] or candidates[:1]
+    rng = np.random.default_rng(0)
+    inputs = np.eye(4, dtype=np.float32)[
+        rng.integers(0, 4, size=(fitting[-1], seq_length))
+    ]
+    throughputs = {}
+    best, best_throughput, stalls = fitting[0], 0.0, 0
+    for batch_size in fitting:
+        batch = inputs[:batch_size]
+        try:
+            # the first pass builds the graph for this shape and is not timed
+            predict_fn(batch)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                predict_fn(batch)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            if not is_resource_exhausted(e):
+                raise
+            print(f"Batch size {batch_size} ran out of memory, stopping the search")
+            break
+        throughputs[batch_size] = batch_size * repeats / max(elapsed, 1e-9)
+        print(f"Batch size {batch_size}: {throughputs[batch_size]:.1f} sequences/s")
+        if throughputs[batch_size] > best_throughput * (1 + min_gain):
+            best, best_throughput, stalls = batch_size, throughputs[batch_size], 0
+        else:
+            stalls += 1
+            if stalls == 2:
+                break
+    return best, throughputs
@@ -0,0 +1,184 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from scheduling_utils import FairScheduler, RequestCancelled
+
+
+class _PendingRequest:
+    """
+    Sequences of one request waiting in the batcher, with the rows already filled in.
+    """
+
+    def __init__(self, seqs, client=None, size=None, cancel_token=None, model=None):
+        self.seqs = seqs
+        self.client = client
+        # hosted model the sequences go through, None for the default one
+        self.model = model
+        # sequences of the whole request, of which `seqs` may be one chunk
+        self.size = len(seqs) if size is None else size
+        self.cancel_token = cancel_token
+        self.future = Future()
+        self.output = None
+        self.next_row = 0  # first sequence not yet placed in a batch
+        self.rows_done = 0  # sequences that already have predictions
+        self.failed = False
+
+    def remaining(self):
+        return len(self.seqs) - self.next_row
+
+
+class MicroBatcher:
+    """
+    Merges the validated sequences of all pending requests into batches of `batch_size`
+    for the model. A batch is flushed when it is full or `max_wait_ms` after its first
+    sequence arrived, and every request gets back its own rows of the (N, C) output.
+    With `n_runners` > 1, up to that many batches are predicted at the same time,
+    e.g. one per worker of an inference pool. Pending requests are picked by a FairScheduler,
+    requests of at most `small_request_rows` sequences (default one batch) go first.
+    A batch only holds sequences for one model, `predict_fn(seqs, model)` predicts it.
+    """
+
+    def __init__(
+        self,
+        predict_fn,
+        batch_size=256,
+        max_wait_ms=5.0,
+        n_runners=1,
+        small_request_rows=None,
+    ):
+        self.predict_fn = predict_fn
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = FairScheduler(small_request_rows or batch_size)
+        self._lock = threading.Lock()
+        self._runner_slots = threading.BoundedSemaphore(n_runners)
+        self._runners = (
+            ThreadPoolExecutor(n_runners, thread_name_prefix="batch-runner")
+            if n_runners > 1
+            else None
+        )
+        self._thread = threading.Thread(
+            target=self._run, name="micro-batcher", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, seqs, client=None, size=None, cancel_token=None, model=None):
+        """
+        Queues a list of sequences and returns a Future resolving to their (N, C) predictions.
+        `client` groups requests for fair queuing, `size` is the sequence count of the whole
+        request if `seqs` is one of its chunks, and a cancelled `cancel_token` fails the Future
+        with RequestCancelled before the remaining sequences reach the model. `model` names the
+        hosted model to run, the default one if None.
+        """
+        pending = _PendingRequest(list(seqs), client, size, cancel_token, model)
+        if not pending.seqs:
+            pending.future.set_result(np.empty((0, 0), dtype=np.float32))
+        else:
+            self._queue.put(pending)
+        return pending.future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect_batch(self):
+        # Returns [(pending, start, end), ...] slices filling at most one batch,
+        # a request with sequences left over goes back to the scheduler for its next turn
+        batch = []
+        # requests for another model than the batch's, queued again once it is collected
+        other_models = []
+        n_rows = 0
+        deadline = None
+        while n_rows < self.batch_size:
+            pending = self._queue.get(
+                None if deadline is None else max(deadline - time.perf_counter(), 0)
+            )
+            if pending is None:
+                break
+            if pending.failed or self._cancel_if_requested(pending):
+                continue
+            if batch and pending.model != batch[0][0].model:
+                other_models.append(pending)
+                continue
+            if deadline is None:
+                deadline = time.perf_counter() + self.max_wait
+            take = min(pending.remaining(), self.batch_size - n_rows)
+            batch.append((pending, pending.next_row, pending.next_row + take))
+            pending.next_row += take
+            n_rows += take
+            if pending.remaining():
+                self._queue.put(pending, front=True)
+        for pending in reversed(other_models):
+            self._queue.put(pending, front=True)
+        return batch
+
+    def _cancel_if_requested(self, pending):
+        # a request cancelled while queued fails without sending more sequences to the model
+        if pending.cancel_token is None:
+            return False
+        try:
+            pending.cancel_token.check()
+            return False
+        except RequestCancelled as e:
+            with self._lock:
+                if not pending.failed:
+                    pending.failed = True
+                    pending.future.set_exception(e)
+            return True
+
+    def _run(self):
+        while True:
+            # wait for a free runner first so batches keep filling while all runners are busy
+            self._runner_slots.acquire()
+            batch = self._collect_batch()
+            batch = [part for part in batch if not part[0].failed]
+            if not batch:
+                self._runner_slots.release()
+                continue
+            if self._runners is None:
+                self._run_batch(batch)
+            else:
+                self._runners.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch):
+        try:
+            self._predict_batch(batch)
+        finally:
+            self._runner_slots.release()
+
+    def _predict_batch(self, batch):
+        seqs = [seq for pending, start, end in batch for seq in pending.seqs[start:end]]
+        try:
+            batch_predictions = np.asarray(self.predict_fn(seqs, batch[0][0].model))
+        except Exception as e:
+            with self._lock:
+                for pending, _, _ in batch:
+                    if not pending.failed:
+                        pending.failed = True
+                        pending.future.set_exception(e)
+            return
+
+        with self._lock:
+            offset = 0
+            for pending, start, end in batch:
+                if pending.failed:
+                    # failed or cancelled by another batch, its rows are dropped
+                    offset += end - start
+                    continue
+                if pending.output is None:
+                    pending.output = np.empty(
+                        (len(pending.seqs),) + batch_predictions.shape[1:],
+                        dtype=batch_predictions.dtype,
+                    )
+                pending.output[start:end] = batch_predictions[
+                    offset : offset + end - start
+                ]
+                offset += end - start
+                pending.rows_done += end - start
+                if pending.rows_done == len(pending.seqs):
+                    pending.future.set_result(pending.output)
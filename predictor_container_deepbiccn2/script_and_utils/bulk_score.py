@@ -0,0 +1,424 @@
+"""
+Offline bulk scoring: predicts every sequence of a FASTA, BED (with a genome) or plain text
+file through the predictor's validation and inference path, without the socket server.
+
+    python bulk_score.py library.fa scores
+    python bulk_score.py peaks.bed scores --genome mm10.2bit
+
+writes scores.npy, the (N, C) float32 predictions filled in through a memory map, the sequence
+IDs in scores.ids.txt and the model's cell types (the columns) in scores.columns.txt.
+Sequences that fail validation get a row of NaN and their errors go to scores.errors.txt.
+Progress is checkpointed to scores.checkpoint.json, running the same command again resumes
+an interrupted run instead of starting over.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tqdm
+
+from api_preprocessing_utils import (
+    REQUIRED_SEQUENCE_LENGTH,
+    check_seqs_specifications,
+    apply_flanks,
+    apply_prediction_ranges,
+)
+from crested_utils import (
+    chunk_size_for,
+    get_cell_type_index,
+    get_model_catalog,
+    init_model_registry,
+    one_hot_encode,
+    predict_one_hot,
+)
+from genome_utils import open_genome, parse_region, resolve_regions
+
+# Input format by file extension (before an optional .gz), anything else is read as one sequence per line
+INPUT_FORMATS = {
+    ".fa": "fasta",
+    ".fasta": "fasta",
+    ".fna": "fasta",
+    ".bed": "bed",
+}
+# Chunks predicted between two checkpoints
+CHECKPOINT_EVERY = 16
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+def input_format(path):
+    name = path[: -len(".gz")] if path.endswith(".gz") else path
+    return INPUT_FORMATS.get(os.path.splitext(name)[1].lower(), "text")
+
+
+def read_fasta(f):
+    # yields (seq_id, sequence), the ID is the first word of the header
+    seq_id, parts = None, []
+    for line in f:
+        line = line.strip()
+        if line.startswith(">"):
+            if seq_id is not None:
+                yield seq_id, "".join(parts)
+            seq_id, parts = (line[1:].split() or [""])[0], []
+        elif line:
+            parts.append(line)
+    if seq_id is not None:
+        yield seq_id, "".join(parts)
+
+
+def read_bed(f):
+    # yields (name, "chrom:start-end[:-]"), named by the region without a name column
+    for line in f:
+        if not line.strip() or line.startswith(("#", "track", "browser")):
+            continue
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 3:
+            # reported as a malformed region when its chunk is validated
+            yield line.strip(), line.strip()
+            continue
+        region = f"{fields[0]}:{fields[1]}-{fields[2]}"
+        if len(fields) > 5 and fields[5] == "-":
+            region += ":-"
+        name = fields[3] if len(fields) > 3 and fields[3] not in ("", ".") else region
+        yield name, region
+
+
+def read_text(f):
+    # one sequence per line, named by its position among the sequences
+    for i, line in enumerate(filter(None, map(str.strip, f))):
+        yield f"seq_{i}", line
+
+
+READERS = {"fasta": read_fasta, "bed": read_bed, "text": read_text}
+
+
+def count_records(path, fmt):
+    with open_text(path) as f:
+        if fmt == "fasta":
+            return sum(line.startswith(">") for line in f)
+        return sum(1 for _ in READERS[fmt](f))
+
+
+def read_chunks(path, fmt, chunk_size, skip=0):
+    """
+    Streams lists of at most `chunk_size` records, after skipping the first `skip` records.
+    """
+    with open_text(path) as f:
+        records = itertools.islice(READERS[fmt](f), skip, None)
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def prepare_chunk(records, first_row, args, genome=None):
+    """
+    Resolves, flanks, validates, trims and encodes one chunk of (seq_id, sequence or region)
+    records the way the server does for a request. Returns the chunk's IDs, the encoded valid
+    sequences (None if there are none), their positions in the chunk and the error messages.
+    """
+    ids = [seq_id for seq_id, _ in records]
+    # IDs in input files need not be unique, the row number tells sequences apart
+    keys = [f"{seq_id} (row {first_row + i})" for i, seq_id in enumerate(ids)]
+    sequences = dict(zip(keys, (value for _, value in records)))
+    json_return_error_model = {"prediction_request_failed": []}
+    if genome is not None:
+        # malformed regions are reported like the server's request validation does
+        for key, region in list(sequences.items()):
+            if parse_region(region) is None:
+                json_return_error_model["prediction_request_failed"].append(
+                    f"region of {key} should look like 'chrom:start-end' or 'chrom:start-end:-' "
+                    "with start < end"
+                )
+                del sequences[key]
+        region_length = (
+            REQUIRED_SEQUENCE_LENGTH - len(args.upstream_seq) - len(args.downstream_seq)
+        )
+        sequences = resolve_regions(
+            genome, sequences, json_return_error_model, region_length
+        )
+    if args.upstream_seq or args.downstream_seq:
+        apply_flanks(sequences, args.upstream_seq, args.downstream_seq, progress=False)
+    if check_seqs_specifications(sequences, {"prediction_request_failed": []})[
+        "prediction_request_failed"
+    ]:
+        # only chunks with invalid sequences are checked again one sequence at a time
+        for key in list(sequences):
+            sequence_errors = check_seqs_specifications(
+                {key: sequences[key]}, {"prediction_request_failed": []}
+            )["prediction_request_failed"]
+            if sequence_errors:
+                json_return_error_model["prediction_request_failed"].extend(
+                    sequence_errors
+                )
+                del sequences[key]
+    if args.prediction_range:
+        # the range was checked against the flanked length at startup
+        apply_prediction_ranges(
+            sequences,
+            dict.fromkeys(sequences, args.prediction_range),
+            json_return_error_model,
+            verbose=False,
+        )
+    positions = {key: i for i, key in enumerate(keys)}
+    valid_rows = np.fromiter(
+        (positions[key] for key in sequences), dtype=np.int64, count=len(sequences)
+    )
+    one_hot = one_hot_encode(list(sequences.values())) if sequences else None
+    return (
+        ids,
+        one_hot,
+        valid_rows,
+        json_return_error_model["prediction_request_failed"],
+    )
+
+
+class ScoreWriter:
+    """
+    Output files of a bulk scoring run and its checkpoint. The predictions are a memory-mapped
+    .npy created at full size up front, IDs and errors are appended per chunk. A checkpoint
+    records how many rows are complete, with the byte length of the ID and error files at that
+    point, so a resumed run truncates whatever was written after it and continues from there.
+    """
+
+    def __init__(self, prefix, settings, n_outputs, restart=False):
+        self.prefix = prefix
+        self.settings = settings
+        self.checkpoint_path = f"{prefix}.checkpoint.json"
+        checkpoint = None
+        if not restart and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("settings") != settings:
+                print(
+                    f"{self.checkpoint_path} belongs to another input or settings, starting over"
+                )
+                checkpoint = None
+        self.done = checkpoint["done"] if checkpoint else 0
+        self.complete = bool(checkpoint and checkpoint.get("complete"))
+        self.predictions = np.lib.format.open_memmap(
+            f"{prefix}.npy",
+            mode="r+" if checkpoint else "w+",
+            dtype=np.float32,
+            shape=(settings["n_records"], n_outputs),
+        )
+        self.ids_file = self._open(f"{prefix}.ids.txt", checkpoint, "ids_bytes")
+        self.errors_file = self._open(
+            f"{prefix}.errors.txt", checkpoint, "errors_bytes"
+        )
+
+    @staticmethod
+    def _open(path, checkpoint, size_key):
+        if checkpoint is None:
+            return open(path, "wb")
+        f = open(path, "r+b")
+        f.truncate(checkpoint[size_key])
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def write_chunk(self, first_row, ids, predictions, errors):
+        # rows of sequences that failed validation stay NaN
+        rows = self.predictions[first_row : first_row + len(ids)]
+        rows[:] = predictions
+        self.ids_file.write("".join(f"{seq_id}\n" for seq_id in ids).encode("utf-8"))
+        self.errors_file.write(
+            "".join(f"{error}\n" for error in errors).encode("utf-8")
+        )
+        self.done = first_row + len(ids)
+
+    def checkpoint(self, complete=False):
+        self.predictions.flush()
+        for f in (self.ids_file, self.errors_file):
+            f.flush()
+            os.fsync(f.fileno())
+        checkpoint = {
+            "settings": self.settings,
+            "done": self.done,
+            "ids_bytes": self.ids_file.tell(),
+            "errors_bytes": self.errors_file.tell(),
+            "complete": complete,
+        }
+        # written next to the checkpoint and renamed over it, a crash keeps the previous one
+        with open(self.checkpoint_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def close(self):
+        self.ids_file.close()
+        self.errors_file.close()
+        del self.predictions
+
+
+def bulk_score(args):
+    fmt = args.format or input_format(args.input)
+    if fmt == "bed" and not args.genome:
+        sys.exit("BED input needs --genome to read its regions from")
+    if args.prediction_range:
+        # every valid sequence has the required length once flanked, so one check covers all
+        start, end = args.prediction_range
+        if not 0 <= start <= end < REQUIRED_SEQUENCE_LENGTH:
+            sys.exit(
+                f"--prediction-range {start},{end} should satisfy "
+                f"0 <= start <= end < {REQUIRED_SEQUENCE_LENGTH}, the flanked sequence length"
+            )
+    genome = open_genome(args.genome) if fmt == "bed" else None
+
+    init_model_registry(autotune=args.autotune)
+    model = get_model_catalog().resolve(args.model)
+    if model is None:
+        sys.exit(
+            f"model '{args.model}' is not hosted, choose from: "
+            + ", ".join(get_model_catalog().names())
+        )
+    cell_types = list(get_cell_type_index(model))
+    with open(f"{args.output}.columns.txt", "w") as f:
+        f.write("".join(f"{cell_type}\n" for cell_type in cell_types))
+
+    input_stat = os.stat(args.input)
+    settings = {
+        "input": os.path.abspath(args.input),
+        "input_bytes": input_stat.st_size,
+        "input_mtime": input_stat.st_mtime,
+        "format": fmt,
+        "model": model,
+        "upstream_seq": args.upstream_seq,
+        "downstream_seq": args.downstream_seq,
+        "prediction_range": args.prediction_range,
+        "n_records": count_records(args.input, fmt),
+    }
+    writer = ScoreWriter(args.output, settings, len(cell_types), args.restart)
+    if writer.complete:
+        print(f"{args.output}.npy is already complete, use --restart to score again")
+        writer.close()
+        return
+    if writer.done:
+        print(f"Resuming after {writer.done} of {settings['n_records']} sequences")
+
+    # flanked sequences are validated against the required length
+    chunk_size = args.chunk_size or chunk_size_for(
+        REQUIRED_SEQUENCE_LENGTH, len(cell_types)
+    )
+    chunks = read_chunks(args.input, fmt, chunk_size, writer.done)
+
+    def next_chunk(first_row):
+        records = next(chunks, None)
+        if records is None:
+            return None
+        return first_row, prepare_chunk(records, first_row, args, genome)
+
+    start = time.perf_counter()
+    first_done = writer.done
+    n_invalid = 0
+    progress = tqdm.tqdm(
+        total=settings["n_records"],
+        initial=writer.done,
+        desc="Scoring sequences",
+        unit="sequence",
+        dynamic_ncols=True,
+    )
+    try:
+        # the next chunk is read and encoded while the current one is in the model
+        with ThreadPoolExecutor(1, thread_name_prefix="encode") as encoder:
+            pending = encoder.submit(next_chunk, writer.done)
+            n_chunks = 0
+            while True:
+                chunk = pending.result()
+                if chunk is None:
+                    break
+                first_row, (ids, one_hot, valid_rows, errors) = chunk
+                pending = encoder.submit(next_chunk, first_row + len(ids))
+                predictions = np.full((len(ids), len(cell_types)), np.nan, np.float32)
+                if one_hot is not None:
+                    predictions[valid_rows] = predict_one_hot(one_hot, model)
+                writer.write_chunk(first_row, ids, predictions, errors)
+                n_invalid += len(ids) - len(valid_rows)
+                progress.update(len(ids))
+                n_chunks += 1
+                if n_chunks % args.checkpoint_every == 0:
+                    writer.checkpoint()
+        writer.checkpoint(complete=True)
+    finally:
+        # an interrupted run keeps the chunks completed so far
+        if writer.done < settings["n_records"]:
+            writer.checkpoint()
+        progress.close()
+        writer.close()
+    elapsed = time.perf_counter() - start
+    n_scored = writer.done - first_done
+    print(
+        f"Scored {n_scored} sequences ({n_invalid} failed validation) in {elapsed:.2f}s "
+        f"({n_scored / max(elapsed, 1e-9):.1f} sequences/s), written to {args.output}.npy"
+    )
+
+
+def parse_prediction_range(value):
+    start, end = (int(v) for v in value.split(","))
+    return [start, end]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Score a FASTA, BED or one-sequence-per-line file offline with the predictor's "
+        "validation and inference path, resuming from the last checkpoint if interrupted."
+    )
+    parser.add_argument("input", help="sequences to score, optionally gzipped")
+    parser.add_argument(
+        "output",
+        help="prefix of the output files: .npy predictions, .ids.txt, .columns.txt, .errors.txt",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(READERS),
+        help="input format (default from the file extension, one sequence per line otherwise)",
+    )
+    parser.add_argument(
+        "--genome", help="FASTA (indexed with a .fai) or .2bit genome of BED input"
+    )
+    parser.add_argument(
+        "--model", help="hosted model to score with (default the default model)"
+    )
+    parser.add_argument(
+        "--upstream-seq", default="", help="added before every sequence"
+    )
+    parser.add_argument(
+        "--downstream-seq", default="", help="added after every sequence"
+    )
+    parser.add_argument(
+        "--prediction-range",
+        type=parse_prediction_range,
+        help="inclusive start,end every (flanked) sequence is trimmed to, e.g. 0,2113",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="sequences per chunk (default what fits PREDICTOR_INFERENCE_MEMORY_BYTES)",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=CHECKPOINT_EVERY,
+        help="chunks between checkpoints",
+    )
+    parser.add_argument(
+        "--autotune", action="store_true", help="autotune the batch size at startup"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore an existing checkpoint"
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    bulk_score(parse_args())
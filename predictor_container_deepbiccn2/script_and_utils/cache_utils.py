@@ -0,0 +1,181 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Approximate Python overhead of one in-memory cache entry on top of its prediction row
+ENTRY_OVERHEAD_BYTES = 200
+KEY_BYTES = 16
+
+
+class DiskPredictionStore:
+    """
+    Persistent cache tier: a memory-mapped float32 (capacity, C) prediction store plus a
+    table of the key stored in every slot, so cached predictions survive container restarts.
+    Slots are reused in insertion order once the store is full.
+    """
+
+    def __init__(self, directory, n_outputs, capacity):
+        self.directory = directory
+        self.n_outputs = n_outputs
+        self.capacity = capacity
+        os.makedirs(directory, exist_ok=True)
+        meta_file = os.path.join(directory, "meta.json")
+        meta = {"n_outputs": n_outputs, "capacity": capacity, "key_bytes": KEY_BYTES}
+        reuse = False
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                reuse = json.load(f) == meta
+            if not reuse:
+                print(
+                    f"Prediction cache in {directory} has a different layout, starting a new one"
+                )
+        mode = "r+" if reuse else "w+"
+        self.predictions = np.memmap(
+            os.path.join(directory, "predictions.f32"),
+            dtype=np.float32,
+            mode=mode,
+            shape=(capacity, n_outputs),
+        )
+        self.keys = np.memmap(
+            os.path.join(directory, "keys.bin"),
+            dtype=np.uint8,
+            mode=mode,
+            shape=(capacity, KEY_BYTES),
+        )
+        self.state = np.memmap(
+            os.path.join(directory, "state.i64"), dtype=np.int64, mode=mode, shape=(1,)
+        )
+        if not reuse:
+            with open(meta_file, "w") as f:
+                json.dump(meta, f)
+        # an all-zero key marks an empty slot
+        filled = np.flatnonzero(self.keys.any(axis=1))
+        self.index = {self.keys[slot].tobytes(): int(slot) for slot in filled}
+        print(f"Loaded {len(self.index)} cached predictions from {directory}")
+
+    def get(self, key):
+        slot = self.index.get(key)
+        if slot is None:
+            return None
+        return np.array(self.predictions[slot])
+
+    def put(self, key, row):
+        """
+        Stores a row and returns True if an older entry had to be overwritten.
+        """
+        if key in self.index:
+            return False
+        slot = int(self.state[0] % self.capacity)
+        old_key = self.keys[slot].tobytes()
+        evicted = old_key != bytes(KEY_BYTES)
+        if evicted:
+            self.index.pop(old_key, None)
+        # the slot is emptied on disk before its row is overwritten and only gets the new key
+        # after it, so a crash part way never pairs a key with another sequence's prediction
+        self.keys[slot] = 0
+        self.keys.flush()
+        self.predictions[slot] = row
+        self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+        self.index[key] = slot
+        self.state[0] += 1
+        return evicted
+
+    def flush(self):
+        self.predictions.flush()
+        self.keys.flush()
+        self.state.flush()
+
+
+class PredictionCache:
+    """
+    Content-addressed cache of prediction rows keyed by a hash of the model identity and the
+    final model-input sequence. The in-memory tier is an LRU bounded by `max_bytes`, an optional
+    DiskPredictionStore in `disk_dir` keeps predictions across restarts.
+    """
+
+    def __init__(
+        self, model_id, max_bytes, disk_dir=None, n_outputs=None, disk_capacity=0
+    ):
+        self.model_id = model_id.encode("utf-8")
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+        self.disk = None
+        if disk_dir and disk_capacity > 0:
+            self.disk = DiskPredictionStore(disk_dir, n_outputs, disk_capacity)
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+        }
+
+    def key(self, sequence):
+        digest = hashlib.blake2b(self.model_id, digest_size=KEY_BYTES)
+        digest.update(b"\0")
+        digest.update(sequence.encode("utf-8"))
+        return digest.digest()
+
+    def _remember(self, key, row):
+        # add to the in-memory LRU and evict the least recently used rows over budget
+        entry_bytes = row.nbytes + ENTRY_OVERHEAD_BYTES
+        if entry_bytes > self.max_bytes:
+            return
+        self.entries[key] = row
+        self.n_bytes += entry_bytes
+        while self.n_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.n_bytes -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+            self.counters["evictions"] += 1
+
+    def get_many(self, keys):
+        """
+        Returns {key: prediction row} for the keys that are cached.
+        """
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.entries.get(key)
+                if row is not None:
+                    self.entries.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                elif self.disk is not None:
+                    row = self.disk.get(key)
+                    if row is not None:
+                        self._remember(key, row)
+                        self.counters["disk_hits"] += 1
+                if row is None:
+                    self.counters["misses"] += 1
+                else:
+                    self.counters["hits"] += 1
+                    found[key] = row
+        return found
+
+    def put_many(self, keys, rows):
+        with self.lock:
+            for key, row in zip(keys, rows):
+                row = np.array(row, dtype=np.float32)
+                if key not in self.entries:
+                    self._remember(key, row)
+                if self.disk is not None and self.disk.put(key, row):
+                    self.counters["disk_evictions"] += 1
+            if self.disk is not None:
+                self.disk.flush()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+            stats["bytes"] = self.n_bytes
+            stats["max_bytes"] = self.max_bytes
+            if self.disk is not None:
+                stats["disk_entries"] = len(self.disk.index)
+                stats["disk_capacity"] = self.disk.capacity
+        return stats
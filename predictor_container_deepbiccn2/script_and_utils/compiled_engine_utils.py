@@ -0,0 +1,206 @@
+import os
+import time
+
+import numpy as np
+import keras
+import tensorflow as tf
+
+PRECISIONS = ["float32", "float16", "bfloat16", "int8"]
+# Keras dtype policies of the reduced precision clones: weights stay float32, compute is reduced
+DTYPE_POLICIES = {"float16": "mixed_float16", "bfloat16": "mixed_bfloat16"}
+# Largest error allowed against the float32 model, relative to the largest reference output
+DEFAULT_TOLERANCES = {"float32": 1e-4, "float16": 1e-2, "bfloat16": 3e-2, "int8": 5e-2}
+
+
+def reference_inputs(n_sequences, seq_length, seed=0):
+    """
+    Returns a fixed (N, L, 4) one-hot batch of random sequences, the reference set of the accuracy check.
+    """
+    rng = np.random.default_rng(seed)
+    return np.eye(4, dtype=np.float32)[
+        rng.integers(0, 4, size=(n_sequences, seq_length))
+    ]
+
+
+def _clone_with_policy(model, dtype_policy):
+    # rebuilds every layer under the given dtype policy and copies the float32 weights over
+    def clone_layer(layer):
+        config = layer.get_config()
+        if not isinstance(layer, keras.layers.InputLayer):
+            config["dtype"] = dtype_policy
+        return layer.__class__.from_config(config)
+
+    clone = keras.models.clone_model(model, clone_function=clone_layer)
+    clone.set_weights(model.get_weights())
+    return clone
+
+
+class CompiledEngine:
+    """
+    Runs the model through graphs traced once per batch-size bucket with a fixed
+    (bucket, seq_length, 4) input signature, JIT compiled with XLA where it is available.
+    Batches are split over the buckets and the last part is padded up to one, so request
+    sizes never retrace a graph. float16 and bfloat16 run a mixed precision clone of the
+    model, int8 runs a TFLite model with dynamic-range int8 quantized weights.
+    """
+
+    def __init__(
+        self,
+        model,
+        precision="float32",
+        buckets=(1, 8, 32, 128, 256),
+        seq_length=2114,
+        xla=True,
+    ):
+        if precision not in PRECISIONS:
+            raise ValueError(
+                f"precision should be one of {PRECISIONS}, got {precision!r}"
+            )
+        self.model = model
+        self.precision = precision
+        self.buckets = sorted(set(buckets))
+        self.seq_length = seq_length
+        self.xla = xla
+        self.n_outputs = model.output_shape[-1]
+        self.build_time = None
+        self.accuracy = None
+        self._runners = {}
+        # zero-padded input per bucket, reused for the last partial batch
+        self._padded = {}
+
+    def _input_spec(self, batch_size):
+        return tf.TensorSpec((batch_size, self.seq_length, 4), tf.float32)
+
+    def _build_graphs(self, model, xla):
+        @tf.function(jit_compile=xla)
+        def forward(one_hot):
+            return tf.cast(model(one_hot, training=False), tf.float32)
+
+        for bucket in self.buckets:
+            graph = forward.get_concrete_function(self._input_spec(bucket))
+            # tracing is lazy for XLA, the first call compiles the bucket
+            graph(tf.zeros((bucket, self.seq_length, 4), tf.float32))
+            self._runners[bucket] = lambda batch, graph=graph: graph(
+                tf.constant(batch)
+            ).numpy()
+
+    def _build_tflite(self):
+        forward = tf.function(lambda one_hot: self.model(one_hot, training=False))
+        graph = forward.get_concrete_function(self._input_spec(None))
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([graph], self.model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        model_content = converter.convert()
+        # inference pool workers pin their thread count through TF_NUM_INTRAOP_THREADS
+        n_threads = int(os.environ.get("TF_NUM_INTRAOP_THREADS", 0)) or os.cpu_count()
+        for bucket in self.buckets:
+            # one interpreter per bucket, all sharing the quantized model
+            interpreter = tf.lite.Interpreter(
+                model_content=model_content, num_threads=n_threads
+            )
+            input_index = interpreter.get_input_details()[0]["index"]
+            interpreter.resize_tensor_input(
+                input_index, [bucket, self.seq_length, 4], strict=True
+            )
+            interpreter.allocate_tensors()
+            output_index = interpreter.get_output_details()[0]["index"]
+
+            def run(
+                batch,
+                interpreter=interpreter,
+                input_index=input_index,
+                output_index=output_index,
+            ):
+                interpreter.set_tensor(input_index, batch)
+                interpreter.invoke()
+                return interpreter.get_tensor(output_index)
+
+            self._runners[bucket] = run
+
+    def build(self):
+        """
+        Builds the precision variant and compiles every bucket.
+        """
+        start = time.perf_counter()
+        if self.precision == "int8":
+            self._build_tflite()
+        else:
+            model = self.model
+            if self.precision in DTYPE_POLICIES:
+                model = _clone_with_policy(self.model, DTYPE_POLICIES[self.precision])
+            try:
+                self._build_graphs(model, self.xla)
+            except Exception as e:
+                if not self.xla:
+                    raise
+                print(
+                    f"XLA compilation failed ({e}), tracing the {self.precision} graphs without it"
+                )
+                self.xla = False
+                self._runners = {}
+                self._build_graphs(model, False)
+        for bucket in self.buckets:
+            self._padded[bucket] = np.zeros(
+                (bucket, self.seq_length, 4), dtype=np.float32
+            )
+        self.build_time = time.perf_counter() - start
+        print(
+            f"Built the {self.precision} compiled engine for batch sizes {self.buckets} "
+            f"({'XLA' if self.xla and self.precision != 'int8' else 'no XLA'}) in {self.build_time:.2f}s"
+        )
+        return self
+
+    def _bucket_for(self, n_rows):
+        for bucket in self.buckets:
+            if bucket >= n_rows:
+                return bucket
+        return self.buckets[-1]
+
+    def predict(self, one_hot):
+        """
+        Returns the (N, C) float32 predictions of an encoded (N, seq_length, 4) batch.
+        """
+        predictions = np.empty((len(one_hot), self.n_outputs), dtype=np.float32)
+        start = 0
+        while start < len(one_hot):
+            bucket = self._bucket_for(len(one_hot) - start)
+            take = min(bucket, len(one_hot) - start)
+            batch = one_hot[start : start + take]
+            if take < bucket:
+                batch = self._padded[bucket]
+                batch[:take] = one_hot[start : start + take]
+                batch[take:] = 0
+            elif batch.dtype != np.float32 or not batch.flags.c_contiguous:
+                batch = np.ascontiguousarray(batch, dtype=np.float32)
+            predictions[start : start + take] = self._runners[bucket](batch)[:take]
+            start += take
+        return predictions
+
+    def check_accuracy(self, inputs, expected, tolerance=None):
+        """
+        Compares the engine's predictions of `inputs` against the float32 model's `expected` ones.
+        The engine passes if its largest error is within `tolerance` of the largest reference output.
+        """
+        tolerance = (
+            DEFAULT_TOLERANCES[self.precision] if tolerance is None else tolerance
+        )
+        actual = self.predict(inputs)
+        expected = np.asarray(expected, dtype=np.float32)
+        scale = max(float(np.abs(expected).max()), np.finfo(np.float32).tiny)
+        max_abs_error = float(np.abs(actual - expected).max())
+        self.accuracy = {
+            "reference_sequences": len(inputs),
+            "max_abs_error": max_abs_error,
+            "max_rel_error": max_abs_error / scale,
+            "tolerance": tolerance,
+            "passed": max_abs_error / scale <= tolerance,
+        }
+        return self.accuracy
+
+    def describe(self):
+        return {
+            "precision": self.precision,
+            "buckets": self.buckets,
+            "xla": self.xla and self.precision != "int8",
+            "build_time_s": self.build_time,
+            "accuracy": self.accuracy,
+        }
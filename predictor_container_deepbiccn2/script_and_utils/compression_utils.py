@@ -0,0 +1,312 @@
+import time
+import zlib
+
+from metrics_utils import METRICS
+
+try:  # the standard library has zstd from Python 3.14
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:  # fall back to the zstandard package when it is installed
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed messages are told apart from JSON ("{") and binary ("CRBN") ones by their first bytes
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Payloads are compressed and decompressed this many bytes at a time
+COMPRESSION_CHUNK_BYTES = 1024 * 1024
+# Compressed bytes given to the zstandard package per call, it has no output limit to check against
+_ZSTANDARD_INPUT_BYTES = 16 * 1024
+# Errors of malformed compressed data, reported as ValueError
+DECOMPRESSION_ERRORS = tuple(
+    [zlib.error, EOFError]
+    + ([zstd.ZstdError] if zstd is not None else [])
+    + ([zstandard.ZstdError] if zstandard is not None else [])
+)
+
+
+def available_codecs():
+    """
+    Returns the compression codecs this predictor can read and write, gzip is always available.
+    """
+    if zstd is not None or zstandard is not None:
+        return ["gzip", "zstd"]
+    return ["gzip"]
+
+
+def message_codec(prefix):
+    """
+    Returns "gzip" or "zstd" if a message starting with `prefix` is compressed, None otherwise.
+    """
+    prefix = bytes(prefix[: len(ZSTD_MAGIC)])
+    if prefix.startswith(GZIP_MAGIC):
+        return "gzip"
+    if prefix == ZSTD_MAGIC:
+        return "zstd"
+    return None
+
+
+def _compressor(codec, level=None):
+    # an object with compress(data) and flush(), both returning compressed bytes
+    if codec == "gzip":
+        return zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, 31
+        )
+    if codec != "zstd" or codec not in available_codecs():
+        raise ValueError(
+            f"compression should be one of {available_codecs()}, got {codec!r}"
+        )
+    if zstd is not None:
+        return zstd.ZstdCompressor(level=level)
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+
+
+def compress_payload(payload, codec, level=None, chunk_bytes=COMPRESSION_CHUNK_BYTES):
+    """
+    Compresses a payload `chunk_bytes` at a time and returns the list of compressed parts, which
+    are sent one after another so large payloads are never copied whole. The compression ratio,
+    the time taken (the "compress" stage) and the CPU time spent are recorded in the metrics.
+    """
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    compressor = _compressor(codec, level)
+    view = memoryview(payload)
+    parts = []
+    for offset in range(0, len(view), chunk_bytes):
+        part = compressor.compress(view[offset : offset + chunk_bytes])
+        if part:
+            parts.append(part)
+    parts.append(compressor.flush())
+    view.release()
+    METRICS.add("compress_cpu_seconds", time.thread_time() - cpu_start)
+    METRICS.observe("compress", time.perf_counter() - start)
+    compressed_bytes = sum(len(part) for part in parts)
+    METRICS.observe_ratio(f"{codec}_response", len(payload) / max(compressed_bytes, 1))
+    METRICS.add("uncompressed_bytes_out", len(payload))
+    METRICS.add("compressed_bytes_out", compressed_bytes)
+    return parts
+
+
+class Decompressor:
+    """
+    Incremental gzip or zstd decompressor that refuses to produce more than `max_bytes`,
+    so a small compressed message cannot expand past the largest accepted request.
+    Several gzip members or zstd frames in a row (e.g. concatenated or pigz output) are
+    decompressed one after another, data after them that is not another one is an error.
+    """
+
+    def __init__(self, codec, max_bytes):
+        self.codec = codec
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self._decompressor = self._new_decompressor()
+
+    def _new_decompressor(self):
+        if self.codec == "gzip":
+            return zlib.decompressobj(31)
+        if zstd is not None:
+            return zstd.ZstdDecompressor()
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def _member_done(self):
+        # the current gzip member or zstd frame is complete
+        return getattr(self._decompressor, "eof", False)
+
+    def _decompress_zstandard(self, data, limit):
+        # stops once the output reaches `limit`, the zstandard package cannot cap it itself
+        parts = []
+        for offset in range(0, len(data), _ZSTANDARD_INPUT_BYTES):
+            parts.append(
+                self._decompressor.decompress(
+                    data[offset : offset + _ZSTANDARD_INPUT_BYTES]
+                )
+            )
+            limit -= len(parts[-1])
+            if limit <= 0:
+                break
+        return b"".join(parts)
+
+    def decompress(self, data):
+        # one byte more than allowed tells a message at the limit from one past it
+        limit = self.max_bytes - self.n_bytes + 1
+        parts = []
+        try:
+            while True:
+                if self._member_done():
+                    # the next member starts with the bytes the finished one left over
+                    leftover = getattr(self._decompressor, "unused_data", b"")
+                    data = bytes(leftover) + bytes(data)
+                    if not data:
+                        break
+                    self._decompressor = self._new_decompressor()
+                if self.codec == "gzip" or zstd is not None:
+                    parts.append(self._decompressor.decompress(data, limit))
+                else:
+                    parts.append(self._decompress_zstandard(data, limit))
+                limit -= len(parts[-1])
+                data = b""
+                if limit <= 0 or not self._member_done():
+                    break
+        except DECOMPRESSION_ERRORS as e:
+            raise ValueError(
+                f"{self.codec} request could not be decompressed: {e}"
+            ) from None
+        decompressed = b"".join(parts)
+        self.n_bytes += len(decompressed)
+        if self.n_bytes > self.max_bytes:
+            raise ValueError(
+                f"decompressed request exceeds the maximum message size of {self.max_bytes} bytes"
+            )
+        return decompressed
+
+    @property
+    def eof(self):
+        return getattr(self._decompressor, "eof", True)
+
+
+class DecompressingReader:
+    """
+    Reads a compressed message of `n_bytes` from the socket like a socket: recv_into fills a buffer
+    with decompressed bytes and returns 0 at the end of the message. Compressed bytes are received
+    and decompressed as they are needed, so a large request is decompressed while it arrives.
+    `prefix` holds compressed bytes already received. Malformed or unsupported compressed data
+    raises ValueError, call `drain` afterwards so the connection stays at a message boundary.
+    The ratio, decompression time and CPU time of the message are recorded in the metrics once
+    it is read whole.
+    """
+
+    def __init__(
+        self,
+        client_socket,
+        n_bytes,
+        prefix,
+        codec,
+        max_bytes,
+        progress=None,
+        progress_step=0,
+        window=COMPRESSION_CHUNK_BYTES,
+    ):
+        self.socket = client_socket
+        self.codec = codec
+        # compressed bytes still to be received, and received so far
+        self.remaining = n_bytes
+        self.received = 0
+        self.progress = progress
+        self.progress_step = progress_step
+        self.reported = 0
+        self.window = bytearray(window)
+        self.compressed_bytes = len(prefix)
+        # time spent decompressing, excluding the waits for the socket
+        self.decompress_time = 0.0
+        self.cpu_time = 0.0
+        # unsupported codecs are reported when the message is read, like malformed data
+        self.decompressor = (
+            Decompressor(codec, max_bytes) if codec in available_codecs() else None
+        )
+        # compressed bytes received with the prefix, decompressed by the first read
+        self.prefix = bytes(prefix)
+        self.pending = memoryview(b"")
+        self.pending_pos = 0
+        self.recorded = False
+
+    def _decompress(self, data):
+        if self.decompressor is None:
+            raise ValueError(
+                f"{self.codec} compressed requests are not supported, send one of {available_codecs()}"
+            )
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            return self.decompressor.decompress(data)
+        finally:
+            self.cpu_time += time.thread_time() - cpu_start
+            self.decompress_time += time.perf_counter() - start
+
+    def _receive(self):
+        # receives and decompresses the next compressed window, returns False at the end of the message
+        while True:
+            if self.prefix is not None:
+                self.pending = memoryview(self._decompress(self.prefix))
+                self.pending_pos = 0
+                self.prefix = None
+                if len(self.pending):
+                    return True
+                continue
+            if self.remaining == 0:
+                if not self.decompressor.eof:
+                    raise ValueError(f"{self.codec} request is truncated")
+                self._record()
+                return False
+            n_bytes = self.socket.recv_into(
+                memoryview(self.window)[: min(len(self.window), self.remaining)]
+            )
+            if n_bytes == 0:
+                raise ConnectionError(
+                    "connection closed before the request was complete"
+                )
+            self.remaining -= n_bytes
+            self.received += n_bytes
+            self.compressed_bytes += n_bytes
+            if self.progress is not None and (
+                self.received - self.reported >= self.progress_step
+                or self.remaining == 0
+            ):
+                self.progress.update(self.received - self.reported)
+                self.reported = self.received
+            self.pending = memoryview(
+                self._decompress(memoryview(self.window)[:n_bytes])
+            )
+            self.pending_pos = 0
+            if len(self.pending):
+                return True
+
+    def _record(self):
+        if self.recorded:
+            return
+        self.recorded = True
+        METRICS.observe("decompress", self.decompress_time)
+        METRICS.add("decompress_cpu_seconds", self.cpu_time)
+        METRICS.observe_ratio(
+            f"{self.codec}_request",
+            self.decompressor.n_bytes / max(self.compressed_bytes, 1),
+        )
+        METRICS.add("compressed_bytes_in", self.compressed_bytes)
+        METRICS.add("uncompressed_bytes_in", self.decompressor.n_bytes)
+
+    def recv_into(self, buffer):
+        while self.pending_pos == len(self.pending):
+            if not self._receive():
+                return 0
+        n_bytes = min(len(buffer), len(self.pending) - self.pending_pos)
+        buffer[:n_bytes] = self.pending[self.pending_pos : self.pending_pos + n_bytes]
+        self.pending_pos += n_bytes
+        return n_bytes
+
+    def read_all(self):
+        """
+        Returns the rest of the decompressed message as one bytearray.
+        """
+        parts = [self.pending[self.pending_pos :]]
+        while self._receive():
+            parts.append(self.pending)
+        self.pending_pos = len(self.pending)
+        return bytearray(b"".join(parts))
+
+    def drain(self):
+        """
+        Receives and drops the rest of the compressed message without decompressing it.
+        """
+        view = memoryview(self.window)
+        while self.remaining:
+            n_bytes = self.socket.recv_into(
+                view[: min(len(self.window), self.remaining)]
+            )
+            if n_bytes == 0:
+                break
+            self.remaining -= n_bytes
+            self.received += n_bytes
+        if self.progress is not None and self.received > self.reported:
+            self.progress.update(self.received - self.reported)
+            self.reported = self.received
@@ -2,14 +2,51 @@
 import os
 import sys
 import json
+import time
 import tqdm
 import struct
 import socket
+import threading
+from contextlib import contextmanager
 import numpy as np
 
 from error_message_functions_updated import *
 from api_preprocessing_utils import *
-from crested_utils import predict_crested, get_cell_type_index
+from crested_utils import (
+    predict_crested,
+    predict_tiled,
+    predict_mutagenesis,
+    mutagenesis_mutations,
+    predict_sequences,
+    get_cell_type_index,
+    get_model_registry,
+    get_model_catalog,
+    init_model_registry,
+    init_inference_pool,
+    AUTOTUNE_MAX_BATCH_SIZE,
+)
+from batching_utils import MicroBatcher
+from cache_utils import PredictionCache
+from metrics_utils import METRICS
+from genome_utils import open_genome, resolve_regions
+from pipeline_utils import ConnectionPipeline
+from scheduling_utils import CancelToken
+from compression_utils import (
+    DecompressingReader,
+    available_codecs,
+    compress_payload,
+    message_codec,
+)
+from protocol_utils import (
+    recv_into_buffer,
+    loads_buffer,
+    dumps_bytes,
+    is_binary_message,
+    BINARY_MAGIC,
+    IncrementalJsonReader,
+    decode_binary_request,
+    encode_binary_response,
+)
 
 # Get the absolute path of the script's directory
 MODEL_NAME = "DeepBICCN2"
@@ -28,37 +65,118 @@ else:
     PREDICTOR_CONTAINER_DIR = os.path.dirname(SCRIPT_DIR)
     HELP_FILE = os.path.join(SCRIPT_DIR, "predictor_help_message.json")
 
-# Set buffer size for TCP
-BUFFER_SIZE = 65536
-
-
-def recv_message_loop(client_socket):
+# Largest request accepted from an Evaluator, larger length prefixes are rejected before allocating
+MAX_MESSAGE_BYTES = int(os.environ.get("PREDICTOR_MAX_MESSAGE_BYTES", 1 << 30))
+# Update the receive progress bar once per this many bytes instead of per packet
+PROGRESS_STEP = 16 * 1024 * 1024
+# JSON requests of at least this many bytes are parsed while they are received instead of
+# after being buffered whole (0 parses every JSON request that way)
+STREAM_PARSE_BYTES = int(
+    os.environ.get("PREDICTOR_STREAM_PARSE_BYTES", 64 * 1024 * 1024)
+)
+
+# Concurrency limits, configurable through the container environment
+# MAX_CONNECTIONS: Evaluator connections served at the same time
+# MAX_INFLIGHT_REQUESTS: requests allowed into the model at the same time
+# PIPELINE_WINDOW: requests of one connection served at the same time, the next ones are
+# received and validated while earlier ones are in inference (1 serves them one by one)
+MAX_CONNECTIONS = int(os.environ.get("PREDICTOR_MAX_CONNECTIONS", 16))
+MAX_INFLIGHT_REQUESTS = int(os.environ.get("PREDICTOR_MAX_INFLIGHT_REQUESTS", 16))
+PIPELINE_WINDOW = int(os.environ.get("PREDICTOR_PIPELINE_WINDOW", 4))
+connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+inflight_requests = threading.BoundedSemaphore(MAX_INFLIGHT_REQUESTS)
+
+# Micro-batching of sequences across concurrent requests
+# BATCH_SIZE: sequences per forward pass, "auto" times candidate sizes at startup and keeps the
+# fastest one within the autotuning memory ceiling (AUTOTUNE_BATCH_SIZE)
+# BATCH_MAX_WAIT_MS: how long a partial batch waits for more sequences before it is flushed
+# SMALL_REQUEST_SEQUENCES: requests up to this size are batched before bulk requests,
+# which take turns per connection (0 uses the batch size)
+AUTOTUNE_BATCH_SIZE = os.environ.get("PREDICTOR_BATCH_SIZE", "256") == "auto"
+BATCH_SIZE = (
+    AUTOTUNE_MAX_BATCH_SIZE
+    if AUTOTUNE_BATCH_SIZE
+    else int(os.environ.get("PREDICTOR_BATCH_SIZE", 256))
+)
+BATCH_MAX_WAIT_MS = float(os.environ.get("PREDICTOR_BATCH_MAX_WAIT_MS", 5))
+SMALL_REQUEST_SEQUENCES = int(os.environ.get("PREDICTOR_SMALL_REQUEST_SEQUENCES", 0))
+batcher = None
+
+# Optional pool of inference worker processes, each with its own copy of the model
+# INFERENCE_WORKERS: number of worker processes (0 runs the model in the server process)
+# INTRA_OP_THREADS / INTER_OP_THREADS: TensorFlow thread pools of every worker (0 keeps the defaults)
+INFERENCE_WORKERS = int(os.environ.get("PREDICTOR_INFERENCE_WORKERS", 0))
+INTRA_OP_THREADS = int(os.environ.get("PREDICTOR_INTRA_OP_THREADS", 0))
+INTER_OP_THREADS = int(os.environ.get("PREDICTOR_INTER_OP_THREADS", 0))
+
+# Prediction cache, keyed by model and final model-input sequence
+# CACHE_BYTES: budget of the in-memory LRU tier (0 disables it)
+# CACHE_DIR: directory of the persistent memory-mapped tier (unset disables it)
+# CACHE_DISK_ENTRIES: number of predictions the persistent tier holds
+CACHE_BYTES = int(os.environ.get("PREDICTOR_CACHE_BYTES", 256 * 1024 * 1024))
+CACHE_DIR = os.environ.get("PREDICTOR_CACHE_DIR", "")
+CACHE_DISK_ENTRIES = int(os.environ.get("PREDICTOR_CACHE_DISK_ENTRIES", 1_000_000))
+prediction_cache = None
+
+# Genome FASTA (with its .fai index) or .2bit file mounted into the container,
+# lets Evaluators send "regions" instead of sequences (unset disables it)
+GENOME_PATH = os.environ.get("PREDICTOR_GENOME", "")
+genome = None
+
+# Sequences per frame when an Evaluator asks for a streamed response ("stream": true)
+STREAM_CHUNK_SIZE = int(os.environ.get("PREDICTOR_STREAM_CHUNK_SIZE", 4096))
+
+# Response compression, negotiated per connection by a request's "compression" field
+# COMPRESSION_LEVEL: gzip or zstd level of the responses (unset uses each codec's default)
+# COMPRESSION_MIN_BYTES: smaller responses are sent uncompressed, Evaluators tell them apart by their first bytes
+COMPRESSION_LEVEL = os.environ.get("PREDICTOR_COMPRESSION_LEVEL")
+COMPRESSION_LEVEL = int(COMPRESSION_LEVEL) if COMPRESSION_LEVEL else None
+COMPRESSION_MIN_BYTES = int(os.environ.get("PREDICTOR_COMPRESSION_MIN_BYTES", 1024))
+
+
+def recv_message_loop(client_socket, pipeline):
     # Step 1: Receive total bytes (length) of the Evaluator's request
     # Step 2: Receive file from Evaluator
+    # Step 3: Hand the request to the connection's pipeline and receive the next one
+    # Returns False if the Evaluator reset the connection, True when its stream ended
+    # (including a half-close after its last request) or the connection is closed on our side
 
     # ---------------------- Receive Evaluator JSON ----------------------
     while True:
-        # Initialize data to store a new message on each iteration
-        json_data_recv = b""
         # Before receiving JSON from Evaluator
         # Receive length of the incoming JSON message (4-byte integer)
-        # Can change to 8-byte integer by changing .recv(4) to .recv(8)
+        # Can change to 8-byte integer by changing bytearray(4) to bytearray(8)
         # and replacing format string '>I' to '>Q'
         # Step 1
         try:
-            msg_length = client_socket.recv(4)
-            if not msg_length:
+            msg_length = bytearray(4)
+            n_received = recv_into_buffer(client_socket, msg_length)
+            if n_received == 0:
                 print("Failed to receive message length. Closing connection.")
-                client_socket.close()
                 break  # Exit the loop if no message length is received
+            if n_received < len(msg_length):
+                print("Data received was incomplete or corrupted.")
+                break
 
             # Unpack message length from 4 bytes
             msglen = struct.unpack(">I", msg_length)[0]
             print(f"Expecting {msglen} bytes of data from the Evaluator.")
+            if msglen > MAX_MESSAGE_BYTES:
+                # Reject before allocating, the rest of the message is not read so the connection is closed
+                json_string = json.dumps(
+                    {
+                        "bad_prediction_request": [
+                            f"request of {msglen} bytes exceeds the maximum message size of {MAX_MESSAGE_BYTES} bytes"
+                        ]
+                    }
+                )
+                jsonResult_error_bytes = json_string.encode("utf-8")
+                pipeline.send_now(jsonResult_error_bytes)
+                break
 
             # Initialize the progress bar
             progress = tqdm.tqdm(
-                range(msglen),
+                total=msglen,
                 unit="B",
                 desc="Receiving Evaluator Request(s)",
                 unit_scale=True,
@@ -66,360 +184,811 @@ def recv_message_loop(client_socket):
             )
 
             # Step 2
-            # Now we want to receive the actual JSON in packets
-            while len(json_data_recv) < msglen:
-                packet = client_socket.recv(BUFFER_SIZE)
-                if not packet:
-                    print("Connection closed unexpectedly.")
-                    break
-                json_data_recv += packet
-                progress.update(len(packet))
-                # print(f"Received packet of {len(packet)} bytes, total received: {len(data)} bytes")
+            receive_start = time.perf_counter()
+            # The first bytes tell binary requests from JSON ones, and compressed requests from both
+            message_prefix = bytearray(min(len(BINARY_MAGIC), msglen))
+            n_received = recv_into_buffer(client_socket, message_prefix, progress)
+            parse_error = None
+            codec = message_codec(message_prefix)
+            if codec is not None:
+                # Compressed requests are decompressed as they arrive, the decompressed
+                # message is then read from `source` instead of the socket
+                source = DecompressingReader(
+                    client_socket,
+                    msglen - n_received,
+                    message_prefix,
+                    codec,
+                    MAX_MESSAGE_BYTES,
+                    progress,
+                    PROGRESS_STEP,
+                )
+                message_prefix = bytearray(len(BINARY_MAGIC))
+                try:
+                    message_prefix = message_prefix[
+                        : recv_into_buffer(source, message_prefix)
+                    ]
+                except ValueError as e:
+                    parse_error = f"request could not be parsed: {e}"
+                    source.drain()
+            stream_parse = (
+                parse_error is None
+                and msglen >= STREAM_PARSE_BYTES
+                and not is_binary_message(message_prefix)
+            )
+            if stream_parse:
+                # Parse large JSON requests as they arrive, the payload is never buffered whole
+                reader = IncrementalJsonReader(
+                    client_socket if codec is None else source,
+                    msglen - n_received if codec is None else None,
+                    message_prefix,
+                    progress if codec is None else None,
+                    PROGRESS_STEP,
+                )
+                try:
+                    evaluator_json = reader.parse()
+                except ValueError as e:
+                    # Skip the rest of the message so the connection stays usable
+                    parse_error = f"request could not be parsed: {e}"
+                    (reader if codec is None else source).drain()
+                n_received += reader.received if codec is None else source.received
+                del reader
+            elif codec is not None:
+                if parse_error is None:
+                    try:
+                        json_data_recv = message_prefix + source.read_all()
+                    except ValueError as e:
+                        parse_error = f"request could not be parsed: {e}"
+                        source.drain()
+                n_received += source.received
+            else:
+                # Receive the actual JSON straight into one preallocated buffer
+                json_data_recv = bytearray(msglen)
+                json_data_recv[: len(message_prefix)] = message_prefix
+                n_received += recv_into_buffer(
+                    client_socket,
+                    memoryview(json_data_recv)[len(message_prefix) :],
+                    progress,
+                    PROGRESS_STEP,
+                )
+            METRICS.observe("receive", time.perf_counter() - receive_start)
+            METRICS.add("bytes_in", len(msg_length) + n_received)
 
             # Close the progress bar when done
             progress.close()
 
             # Decode and display the received data if all of it is received
-            if len(json_data_recv) == msglen:
+            if n_received == msglen:
                 print("Evaluator request received completely")
                 pass
             else:
+                print("Connection closed unexpectedly.")
                 print("Data received was incomplete or corrupted.")
                 break
         except Exception as e:
             print(f"Error while receiving data: {e}")
-            client_socket.close()
-            break  # Break the loop on exception
+            # a reset connection cannot take the replies of the requests in flight anymore
+            return not isinstance(e, (ConnectionResetError, ConnectionAbortedError))
 
         # ---------------------- Process Received JSON ----------------------
-        evaluator_request_full = json_data_recv
-        evaluator_json = evaluator_request_full.decode("utf-8")
-        evaluator_json = json.loads(evaluator_json)
-
-        # group these functions
-        json_return_error = {"bad_prediction_request": []}
-
-        # if only a "help" was requested return the predictor information file
-        if evaluator_json["request"] == "help":
-            # model builder should place help file in predictor folder
-            help_file = HELP_FILE
-            print(f"Help requested! Sending {HELP_FILE}...")
-            jsonResult_help = json.load(open(help_file))
-
-            jsonResult_help = json.dumps(jsonResult_help)
+        # Requests starting with the binary protocol magic get a binary prediction response
+        METRICS.add("requests")
+        parse_start = time.perf_counter()
+        binary_mode = is_binary_message(message_prefix)
+        if parse_error is None and not stream_parse:
+            # Parse directly from the receive buffer, no bytes/str copies of the payload
+            # (streamed requests are already parsed while receiving)
             try:
-                jsonResult_help_bytes = jsonResult_help.encode("utf-8")
-                jsonResult_help_total_bytes = len(jsonResult_help_bytes)
-                client_socket.sendall(struct.pack(">I", jsonResult_help_total_bytes))
-                client_socket.sendall(jsonResult_help_bytes)
+                if binary_mode:
+                    evaluator_json = decode_binary_request(json_data_recv)
+                else:
+                    evaluator_json = loads_buffer(json_data_recv)
+            except (ValueError, KeyError, TypeError) as e:
+                parse_error = (
+                    f"binary request could not be decoded: {e}"
+                    if binary_mode
+                    else f"request could not be parsed: {e}"
+                )
+            del json_data_recv
+            METRICS.observe("parse", time.perf_counter() - parse_start)
+        if parse_error is not None:
+            # Requests that could not be read, streamed or not, get the same reply,
+            # the rest of a streamed or compressed message was skipped
+            json_string = json.dumps({"bad_prediction_request": [parse_error]})
+            if pipeline.send_now(json_string.encode("utf-8")):
                 continue
-            except socket.error as e:
-                print("server_error: Error sending help response: %s" % e)
-                # finally:
-                client_socket.close()
-                # server.close()
-                print("Connection to client closed")
-                # sys.exit(0)
-
-        # --- MODEL-SPECIFIC: Determine readout type ---
-        readout_type = evaluator_json.get("readout", "point")
-        is_point_readout = readout_type == "point"
-
-        # re-usable error checking functions
-        json_return_error = check_mandatory_keys(
-            evaluator_json.keys(), json_return_error
+            break
+
+        # Step 3
+        # Responses carry the request's "request_id" if it sent one,
+        # those may come back out of order
+        request_id = (
+            evaluator_json.get("request_id")
+            if isinstance(evaluator_json, dict)
+            else None
         )
-        json_return_error = check_request(evaluator_json["request"], json_return_error)
-        json_return_error = check_prediction_task_mandatory_keys(
-            evaluator_json["prediction_tasks"], json_return_error
+        # A supported "compression" compresses this and later responses on the connection,
+        # "none" turns it off again, other values are reported by the request validation
+        compression = (
+            evaluator_json.get("compression")
+            if isinstance(evaluator_json, dict)
+            else None
         )
-        # if any of the mandatory keys are missing immediately return an error to the evaluator
-        if any(json_return_error.values()) == True:
-            json_string = json.dumps(json_return_error)
+        if compression == "none":
+            pipeline.compression = None
+        elif compression in available_codecs():
+            pipeline.compression = compression
+        # the request's deadline counts from when it started arriving
+        reply = pipeline.reply(request_id, CancelToken(receive_start))
+        pipeline.submit(serve_request, reply, evaluator_json, binary_mode)
+        if pipeline.failed.is_set():
+            break
+    return True
+
+
+def serve_request(reply, evaluator_json, binary_mode):
+    """
+    Validates and serves one parsed request, its responses are sent through `reply`.
+    Returns False if the connection to the Evaluator has to be closed.
+    """
+    # group these functions
+    json_return_error = {"bad_prediction_request": []}
+
+    # hosted model serving the request, the default model unless "model" names another one
+    model_catalog = get_model_catalog()
+    model_name = model_catalog.resolve(evaluator_json.get("model"))
+
+    # if only a "help" was requested return the predictor information file
+    if evaluator_json["request"] == "help":
+        if model_name is None:
+            json_return_error = check_key_values_model(
+                evaluator_json["model"], model_catalog.names(), json_return_error
+            )
             try:
-                jsonResult_error_bytes = json_string.encode("utf-8")
-                jsonResult_error_total_bytes = len(jsonResult_error_bytes)
-                client_socket.sendall(struct.pack(">I", jsonResult_error_total_bytes))
-                client_socket.sendall(jsonResult_error_bytes)
-                continue
+                reply.send(json.dumps(json_return_error).encode("utf-8"))
+                return True
             except socket.error as e:
                 print("server_error: Error sending error response: %s" % e)
-                # finally:
-                client_socket.close()
-                # server.close()
-                print("Connection to client closed")
-                # sys.exit(1)
-                break
+                return False
+        # model builder should place help file in predictor folder,
+        # or a <name>_help_message.json next to each hosted model
+        model_registry = model_catalog.registry(model_name)
+        print(f"Help requested! Sending {model_registry.help_path}...")
+        jsonResult_help = dict(model_registry.help_metadata or {"model": model_name})
+        if len(model_catalog.names()) > 1:
+            jsonResult_help["hosted_models"] = model_catalog.names()
+
+        jsonResult_help = json.dumps(jsonResult_help)
+        try:
+            jsonResult_help_bytes = jsonResult_help.encode("utf-8")
+            reply.send(jsonResult_help_bytes)
+            return True
+        except socket.error as e:
+            print("server_error: Error sending help response: %s" % e)
+            return False
+
+    # return the prediction cache hit, miss and eviction counters
+    if evaluator_json["request"] == "cache_stats":
+        cache_stats = (
+            prediction_cache.stats()
+            if prediction_cache is not None
+            else {"enabled": False}
+        )
+        print("Cache statistics requested!")
+        try:
+            jsonResult_cache_bytes = json.dumps(cache_stats).encode("utf-8")
+            reply.send(jsonResult_cache_bytes)
+            return True
+        except socket.error as e:
+            print("server_error: Error sending cache statistics: %s" % e)
+            return False
+
+    # return per-stage latency histograms, counters and gauges
+    # as JSON, or as Prometheus text with "format": "prometheus"
+    if evaluator_json["request"] == "metrics":
+        print("Metrics requested!")
+        cache_counters = (
+            prediction_cache.stats() if prediction_cache is not None else {}
+        )
+        if evaluator_json.get("format") == "prometheus":
+            jsonResult_metrics_bytes = METRICS.prometheus_text(
+                {
+                    f"cache_{name}": value
+                    for name, value in cache_counters.items()
+                    if name in prediction_cache.counters
+                }
+            ).encode("utf-8")
         else:
-            json_return_error = check_key_values_readout(
-                evaluator_json["readout"], json_return_error
-            )
-            json_return_error = check_prediction_task_name(
-                evaluator_json["prediction_tasks"], json_return_error
-            )
-            json_return_error = check_prediction_task_type(
-                evaluator_json["prediction_tasks"], json_return_error
-            )
-            json_return_error = check_prediction_task_cell_type(
-                evaluator_json["prediction_tasks"], json_return_error
+            metrics = METRICS.snapshot()
+            metrics["cold_start"] = get_model_registry().timings()
+            metrics["loaded_models"] = model_catalog.loaded()
+            metrics["cache"] = cache_counters
+            jsonResult_metrics_bytes = json.dumps(metrics).encode("utf-8")
+        try:
+            reply.send(jsonResult_metrics_bytes)
+            return True
+        except socket.error as e:
+            print("server_error: Error sending metrics: %s" % e)
+            return False
+
+    # --- MODEL-SPECIFIC: Determine readout type ---
+    readout_type = evaluator_json.get("readout", "point")
+    is_point_readout = readout_type == "point"
+
+    # re-usable error checking functions, run as a single pass over the request
+    # if any of the mandatory keys are missing only those errors are returned
+    # --- MODEL SPECIFIC: Ensure this CREsted Predictor only supports mus_musculus ---
+    # other hosted models support the species listed in their help metadata
+    supported_species = "mus_musculus"
+    if model_name is not None and model_name != model_catalog.default_model:
+        supported_species = (
+            model_catalog.registry(model_name).help_metadata or {}
+        ).get("species")
+    with METRICS.timer("validate"):
+        json_return_error = validate_request(
+            evaluator_json,
+            json_return_error,
+            supported_species=supported_species,
+            available_models=model_catalog.names(),
+            available_codecs=available_codecs(),
+        )
+
+    # if any errors were caught return them all to evaluator
+    if any(json_return_error.values()) == True:
+        METRICS.add("failed_requests")
+        json_string = json.dumps(json_return_error)
+        try:
+            jsonResult_error_bytes = json_string.encode("utf-8")
+            reply.send(jsonResult_error_bytes)
+            return True
+        except socket.error as e:
+            print("server_error: Error sending error response: %s" % e)
+            # sys.exit(1)
+            return False
+
+    # past its deadline the request is cancelled at the next inference chunk
+    if "deadline_ms" in evaluator_json:
+        reply.cancel_token.set_deadline(evaluator_json["deadline_ms"])
+
+    # ---------------------- Process Sequences and Prediction Ranges ----------------------
+    # Extract sequences to predict
+    # Check that the sequences meet model specifications
+    # Otherwise do any other formatting required for the model
+    METRICS.add("prediction_requests")
+    if "regions" in evaluator_json:
+        # read the regions from the mounted genome instead of receiving their sequences
+        json_return_error_model = {"prediction_request_failed": []}
+        if genome is None:
+            json_return_error_model["prediction_request_failed"].append(
+                "This predictor has no genome mounted, send 'sequences' instead of 'regions'"
             )
-            json_return_error = check_prediction_task_species(
-                evaluator_json["prediction_tasks"], json_return_error
+        else:
+            # regions are flanked like sequences, their length is checked before reading them
+            region_length = (
+                REQUIRED_SEQUENCE_LENGTH
+                - len(evaluator_json.get("upstream_seq", ""))
+                - len(evaluator_json.get("downstream_seq", ""))
             )
-            if "prediction_ranges" in evaluator_json.keys():
-                json_return_error = check_seq_ids(
-                    evaluator_json["prediction_ranges"],
-                    evaluator_json["sequences"],
-                    json_return_error,
-                )
-                json_return_error = check_prediction_ranges(
-                    evaluator_json["prediction_ranges"], json_return_error
-                )
-
-            if (
-                "upstream_seq" in evaluator_json.keys()
-                or "downstream_seq" in evaluator_json.keys()
-            ):
-                json_return_error = check_key_values_upstream_flank(
-                    evaluator_json["upstream_seq"], json_return_error
+            with METRICS.timer("regions"):
+                evaluator_json["sequences"] = resolve_regions(
+                    genome,
+                    evaluator_json["regions"],
+                    json_return_error_model,
+                    region_length,
+                    tiled=evaluator_json.get("tile_stride") is not None,
                 )
-            if "downstream_seq" in evaluator_json.keys():
-                json_return_error = check_key_values_downstream_flank(
-                    evaluator_json["downstream_seq"], json_return_error
-                )
-
-            # --- MODEL SPECIFIC: Ensure this CREsted Predictor only supports mus_musculus ---
-            for task in evaluator_json["prediction_tasks"]:
-                if task.get("species", "").lower() != "mus_musculus":
-                    json_return_error["bad_prediction_request"].append(
-                        f"This predictor only supports species: mus_musculus. Received '{task.get('species')}' for task '{task.get('name')}'."
-                    )
-                    break
-
-            # if any errors were caught return them all to evaluator
-            if any(json_return_error.values()) == True:
-                json_string = json.dumps(json_return_error)
-                try:
-                    jsonResult_error_bytes = json_string.encode("utf-8")
-                    jsonResult_error_total_bytes = len(jsonResult_error_bytes)
-                    client_socket.sendall(
-                        struct.pack(">I", jsonResult_error_total_bytes)
-                    )
-                    client_socket.sendall(jsonResult_error_bytes)
-                    continue
-                except socket.error as e:
-                    print("server_error: Error sending error response: %s" % e)
-                    # finally:
-                    client_socket.close()
-                    # server.close()
-                    print("Connection to client closed")
-                    # sys.exit(1)
-                    break
-
-        # ---------------------- Process Sequences and Prediction Ranges ----------------------
-        # Extract sequences to predict
-        # Check that the sequences meet model specifications
-        # Otherwise do any other formatting required for the model
-        sequences = evaluator_json["sequences"]
-
-        # --- Add upstream and downstream flanking sequences, if provided by the evaluator ---
-        # Default to empty string if not provided
-        upstream_seq = evaluator_json.get("upstream_seq", "")
-        downstream_seq = evaluator_json.get("downstream_seq", "")
-        if upstream_seq or downstream_seq:
-            print(
-                f"Applying flanking:\
-                    \n+{len(upstream_seq)} bases upstream,\
-                    \n+{len(downstream_seq)} bases downstream"
-            )
-            for seq_id, sequence in tqdm.tqdm(
-                sequences.items(),
-                desc="Flanking sequences",
-                unit="sequence",
-                total=len(sequences),
-                dynamic_ncols=True,
-            ):
-                flanked = f"{upstream_seq}{sequence}{downstream_seq}"
-                sequences[seq_id] = flanked
-
-        # Can add any additional error checking functions here
-        json_return_error_model = {"prediction_request_failed": []}
-        json_return_error_model = check_seqs_specifications(
-            sequences, json_return_error_model
-        )
-
-        # --- Process prediction_ranges if provided ---
-        if "prediction_ranges" in evaluator_json:
-            prediction_ranges = evaluator_json["prediction_ranges"]
-            for seq_id, pr in prediction_ranges.items():
-                # Only process non-empty ranges
-                if pr:
-                    # Unpack start and end indices
-                    start, end = pr
-                    # Check that the end index does not exceed sequence length
-                    if end >= len(sequences[seq_id]):
-                        json_return_error_model["prediction_request_failed"].append(
-                            f"Prediction range for '{seq_id}' exceeds the sequence length!"
-                        )
-                    else:
-                        # Slice the sequence. `prediction_range` is start, end inclusive
-                        sequences[seq_id] = sequences[seq_id][start : end + 1]
-                        print(
-                            f"Sequence '{seq_id}' trimmed to prediction range [{start}, {end}]."
-                        )
-
-        # if anything is caught don't run the model and return to evaluator to fix
         if any(json_return_error_model.values()) == True:
-            json_string = json.dumps(json_return_error_model)
-            try:
-                jsonResult_bytes = json_string.encode("utf-8")
-                jsonResults_total_bytes = len(jsonResult_bytes)
-                client_socket.sendall(struct.pack(">I", jsonResults_total_bytes))
-                client_socket.sendall(jsonResult_bytes)
-                continue
-            except socket.error as e:
-                print("server_error: Error sending error response: %s" % e)
-                # finally:
-                client_socket.close()
-                # server.close()
-                print("Connection to client closed")
-                # sys.exit(1)
-                break
-
-            # ---------------------- Extract Prediction Tasks and Run the Model ----------------------
-            # Start big loop here for all the prediction_tasks
-            # Connect to cell type matching container in cases of multi-task models
-            # cell_type_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            # cell_type_socket.connect((cell_type_matcher_ip, cell_type_matcher_port))
-
-        task_predictions = predict_crested(
-            sequences
-        )  # return predictions over all cell types {seq_id: [[preds]]}
-        cell_type_mapping = get_cell_type_index()
-
-        # --- ADDITION: Early bail-out if model returns error or cell type is not found---
-        # Send the error to client and close this client
-        def _send_error_and_continue(client_socket, errors):
-            """
-            Helper to package up a list of error messages and send them back to the Evaluator.
-            Returns True if it sent (so caller should `continue`), False on socket error.
-            """
-            payload = {"prediction_request_failed": errors}
-            js = json.dumps(payload).encode("utf-8")
+            METRICS.add("failed_requests")
             try:
-                client_socket.sendall(struct.pack(">I", len(js)))
-                client_socket.sendall(js)
-                print(
-                    "Sent prediction error back; closing connection with this Evaluator"
-                )
+                reply.send(json.dumps(json_return_error_model).encode("utf-8"))
                 return True
             except socket.error as e:
-                print(f"server_error: Error sending error response: {e}")
-                client_socket.close()
-                print("Connection to client closed")
+                print("server_error: Error sending error response: %s" % e)
                 return False
+    sequences = evaluator_json["sequences"]
+
+    # --- Add upstream and downstream flanking sequences, if provided by the evaluator ---
+    # Default to empty string if not provided
+    upstream_seq = evaluator_json.get("upstream_seq", "")
+    downstream_seq = evaluator_json.get("downstream_seq", "")
+    if upstream_seq or downstream_seq:
+        print(
+            f"Applying flanking:\
+                \n+{len(upstream_seq)} bases upstream,\
+                \n+{len(downstream_seq)} bases downstream"
+        )
+        flank_start = time.perf_counter()
+        apply_flanks(sequences, upstream_seq, downstream_seq)
+        METRICS.observe("flank", time.perf_counter() - flank_start)
+
+    # Can add any additional error checking functions here
+    validate_sequences_start = time.perf_counter()
+    json_return_error_model = {"prediction_request_failed": []}
+    # tiled requests send long sequences that are cut into model-length windows here
+    tile_stride = evaluator_json.get("tile_stride")
+    json_return_error_model = check_seqs_specifications(
+        sequences, json_return_error_model, tiled=tile_stride is not None
+    )
+    is_mutagenesis = evaluator_json["request"] == "mutagenesis"
+    if is_mutagenesis:
+        json_return_error_model = check_mutagenesis_specifications(
+            sequences, evaluator_json, json_return_error_model, len(upstream_seq)
+        )
 
-        cell_type_errors = [
-            f"Cell type '{t['cell_type']}' not recognized."
-            for t in evaluator_json["prediction_tasks"]
-            if t["cell_type"] not in cell_type_mapping
-        ]
-        if isinstance(task_predictions, str):
-            cell_type_errors.append(task_predictions)
-        if cell_type_errors:
-            if not _send_error_and_continue(client_socket, cell_type_errors):
-                break
-            continue
-
-        # Now format predictions to API JSON structure
-        # Create JSON to return
-        json_return = {
-            "request": evaluator_json["request"],
-            # Prediction task is an array of objects for all requested tasks
-            "prediction_tasks": [],
-        }
-
-        # Loop through all the prediction tasks
-        for prediction_task in evaluator_json["prediction_tasks"]:
-            request_type = prediction_task["type"]
-            cell_type = prediction_task["cell_type"]
-            idx = cell_type_mapping.get(cell_type, None)
-            if idx is None:
-                # If the cell type is not found in the mapping, return an error
-                json_return_error["bad_prediction_request"].append(
-                    f"Cell type '{cell_type}' not recognized."
-                )
-                continue
-            formatted_preds = {}
-            for seq_id, preds in task_predictions.items():
-                raw = preds[idx]
-                if isinstance(raw, (np.generic, float, int)):
-                    formatted_preds[seq_id] = float(raw)
-                else:
-                    formatted_preds[seq_id] = raw.tolist()
-
-            # Cell type predictor container is running, send the predictor's cell type and evaluator cell type to it
-            # If you want to override the cell type container you can remove the following code
-            # Send the predictor and evaluator cell type
-            # cell_type_socket.sendall(b'Hello, cell type matcher dude!')
-            # cell_type_matcher_return = cell_type_socket.recv(1024)
-
-            # The following code will be model specific
-            # Sample point prediction model
-            # Model builders need to add the appropriate returns here
-
-            # Create structured response for the evaluator
-            current_prediction_task = {
-                "name": prediction_task["name"],
-                "type_requested": request_type,
-                "type_actual": request_type,  # If remapped, update this
-                "cell_type_requested": cell_type,
-                "cell_type_actual": cell_type,  # If remapped, update this
-                "species_requested": prediction_task["species"],
-                "species_actual": prediction_task["species"],
-                "predictions": formatted_preds,
-            }
+    # --- Process prediction_ranges if provided ---
+    if "prediction_ranges" in evaluator_json:
+        json_return_error_model = apply_prediction_ranges(
+            sequences, evaluator_json["prediction_ranges"], json_return_error_model
+        )
 
-            # Append results for current prediction task to the main JSON object
-            json_return["prediction_tasks"].append(current_prediction_task)
+    METRICS.observe(
+        "validate_sequences", time.perf_counter() - validate_sequences_start
+    )
 
-        # Convert dictionary to JSON object and send back to evaluator
-        json_string = json.dumps(json_return)
+    # if anything is caught don't run the model and return to evaluator to fix
+    if any(json_return_error_model.values()) == True:
+        METRICS.add("failed_requests")
+        json_string = json.dumps(json_return_error_model)
         try:
             jsonResult_bytes = json_string.encode("utf-8")
-            jsonResults_total_bytes = len(jsonResult_bytes)
-            client_socket.sendall(struct.pack(">I", jsonResults_total_bytes))
-            client_socket.sendall(jsonResult_bytes)
-            continue
+            reply.send(jsonResult_bytes)
+            return True
         except socket.error as e:
-            print("server_error: Error sending prediction response: %s" % e)
-            # finally:
-            client_socket.close()
-            # server.close()
-            print("Connection to client closed")
-            # sys.exit(0)
-            break
+            print("server_error: Error sending error response: %s" % e)
+            # sys.exit(1)
+            return False
+
+        # ---------------------- Extract Prediction Tasks and Run the Model ----------------------
+        # Start big loop here for all the prediction_tasks
+        # Connect to cell type matching container in cases of multi-task models
+        # cell_type_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # cell_type_socket.connect((cell_type_matcher_ip, cell_type_matcher_port))
+
+    cell_type_mapping = get_cell_type_index(model_name)
+    # cached predictions belong to the default model
+    cache = prediction_cache if model_name == model_catalog.default_model else None
+
+    # --- ADDITION: Early bail-out if model returns error or cell type is not found---
+    # Send the error to client and close this client
+    def _send_error_and_continue(errors):
+        """
+        Helper to package up a list of error messages and send them back to the Evaluator.
+        Returns True if it sent (so caller should `return True`), False on socket error.
+        """
+        METRICS.add("failed_requests")
+        payload = {"prediction_request_failed": errors}
+        js = json.dumps(payload).encode("utf-8")
+        try:
+            reply.send(js)
+            print("Sent prediction error back; closing connection with this Evaluator")
+            return True
+        except socket.error as e:
+            print(f"server_error: Error sending error response: {e}")
+            return False
+
+    cell_type_errors = [
+        f"Cell type '{t['cell_type']}' not recognized."
+        for t in evaluator_json["prediction_tasks"]
+        if t["cell_type"] not in cell_type_mapping
+    ]
+
+    # --- Streaming mode: send one frame per inference chunk followed by an end frame ---
+    if evaluator_json.get("stream", False):
+        # cell types have to be checked up front since frames go out as soon as they are ready
+        if cell_type_errors:
+            if not _send_error_and_continue(cell_type_errors):
+                return False
+            return True
+        with inflight_requests, track_inflight():
+            sent = stream_predictions(
+                reply,
+                evaluator_json,
+                sequences,
+                cell_type_mapping,
+                binary_mode,
+                model_name,
+                cache,
+            )
+        if not sent:
+            return False
+        return True
+
+    # All connections share the resident model, limit how many requests run inference at once
+    extra_fields = None
+    with inflight_requests, track_inflight():
+        if is_mutagenesis:
+            # mutants are built in the encoded reference, only their positions are listed here
+            positions = evaluator_json.get("mutagenesis_positions", {})
+            variants = evaluator_json.get("mutagenesis_variants", {})
+            mutations = {
+                seq_id: mutagenesis_mutations(
+                    sequence,
+                    positions.get(seq_id),
+                    variants.get(seq_id),
+                    len(upstream_seq),
+                    len(sequence) - len(downstream_seq),
+                )
+                for seq_id, sequence in sequences.items()
+            }
+            task_predictions = predict_mutagenesis(
+                sequences, mutations, cancel_token=reply.cancel_token, model=model_name
+            )  # return (seq_ids, reference and mutant delta rows, first row per sequence)
+        elif tile_stride is not None:
+            task_predictions = predict_tiled(
+                sequences,
+                tile_stride,
+                cancel_token=reply.cancel_token,
+                model=model_name,
+            )  # return (seq_ids, (W, C) window predictions, first window row per sequence)
+            extra_fields = {
+                "tile_stride": tile_stride,
+                "window_length": REQUIRED_SEQUENCE_LENGTH,
+            }
+        else:
+            task_predictions = predict_crested(
+                sequences,
+                batcher,
+                cache,
+                client=reply.client,
+                cancel_token=reply.cancel_token,
+                model=model_name,
+            )  # return (seq_ids, (N, C) predictions over all cell types)
+
+    if isinstance(task_predictions, str):
+        if reply.cancel_token.is_cancelled():
+            METRICS.add("cancelled_requests")
+        cell_type_errors.append(task_predictions)
+    if cell_type_errors:
+        if not _send_error_and_continue(cell_type_errors):
+            return False
+        return True
+
+    # Convert dictionary to JSON object and send back to evaluator
+    try:
+        with METRICS.timer("format"):
+            jsonResult_bytes = format_prediction_response(
+                evaluator_json,
+                task_predictions,
+                cell_type_mapping,
+                binary_mode,
+                extra_fields,
+            )
+        with METRICS.timer("send"):
+            reply.send(jsonResult_bytes)
+        return True
+    except socket.error as e:
+        print("server_error: Error sending prediction response: %s" % e)
+        # sys.exit(0)
+        return False
+
+    # # ---------------------- Close Connection Sockets ----------------------
+    # client_socket.close()
+    # print("Connection to client closed")
+    # # close server socket
+    # server.close()
+
+
+def send_payload(client_socket, payload):
+    # Send one length-prefixed message to the Evaluator,
+    # compressed payloads come as the list of their compressed parts
+    parts = payload if isinstance(payload, list) else [payload]
+    payload_length = sum(len(part) for part in parts)
+    client_socket.sendall(struct.pack(">I", payload_length))
+    for part in parts:
+        client_socket.sendall(part)
+    METRICS.add("bytes_out", 4 + payload_length)
+
+
+def compress_response(payload, codec):
+    # Compress a response with the codec the Evaluator negotiated, small ones are not worth it
+    if len(payload) < COMPRESSION_MIN_BYTES:
+        return payload
+    return compress_payload(payload, codec, COMPRESSION_LEVEL)
+
+
+@contextmanager
+def track_inflight():
+    # Count the requests currently inside inference for the metrics
+    METRICS.adjust_gauge("inflight_requests", 1)
+    try:
+        yield
+    finally:
+        METRICS.adjust_gauge("inflight_requests", -1)
+
+
+def format_prediction_response(
+    evaluator_json, task_predictions, cell_type_mapping, binary_mode, extra_fields=None
+):
+    """
+    Builds the response payload for (seq_ids, (N, C) predictions) as JSON bytes, or in the binary
+    protocol if the request was binary. `extra_fields` are added to the top level of the response.
+    Tiled and mutagenesis predictions come as (seq_ids, predictions, first row of every sequence)
+    and give every sequence a per-window track or its reference and mutant deltas.
+    """
+    seq_ids, predictions = task_predictions[:2]
+    row_offsets = task_predictions[2] if len(task_predictions) > 2 else None
+    is_mutagenesis = evaluator_json["request"] == "mutagenesis"
+    variants = evaluator_json.get("mutagenesis_variants", {})
+    # Now format predictions to API JSON structure
+    # Create JSON to return
+    json_return = {
+        "request": evaluator_json["request"],
+        # Prediction task is an array of objects for all requested tasks
+        "prediction_tasks": [],
+    }
+    if extra_fields:
+        json_return.update(extra_fields)
+
+    # serialized {seq_id: prediction} object per predicted column, shared by tasks on the same cell type
+    serialized_columns = {}
+    task_columns = []
+
+    # Loop through all the prediction tasks
+    for prediction_task in evaluator_json["prediction_tasks"]:
+        request_type = prediction_task["type"]
+        cell_type = prediction_task["cell_type"]
+        idx = cell_type_mapping.get(cell_type, None)
+        if idx is None:
+            # Unknown cell types are reported before predictions are formatted
+            continue
+        # binary responses carry the predictions once as a matrix instead
+        if not binary_mode and idx not in serialized_columns:
+            # slice the whole column and serialize it in one go
+            column = predictions[:, idx].tolist()
+            if is_mutagenesis:
+                # the reference prediction, then the change of every mutant relative to it,
+                # grouped per position (3 alternative bases) unless variants were listed
+                column = [
+                    {
+                        "reference": column[start],
+                        "deltas": (
+                            column[start + 1 : end]
+                            if seq_id in variants
+                            else [
+                                column[row : row + 3]
+                                for row in range(start + 1, end, 3)
+                            ]
+                        ),
+                    }
+                    for seq_id, start, end in zip(
+                        seq_ids,
+                        row_offsets[:-1].tolist(),
+                        row_offsets[1:].tolist(),
+                    )
+                ]
+            elif row_offsets is not None:
+                # each sequence gets the list of its windows' predictions
+                column = [
+                    column[start:end]
+                    for start, end in zip(
+                        row_offsets[:-1].tolist(), row_offsets[1:].tolist()
+                    )
+                ]
+            serialized_columns[idx] = dumps_bytes(dict(zip(seq_ids, column)))
+
+        # Cell type predictor container is running, send the predictor's cell type and evaluator cell type to it
+        # If you want to override the cell type container you can remove the following code
+        # Send the predictor and evaluator cell type
+        # cell_type_socket.sendall(b'Hello, cell type matcher dude!')
+        # cell_type_matcher_return = cell_type_socket.recv(1024)
+
+        # The following code will be model specific
+        # Sample point prediction model
+        # Model builders need to add the appropriate returns here
+
+        # Create structured response for the evaluator
+        current_prediction_task = {
+            "name": prediction_task["name"],
+            "type_requested": request_type,
+            "type_actual": request_type,  # If remapped, update this
+            "cell_type_requested": cell_type,
+            "cell_type_actual": cell_type,  # If remapped, update this
+            "species_requested": prediction_task["species"],
+            "species_actual": prediction_task["species"],
+        }
+        if binary_mode:
+            # point the task at its column of the prediction matrix
+            current_prediction_task["column"] = idx
+
+        # Append results for current prediction task to the main JSON object
+        json_return["prediction_tasks"].append(current_prediction_task)
+        task_columns.append(idx)
+
+    if binary_mode:
+        if is_mutagenesis:
+            # sequence i owns the next row_counts[i] rows: its reference, then its mutant deltas
+            json_return["row_counts"] = np.diff(row_offsets).tolist()
+        elif row_offsets is not None:
+            # rows of the matrix are windows, sequence i owns the next window_counts[i] rows
+            json_return["window_counts"] = np.diff(row_offsets).tolist()
+        return encode_binary_response(
+            json_return, seq_ids, cell_type_mapping.keys(), predictions
+        )
 
-        # # ---------------------- Close Connection Sockets ----------------------
-        # client_socket.close()
-        # print("Connection to client closed")
-        # # close server socket
-        # server.close()
+    # Splice each task's serialized predictions in as its last key
+    prediction_tasks = json_return.pop("prediction_tasks")
+    parts = [dumps_bytes({"request": json_return.pop("request")})[:-1]]
+    parts.append(b',"prediction_tasks":[')
+    for i, (current_prediction_task, idx) in enumerate(
+        zip(prediction_tasks, task_columns)
+    ):
+        if i:
+            parts.append(b",")
+        parts.append(dumps_bytes(current_prediction_task)[:-1])
+        parts.append(b',"predictions":')
+        parts.append(serialized_columns[idx])
+        parts.append(b"}")
+    parts.append(b"]")
+    for key, value in json_return.items():
+        parts.append(b"," + dumps_bytes(key) + b":" + dumps_bytes(value))
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+def stream_predictions(
+    reply,
+    evaluator_json,
+    sequences,
+    cell_type_mapping,
+    binary_mode,
+    model=None,
+    cache=None,
+):
+    """
+    Predicts `sequences` in chunks of STREAM_CHUNK_SIZE and sends each chunk as its own
+    length-prefixed response frame with a "chunk" number, followed by a frame with
+    "stream_end": true. A model error is sent as a prediction_request_failed frame and ends the stream.
+    `model` names the hosted model to run and `cache` is its prediction cache, if any.
+    Returns False if the Evaluator could not be reached anymore.
+    """
+    seq_ids = list(sequences.keys())
+    n_chunks = 0
+    try:
+        for chunk_start in range(0, len(seq_ids), STREAM_CHUNK_SIZE):
+            chunk_ids = seq_ids[chunk_start : chunk_start + STREAM_CHUNK_SIZE]
+            chunk_predictions = predict_crested(
+                {seq_id: sequences[seq_id] for seq_id in chunk_ids},
+                batcher,
+                cache,
+                client=reply.client,
+                cancel_token=reply.cancel_token,
+                model=model,
+            )
+            if isinstance(chunk_predictions, str):
+                METRICS.add("failed_requests")
+                if reply.cancel_token.is_cancelled():
+                    METRICS.add("cancelled_requests")
+                frame = json.dumps(
+                    {"prediction_request_failed": [chunk_predictions]}
+                ).encode("utf-8")
+                reply.send(frame)
+                return True
+            with METRICS.timer("format"):
+                frame = format_prediction_response(
+                    evaluator_json,
+                    chunk_predictions,
+                    cell_type_mapping,
+                    binary_mode,
+                    {"chunk": n_chunks, "first_sequence_index": chunk_start},
+                )
+            del chunk_predictions
+            with METRICS.timer("send"):
+                reply.send(frame)
+            n_chunks += 1
+
+        # terminating frame, carries no predictions
+        frame = format_prediction_response(
+            {"request": evaluator_json["request"], "prediction_tasks": []},
+            ([], np.empty((0, len(cell_type_mapping)), dtype=np.float32)),
+            cell_type_mapping,
+            binary_mode,
+            {"stream_end": True, "n_chunks": n_chunks, "n_sequences": len(seq_ids)},
+        )
+        reply.send(frame)
+    except socket.error as e:
+        print("server_error: Error sending streamed prediction response: %s" % e)
+        return False
+    print(f"Streamed {len(seq_ids)} predictions in {n_chunks} chunks")
+    return True
+
+
+def handle_client(client_socket, client_address):
+    # Serve one Evaluator connection on its own thread and free its slot when it disconnects
+    METRICS.adjust_gauge("connections", 1)
+    pipeline = ConnectionPipeline(
+        client_socket,
+        PIPELINE_WINDOW,
+        send_payload,
+        client=f"{client_address[0]}:{client_address[1]}",
+        compress_fn=compress_response,
+    )
+    connection_reset = False
+    try:
+        connection_reset = not recv_message_loop(client_socket, pipeline)
+    except Exception as e:
+        print(f"Error serving {client_address[0]}:{client_address[1]}: {e}")
+    finally:
+        if connection_reset:
+            # the Evaluator is gone, requests still in flight stop at their next inference chunk
+            pipeline.cancel_all("the connection to the Evaluator was reset")
+        # after a clean end of the stream, e.g. a half-close, requests in flight still reply
+        # (a failed send cancels them through the pipeline)
+        pipeline.close()
+        client_socket.close()
+        METRICS.adjust_gauge("connections", -1)
+        connection_slots.release()
+        print(f"Connection to {client_address[0]}:{client_address[1]} closed")
 
 
 def run_predictor():
+    global batcher, prediction_cache, genome
     predictor_ip = sys.argv[1]
     predictor_port = int(sys.argv[2])
     # cell_type_matcher_ip = sys.argv[3]
     # cell_type_matcher_port = sys.argv[4]
 
+    # Load the model and cell type mapping once and warm it up before accepting requests
+    # With an inference pool the workers hold the model and the server only reads the cell types
+    model_registry = init_model_registry(
+        load_model=INFERENCE_WORKERS == 0,
+        autotune=AUTOTUNE_BATCH_SIZE,
+        help_file=HELP_FILE,
+    )
+    print(f"Hosting models: {', '.join(get_model_catalog().names())}")
+    batch_size = model_registry.batch_size or BATCH_SIZE
+    if INFERENCE_WORKERS > 0:
+        inference_pool = init_inference_pool(
+            INFERENCE_WORKERS,
+            BATCH_SIZE,
+            INTRA_OP_THREADS,
+            INTER_OP_THREADS,
+            autotune=AUTOTUNE_BATCH_SIZE,
+        )
+        batch_size = inference_pool.batch_size
+        METRICS.register_gauge(
+            "idle_inference_workers", inference_pool.idle_worker_count
+        )
+        print(
+            f"Cold start: inference workers ready in {inference_pool.startup_time:.2f}s"
+        )
+    else:
+        print(
+            f"Cold start: model load {model_registry.load_time:.2f}s, warm-up {model_registry.warmup_time:.2f}s"
+        )
+        if model_registry.engine is not None:
+            print(
+                f"Serving the {model_registry.engine.precision} compiled engine, built in {model_registry.engine.build_time:.2f}s"
+            )
+    # one batch per inference worker can be in the model at the same time
+    batcher = MicroBatcher(
+        predict_sequences,
+        batch_size,
+        BATCH_MAX_WAIT_MS,
+        n_runners=max(INFERENCE_WORKERS, 1),
+        small_request_rows=SMALL_REQUEST_SEQUENCES,
+    ).start()
+    METRICS.register_gauge("batch_queue_depth", batcher.queue_depth)
+    if CACHE_BYTES > 0 or CACHE_DIR:
+        prediction_cache = PredictionCache(
+            model_registry.model_id,
+            CACHE_BYTES,
+            CACHE_DIR,
+            len(model_registry.cell_type_index),
+            CACHE_DISK_ENTRIES,
+        )
+
+    if GENOME_PATH:
+        genome = open_genome(GENOME_PATH)
+
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
     # bind the socket to a specific address and port
     server.bind((predictor_ip, predictor_port))
     # listen for incoming connections
-    server.listen(0)
-    print(f"Listening on {predictor_ip}:{predictor_port}")
+    server.listen(MAX_CONNECTIONS)
+    print(
+        f"Listening on {predictor_ip}:{predictor_port} "
+        f"(max {MAX_CONNECTIONS} connections, {MAX_INFLIGHT_REQUESTS} requests in flight)"
+    )
 
     # We want to have multiple evaluators to connect so predictor
     # can take multiple requests (and not just multiple tasks per evaluator)
@@ -427,14 +996,26 @@ def run_predictor():
     # This loop allows the Predictor server to stay running so that different Evaluators can connect
     while True:
         try:
+            # Wait for a free connection slot, extra Evaluators queue in the listen backlog
+            connection_slots.acquire()
             print("Waiting for an Evaluator to connect")
             # accept incoming connections
-            client_socket, client_address = server.accept()
+            try:
+                client_socket, client_address = server.accept()
+            except Exception:
+                connection_slots.release()
+                raise
             print(f"Accepted connection from {client_address[0]}:{client_address[1]}")
-            # Once connected, receive request
-            recv_message_loop(client_socket)
+            # Once connected, receive requests on a separate thread so other Evaluators can connect
+            threading.Thread(
+                target=handle_client,
+                args=(client_socket, client_address),
+                daemon=True,
+            ).start()
         except Exception as e:
             print(f"Error accepting client: {e}")
 
 
-run_predictor()
+# inference workers re-import this script, only the main process runs the server
+if __name__ == "__main__":
+    run_predictor()
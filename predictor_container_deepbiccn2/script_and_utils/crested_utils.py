@@ -1,37 +1,867 @@
 import os
+import gc
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import crested
+import numpy as np
 import pandas as pd
 import keras
 
+from metrics_utils import METRICS
+from batch_tuning_utils import (
+    activation_bytes_per_sequence,
+    autotune_batch_size,
+    is_resource_exhausted,
+)
+
 SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
-MODEL_PATH = os.path.join(SCRIPT_PATH, "..", "model")
+# The model directory can be overridden, e.g. to serve the benchmark's stand-in model.
+# Every <name>.keras in it with its <name>_output_classes.tsv (and optionally
+# <name>_help_message.json) is hosted, requests pick one with their "model" field
+MODEL_PATH = os.environ.get(
+    "PREDICTOR_MODEL_DIR", os.path.join(SCRIPT_PATH, "..", "model")
+)
 MODEL_NAME = "deepbiccn2"
-saved_models_path = os.path.join(MODEL_PATH, f"{MODEL_NAME}.keras")
-targets_file = os.path.join(MODEL_PATH, f"{MODEL_NAME}_output_classes.tsv")
+# Model serving requests without a "model" field, loaded at startup and never unloaded
+DEFAULT_MODEL = os.environ.get("PREDICTOR_DEFAULT_MODEL", MODEL_NAME)
+saved_models_path = os.path.join(MODEL_PATH, f"{DEFAULT_MODEL}.keras")
+targets_file = os.path.join(MODEL_PATH, f"{DEFAULT_MODEL}_output_classes.tsv")
+# Memory budget of the loaded models' weights, the least recently used models are
+# unloaded to stay within it and loaded again on their next request (0 for no limit)
+MODEL_MEMORY_BYTES = int(os.environ.get("PREDICTOR_MODEL_MEMORY_BYTES", 0))
+
+# Input length expected by the model, used for the warm-up batch
+INPUT_LENGTH = 2114
+WARMUP_BATCH_SIZE = 2
+
+# Memory budget of one inference chunk. Requests are encoded and predicted chunk by chunk
+# into one preallocated output, so peak memory follows the chunk size instead of the request size
+INFERENCE_MEMORY_BYTES = int(
+    os.environ.get("PREDICTOR_INFERENCE_MEMORY_BYTES", 512 * 1024 * 1024)
+)
+
+# Inference engine: "eager" runs crested.tl.predict, "compiled" runs graphs traced at startup with a
+# fixed input shape per batch-size bucket (compiled_engine_utils), optionally at reduced precision
+INFERENCE_ENGINE = os.environ.get("PREDICTOR_INFERENCE_ENGINE", "eager")
+ENGINE_PRECISION = os.environ.get("PREDICTOR_ENGINE_PRECISION", "float32")
+_ENGINE_BUCKETS = os.environ.get("PREDICTOR_ENGINE_BUCKETS", "1,8,32,128,256")
+ENGINE_BUCKETS = [
+    int(bucket) for bucket in _ENGINE_BUCKETS.split(",") if bucket.strip()
+]
+ENGINE_XLA = os.environ.get("PREDICTOR_ENGINE_XLA", "1") != "0"
+# A precision variant only serves traffic if its predictions of the reference set stay within
+# this tolerance of the float32 model's, relative to the largest output (default per precision)
+ENGINE_TOLERANCE = os.environ.get("PREDICTOR_ENGINE_TOLERANCE")
+ENGINE_REFERENCE_SEQUENCES = int(
+    os.environ.get("PREDICTOR_ENGINE_REFERENCE_SEQUENCES", 64)
+)
+
+# Batch size autotuning (PREDICTOR_BATCH_SIZE=auto): forward-pass sizes up to AUTOTUNE_MAX_BATCH_SIZE
+# are timed at startup, skipping those whose estimated memory exceeds AUTOTUNE_MEMORY_BYTES
+AUTOTUNE_MAX_BATCH_SIZE = int(os.environ.get("PREDICTOR_AUTOTUNE_MAX_BATCH_SIZE", 1024))
+AUTOTUNE_MEMORY_BYTES = int(
+    os.environ.get("PREDICTOR_AUTOTUNE_MEMORY_BYTES", 2 * 1024 * 1024 * 1024)
+)
+
+# One-hot encoding: every ASCII byte maps to a row of ONE_HOT_TABLE.
+# A, C, G and T (either case) get their one-hot row, N and every other
+# ambiguous character get the all-zero row, like crested's own encoder.
+ONE_HOT_LOOKUP = np.full(256, 4, dtype=np.uint8)
+ONE_HOT_LOOKUP[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4)
+ONE_HOT_LOOKUP[np.frombuffer(b"acgt", dtype=np.uint8)] = np.arange(4)
+ONE_HOT_TABLE = np.vstack([np.eye(4), np.zeros((1, 4))]).astype(np.float32)
+# Codes of the three alternative bases of each reference base (A, C, G, T), in A, C, G, T order
+ALTERNATIVE_CODES = np.array(
+    [[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]], dtype=np.uint8
+)
+
+
+class ModelRegistry:
+    """
+    Holds the Keras model and its cell type mapping in memory so they are
+    loaded once at predictor startup instead of on every request.
+    """
+
+    def __init__(
+        self,
+        model_path=saved_models_path,
+        targets_path=targets_file,
+        name=None,
+        help_path=None,
+    ):
+        self.model_path = model_path
+        self.targets_path = targets_path
+        self.name = name or os.path.splitext(os.path.basename(model_path))[0]
+        # help metadata returned for {"request": "help"}, None if the model has none
+        self.help_path = help_path
+        self.help_metadata = None
+        self.model = None
+        self.cell_type_index = None
+        self.load_time = None
+        self.warmup_time = None
+        self.model_id = None
+        # compiled engine serving the model input length, None to run crested.tl.predict
+        self.engine = None
+        # sequences per forward pass, None leaves it to crested.tl.predict; halved when a pass runs out of memory
+        self.batch_size = None
+        self.autotune_throughputs = None
+        # weights in memory, counted against the model catalog's memory budget
+        self.memory_bytes = 0
+        # requests currently using the model, it is not unloaded while any are
+        self.users = 0
+        # Connections share one model, forward passes go through it one at a time
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def load(self, load_model=True):
+        # without load_model only the cell types and model identity are read,
+        # for a server whose forward passes run in an inference pool
+        start = time.perf_counter()
+        if load_model:
+            self.model = keras.models.load_model(self.model_path, compile=False)
+            self.memory_bytes = self.model.count_params() * 4
+        self.read_targets()
+        self.model_id = self._model_file_hash()
+        self.load_time = time.perf_counter() - start
+        print(f"Loaded model {self.model_path} in {self.load_time:.2f}s")
+        return self
+
+    def read_targets(self):
+        targets_df = pd.read_csv(self.targets_path, sep="\t", names=["target"])
+        self.cell_type_index = {
+            target: i for i, target in enumerate(targets_df["target"])
+        }
+        return self
+
+    def read_help(self):
+        """
+        Returns the model's help metadata, or None if it has none or it cannot be read.
+        """
+        if self.help_path is None:
+            return None
+        try:
+            with open(self.help_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Could not read the help metadata of {self.name}: {e}")
+            return None
+
+    def unload(self):
+        # drops the weights, the cell types stay so requests can still be validated
+        self.model = None
+        self.engine = None
+        self.memory_bytes = 0
+        gc.collect()
+
+    def _model_file_hash(self):
+        # identifies the model weights, used to key cached predictions
+        digest = hashlib.sha256(self.name.encode("utf-8"))
+        with open(self.model_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return f"{self.name}-{digest.hexdigest()[:16]}"
+
+    def build_engine(
+        self,
+        engine=INFERENCE_ENGINE,
+        precision=ENGINE_PRECISION,
+        buckets=ENGINE_BUCKETS,
+        xla=ENGINE_XLA,
+        tolerance=ENGINE_TOLERANCE,
+    ):
+        """
+        Builds the compiled engine and checks it against the float32 model on a reference set.
+        A precision that fails the check falls back to float32, a failing float32 engine to eager inference.
+        """
+        if engine != "compiled" or self.model is None:
+            return self
+        from compiled_engine_utils import CompiledEngine, reference_inputs
+
+        inputs = reference_inputs(ENGINE_REFERENCE_SEQUENCES, INPUT_LENGTH)
+        expected = crested.tl.predict(input=inputs, model=self.model, genome=None)
+        for candidate in dict.fromkeys([precision, "float32"]):
+            try:
+                compiled = CompiledEngine(
+                    self.model, candidate, buckets, INPUT_LENGTH, xla
+                ).build()
+            except Exception as e:
+                print(f"Could not build the {candidate} compiled engine: {e}")
+                continue
+            report = compiled.check_accuracy(
+                inputs, expected, None if tolerance is None else float(tolerance)
+            )
+            print(
+                f"{candidate} engine accuracy check: max relative error "
+                f"{report['max_rel_error']:.2e} (tolerance {report['tolerance']:.0e})"
+            )
+            if report["passed"]:
+                self.engine = compiled
+                return self
+            print(f"The {candidate} engine failed its accuracy check, not serving it")
+        print("Falling back to eager inference")
+        return self
+
+    def _forward(self, one_hot):
+        # one forward pass, through the compiled engine when it serves this input length
+        if self.engine is not None and one_hot.shape[1] == INPUT_LENGTH:
+            return self.engine.predict(one_hot)
+        if self.batch_size is None:
+            return crested.tl.predict(input=one_hot, model=self.model, genome=None)
+        return crested.tl.predict(
+            input=one_hot, model=self.model, genome=None, batch_size=len(one_hot)
+        )
+
+    def predict(self, one_hot):
+        """
+        Runs the model over an encoded (N, L, 4) batch in forward passes of at most `batch_size`
+        sequences. A pass that runs out of memory halves `batch_size` for it and every later
+        batch, and only that pass's sequences are predicted again.
+        """
+        if len(one_hot) == 0:
+            return self._forward(one_hot)
+        predictions = None
+        start = 0
+        while start < len(one_hot):
+            end = min(start + (self.batch_size or len(one_hot)), len(one_hot))
+            try:
+                batch_predictions = self._forward(one_hot[start:end])
+            except Exception as e:
+                if end - start <= 1 or not is_resource_exhausted(e):
+                    raise
+                self._shrink_batch_size(end - start, e)
+                continue
+            if predictions is None:
+                predictions = np.empty(
+                    (len(one_hot), batch_predictions.shape[-1]), dtype=np.float32
+                )
+            predictions[start:end] = batch_predictions
+            start = end
+        return predictions
+
+    def _shrink_batch_size(self, failed_size, error):
+        self.batch_size = max(1, failed_size // 2)
+        METRICS.add("oom_retries")
+        print(
+            f"Forward pass of {failed_size} sequences ran out of memory ({type(error).__name__}), "
+            f"retrying with batches of {self.batch_size}"
+        )
+
+    def autotune_batch_size(
+        self, max_batch_size=AUTOTUNE_MAX_BATCH_SIZE, memory_bytes=AUTOTUNE_MEMORY_BYTES
+    ):
+        """
+        Sets `batch_size` to the forward-pass size with the best throughput that fits in `memory_bytes`.
+        With a compiled engine the candidates are its batch-size buckets.
+        """
+        if self.model is None:
+            return self
+        if self.engine is not None:
+            candidates = [b for b in self.engine.buckets if b <= max_batch_size]
+        else:
+            candidates = [2**i for i in range(3, max_batch_size.bit_length())]
+        candidates = candidates or [max_batch_size]
+        # candidates are timed as single forward passes, without the out-of-memory fallback
+        self.batch_size = max(candidates)
+        start = time.perf_counter()
+        self.batch_size, self.autotune_throughputs = autotune_batch_size(
+            self._forward,
+            candidates,
+            INPUT_LENGTH,
+            activation_bytes_per_sequence(self.model, INPUT_LENGTH),
+            memory_bytes,
+        )
+        print(
+            f"Autotuned the batch size to {self.batch_size} in {time.perf_counter() - start:.2f}s"
+        )
+        return self
+
+    def warm_up(self, batch_size=WARMUP_BATCH_SIZE):
+        # Run one forward pass on random sequences so graph building happens
+        # before the first Evaluator request instead of during it
+        rng = np.random.default_rng(0)
+        bases = np.array(list("ACGT"))
+        dummy_seqs = [
+            "".join(rng.choice(bases, INPUT_LENGTH)) for _ in range(batch_size)
+        ]
+        start = time.perf_counter()
+        self.predict(one_hot_encode(dummy_seqs))
+        self.warmup_time = time.perf_counter() - start
+        print(f"Model warm-up on {batch_size} sequences took {self.warmup_time:.2f}s")
+        return self
+
+    def timings(self):
+        timings = {"load_time_s": self.load_time, "warmup_time_s": self.warmup_time}
+        if self.engine is not None:
+            timings["engine"] = self.engine.describe()
+        if self.batch_size is not None:
+            timings["batch_size"] = self.batch_size
+        if self.autotune_throughputs is not None:
+            timings["autotune_sequences_per_s"] = self.autotune_throughputs
+        return timings
+
+
+class ModelCatalog:
+    """
+    The models hosted by the predictor: every `<name>.keras` in `models_dir` that has its
+    `<name>_output_classes.tsv`. Only their cell types are read up front. A model is loaded
+    on its first request and the least recently used ones are unloaded to keep the loaded
+    weights within `memory_bytes` (0 for no limit), except the default model and models in use.
+    Without `load_models` only cell types and identities are read, for a server whose
+    forward passes run in an inference pool.
+    """
+
+    def __init__(
+        self,
+        models_dir=MODEL_PATH,
+        default_model=DEFAULT_MODEL,
+        memory_bytes=MODEL_MEMORY_BYTES,
+        load_models=True,
+        default_help_path=None,
+    ):
+        self.models_dir = models_dir
+        self.default_model = default_model
+        self.memory_bytes = memory_bytes
+        self.load_models = load_models
+        self.registries = {}
+        for file_name in sorted(os.listdir(models_dir)):
+            name, extension = os.path.splitext(file_name)
+            targets_path = os.path.join(models_dir, f"{name}_output_classes.tsv")
+            if extension != ".keras" or not os.path.exists(targets_path):
+                continue
+            help_path = os.path.join(models_dir, f"{name}_help_message.json")
+            if not os.path.exists(help_path):
+                help_path = default_help_path if name == default_model else None
+            registry = ModelRegistry(
+                os.path.join(models_dir, file_name), targets_path, name, help_path
+            ).read_targets()
+            registry.help_metadata = registry.read_help()
+            self.registries[name] = registry
+        if default_model not in self.registries:
+            raise FileNotFoundError(
+                f"{default_model}.keras and {default_model}_output_classes.tsv not found in {models_dir}"
+            )
+        # request names are matched case-insensitively, e.g. "DeepBICCN2"
+        self._names = {name.lower(): name for name in self.registries}
+        # loaded models, least recently used first
+        self._loaded = OrderedDict()
+        self.lock = threading.Lock()
+
+    def names(self):
+        return list(self.registries)
+
+    def resolve(self, name=None):
+        """
+        Returns the catalog name of a requested model, the default model for None,
+        or None if no such model is hosted.
+        """
+        if name is None:
+            return self.default_model
+        if not isinstance(name, str):
+            return None
+        return self._names.get(name.lower())
+
+    def registry(self, name=None):
+        # the model's registry, its weights may not be loaded
+        return self.registries[self.resolve(name)]
+
+    def load_default(self, autotune=False):
+        """
+        Loads and warms up the default model, and autotunes its batch size with `autotune`.
+        """
+        registry = self.registries[self.default_model]
+        registry.load(self.load_models)
+        if self.load_models:
+            registry.build_engine().warm_up()
+            if autotune:
+                registry.autotune_batch_size()
+        with self.lock:
+            self._loaded[registry.name] = registry
+        return registry
+
+    @contextmanager
+    def use(self, name=None):
+        """
+        Yields the registry of a model with its weights loaded, loading it first if needed.
+        The model is not unloaded before the block ends.
+        """
+        registry = self.registry(name)
+        with self.lock:
+            registry.users += 1
+            if registry.name in self._loaded:
+                self._loaded.move_to_end(registry.name)
+        try:
+            if registry.name not in self._loaded:
+                self._load(registry)
+            yield registry
+        finally:
+            with self.lock:
+                registry.users -= 1
+                self._evict()
+
+    def _load(self, registry):
+        # requests for a model being loaded wait for that load instead of starting another
+        with registry.load_lock:
+            if registry.name in self._loaded:
+                return
+            with METRICS.timer("model_load"):
+                registry.load(self.load_models)
+                if self.load_models:
+                    registry.build_engine().warm_up()
+            with self.lock:
+                self._loaded[registry.name] = registry
+                self._evict()
+        METRICS.add("model_loads")
+
+    def _evict(self):
+        # called with self.lock held
+        if not self.memory_bytes:
+            return
+        loaded_bytes = sum(registry.memory_bytes for registry in self._loaded.values())
+        for name, registry in list(self._loaded.items()):
+            if loaded_bytes <= self.memory_bytes:
+                break
+            if name == self.default_model or registry.users:
+                continue
+            loaded_bytes -= registry.memory_bytes
+            del self._loaded[name]
+            registry.unload()
+            METRICS.add("model_evictions")
+            print(f"Unloaded model {name} to stay within the model memory budget")
+
+    def loaded(self):
+        with self.lock:
+            return list(self._loaded)
+
+
+_model_catalog = None
+_inference_pool = None
+
+
+def init_model_registry(load_model=True, autotune=False, help_file=None):
+    """
+    Finds the hosted models, then loads and warms up the default one and autotunes its batch
+    size with `autotune`. `help_file` is the default model's help metadata if the models
+    directory has none. Called once by the predictor server before it starts listening.
+    """
+    global _model_catalog
+    _model_catalog = ModelCatalog(load_models=load_model, default_help_path=help_file)
+    return _model_catalog.load_default(autotune)
+
+
+def init_inference_pool(
+    n_workers, max_batch_size, intra_op_threads=0, inter_op_threads=0, autotune=False
+):
+    """
+    Starts `n_workers` inference processes, each with its own copy of the model.
+    predict_sequences runs its forward passes in them from then on. With `autotune`
+    every worker tunes its batch size up to `max_batch_size`.
+    """
+    global _inference_pool
+    from inference_pool_utils import InferencePool
+
+    model_catalog = get_model_catalog()
+    _inference_pool = InferencePool(
+        n_workers,
+        {
+            name: len(registry.cell_type_index)
+            for name, registry in model_catalog.registries.items()
+        },
+        max_batch_size,
+        model_catalog.models_dir,
+        model_catalog.default_model,
+        intra_op_threads,
+        inter_op_threads,
+        autotune,
+    ).start()
+    return _inference_pool
+
+
+def get_model_catalog():
+    """
+    Returns the hosted models, loading the default one on first use if the server did not initialize it.
+    """
+    if _model_catalog is None:
+        init_model_registry()
+    return _model_catalog
+
+
+def get_model_registry(model=None):
+    """
+    Returns the registry of a hosted model, by default the resident default model.
+    """
+    return get_model_catalog().registry(model)
 
 
-def get_cell_type_index():
+def get_cell_type_index(model=None):
     """
     Returns a dictionary mapping cell type names to their corresponding indices.
     """
-    targets_df = pd.read_csv(targets_file, sep="\t", names=["target"])
-    return {target: i for i, target in enumerate(targets_df["target"])}
+    return get_model_registry(model).cell_type_index
+
+
+def one_hot_encode(seqs: list, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    One-hot encodes equal-length sequences into a contiguous (N, L, 4) float32 array in one
+    vectorized pass over the concatenated ASCII bytes. Fills `out` if a preallocated array is given.
+    """
+    seq_length = len(seqs[0]) if seqs else 0
+    # non-ASCII characters become "?" and are encoded like N
+    seq_bytes = np.frombuffer("".join(seqs).encode("ascii", "replace"), dtype=np.uint8)
+    if seq_bytes.size != len(seqs) * seq_length:
+        raise ValueError(
+            "sequences passed to the model should all have the same length"
+        )
+    codes = ONE_HOT_LOOKUP[seq_bytes].reshape(len(seqs), seq_length)
+    if out is None:
+        out = np.empty((len(seqs), seq_length, 4), dtype=np.float32)
+    np.take(ONE_HOT_TABLE, codes, axis=0, out=out)
+    return out
+
+
+def predict_sequences(seqs: list, model=None) -> np.ndarray:
+    """
+    Runs a hosted model (the default one if `model` is None) over a list of model-ready
+    sequences and returns the (N, C) predictions.
+    """
+    seq_lengths = {len(seq) for seq in seqs}
+    if len(seq_lengths) > 1:
+        # batches merged across requests can mix lengths (prediction_ranges), encode each length on its own
+        predictions = [None] * len(seqs)
+        for seq_length in seq_lengths:
+            rows = [i for i, seq in enumerate(seqs) if len(seq) == seq_length]
+            for i, row in zip(rows, predict_sequences([seqs[i] for i in rows], model)):
+                predictions[i] = row
+        return np.stack(predictions)
+
+    if _inference_pool is not None:
+        # encoded into a worker's shared buffer and predicted in that worker
+        predictions = _inference_pool.predict(seqs, model)
+        METRICS.add("model_sequences", len(seqs))
+        return predictions
+
+    with METRICS.timer("encode"):
+        one_hot = one_hot_encode(seqs)  # (N, L, 4)
+    return predict_one_hot(one_hot, model)
+
+
+def predict_one_hot(one_hot: np.ndarray, model=None) -> np.ndarray:
+    """
+    Runs a hosted model over an already encoded (N, L, 4) batch and returns the (N, C) predictions.
+    """
+    if _inference_pool is not None:
+        predictions = _inference_pool.predict_encoded(one_hot, model)
+    else:
+        with get_model_catalog().use(model) as model_registry:
+            with model_registry.lock, METRICS.timer("model"):
+                predictions = model_registry.predict(one_hot)
+    METRICS.add("model_sequences", len(one_hot))
+    return predictions
+
+
+def check_cancelled(cancel_token):
+    # raises RequestCancelled once the request's deadline passed or its Evaluator left
+    if cancel_token is not None:
+        cancel_token.check()
+
+
+def count_windows(seq_length: int, stride: int) -> int:
+    """
+    Returns how many model-length windows start every `stride` bases within `seq_length` bases.
+    """
+    return (seq_length - INPUT_LENGTH) // stride + 1
+
 
+def tile_windows(one_hot: np.ndarray, stride: int) -> np.ndarray:
+    """
+    Returns the (W, INPUT_LENGTH, 4) windows starting every `stride` bases of an encoded
+    (L, 4) sequence as a read-only strided view, no window is copied.
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(one_hot, INPUT_LENGTH, axis=0)
+    return windows[::stride].transpose(0, 2, 1)  # (W, INPUT_LENGTH, 4)
 
-def predict_crested(sequences: dict) -> dict | str:
-    predictions = {}
+
+def predict_tiled(
+    sequences: dict,
+    stride: int,
+    memory_bytes=INFERENCE_MEMORY_BYTES,
+    cancel_token=None,
+    model=None,
+) -> tuple[list, np.ndarray, np.ndarray] | str:
+    """
+    Predicts every INPUT_LENGTH window starting each `stride` bases of {seq_id: long sequence}.
+    Returns the sequence IDs, one (W, C) prediction matrix holding the windows of all sequences
+    one after the other, and the first row of each sequence's windows (plus the total),
+    or the error message as a string. `cancel_token` is checked before every model batch.
+    """
+    try:
+        seqs_ids = list(sequences.keys())
+        n_outputs = len(get_cell_type_index(model))
+        n_windows = np.fromiter(
+            (count_windows(len(seq), stride) for seq in sequences.values()),
+            dtype=np.int64,
+            count=len(seqs_ids),
+        )
+        window_offsets = np.concatenate([[0], np.cumsum(n_windows)])
+        predictions = np.empty((window_offsets[-1], n_outputs), dtype=np.float32)
+        chunk_size = chunk_size_for(INPUT_LENGTH, n_outputs, memory_bytes)
+
+        start = time.perf_counter()
+        # windows of consecutive sequences are gathered into one reused model batch
+        batch = np.empty(
+            (min(chunk_size, len(predictions)), INPUT_LENGTH, 4), dtype=np.float32
+        )
+        batch_start = 0  # output row of the first window in the batch
+        n_batched = 0
+        for seq in sequences.values():
+            with METRICS.timer("encode"):
+                # each sequence is encoded once, its windows are views into that buffer
+                windows = tile_windows(one_hot_encode([seq])[0], stride)
+            window_start = 0
+            while window_start < len(windows):
+                take = min(len(windows) - window_start, len(batch) - n_batched)
+                batch[n_batched : n_batched + take] = windows[
+                    window_start : window_start + take
+                ]
+                n_batched += take
+                window_start += take
+                if n_batched == len(batch):
+                    check_cancelled(cancel_token)
+                    predictions[batch_start : batch_start + n_batched] = (
+                        predict_one_hot(batch, model)
+                    )
+                    batch_start += n_batched
+                    n_batched = 0
+        if n_batched:
+            check_cancelled(cancel_token)
+            predictions[batch_start : batch_start + n_batched] = predict_one_hot(
+                batch[:n_batched], model
+            )
+        elapsed = time.perf_counter() - start
+        METRICS.observe("inference", elapsed)
+        METRICS.add("sequences", len(seqs_ids))
+        print(
+            f"Predicted {len(predictions)} windows with stride {stride} over "
+            f"{len(seqs_ids)} sequences in {elapsed:.2f}s"
+        )
+        return seqs_ids, predictions, window_offsets
+    except Exception as e:
+        return str(e)
+
+
+def mutagenesis_mutations(
+    sequence: str, positions=None, variants=None, start: int = 0, end=None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (positions, alternative base codes) of the mutants of `sequence`. `variants` is a
+    list of [position, base] substitutions. Otherwise every position in `positions`, by default
+    every position of sequence[start:end], gets its three substitutions in A, C, G, T order
+    skipping the reference base. Positions are counted from `start`, e.g. past an upstream flank.
+    """
+    if variants is not None:
+        mutation_positions = np.array(
+            [position for position, _ in variants], dtype=np.int64
+        )
+        alt_codes = ONE_HOT_LOOKUP[
+            np.frombuffer("".join(base for _, base in variants).encode(), np.uint8)
+        ]
+        return mutation_positions + start, alt_codes
+    if positions is None:
+        positions = np.arange(0, (end if end is not None else len(sequence)) - start)
+    positions = np.asarray(positions, dtype=np.int64) + start
+    ref_codes = ONE_HOT_LOOKUP[
+        np.frombuffer(sequence.encode("ascii", "replace"), dtype=np.uint8)[positions]
+    ]
+    return np.repeat(positions, 3), ALTERNATIVE_CODES[ref_codes].ravel()
+
+
+def predict_mutagenesis(
+    sequences: dict,
+    mutations: dict,
+    memory_bytes=INFERENCE_MEMORY_BYTES,
+    cancel_token=None,
+    model=None,
+) -> tuple[list, np.ndarray, np.ndarray] | str:
+    """
+    Predicts every reference sequence and its single-base mutants, built from {seq_id: (positions,
+    alternative codes)} by flipping one position of a copy of the encoded reference.
+    Returns the sequence IDs, one (R, C) matrix holding for every sequence its reference prediction
+    followed by one row per mutant with its change relative to the reference, and the first row of
+    each sequence (plus the total), or the error message as a string.
+    `cancel_token` is checked before every model batch.
+    """
+    try:
+        seqs_ids = list(sequences.keys())
+        n_outputs = len(get_cell_type_index(model))
+        n_rows = np.fromiter(
+            (len(mutations[seq_id][0]) + 1 for seq_id in seqs_ids),
+            dtype=np.int64,
+            count=len(seqs_ids),
+        )
+        row_offsets = np.concatenate([[0], np.cumsum(n_rows)])
+        predictions = np.empty((row_offsets[-1], n_outputs), dtype=np.float32)
+        seq_length = max(map(len, sequences.values()), default=0)
+        chunk_size = chunk_size_for(seq_length, n_outputs, memory_bytes)
+
+        start = time.perf_counter()
+        batch = None
+        batch_start = 0  # output row of the first mutant in the batch
+        n_batched = 0
+        for seq_id, seq in sequences.items():
+            with METRICS.timer("encode"):
+                reference = one_hot_encode([seq])[0]  # (L, 4)
+            if batch is None or batch.shape[1] != len(seq):
+                if n_batched:
+                    check_cancelled(cancel_token)
+                    predictions[batch_start : batch_start + n_batched] = (
+                        predict_one_hot(batch[:n_batched], model)
+                    )
+                    batch_start += n_batched
+                    n_batched = 0
+                batch = np.empty(
+                    (min(chunk_size, len(predictions)), len(seq), 4), dtype=np.float32
+                )
+            # the reference itself goes first, marked by position -1
+            positions, alt_codes = mutations[seq_id]
+            positions = np.concatenate([[-1], positions])
+            alt_codes = np.concatenate([[0], alt_codes]).astype(np.intp)
+            done = 0
+            while done < len(positions):
+                take = min(len(positions) - done, len(batch) - n_batched)
+                rows = batch[n_batched : n_batched + take]
+                with METRICS.timer("encode"):
+                    rows[:] = reference
+                    flipped = positions[done : done + take] >= 0
+                    rows[
+                        np.flatnonzero(flipped), positions[done : done + take][flipped]
+                    ] = ONE_HOT_TABLE[alt_codes[done : done + take][flipped]]
+                n_batched += take
+                done += take
+                if n_batched == len(batch):
+                    check_cancelled(cancel_token)
+                    predictions[batch_start : batch_start + n_batched] = (
+                        predict_one_hot(batch, model)
+                    )
+                    batch_start += n_batched
+                    n_batched = 0
+        if n_batched:
+            check_cancelled(cancel_token)
+            predictions[batch_start : batch_start + n_batched] = predict_one_hot(
+                batch[:n_batched], model
+            )
+        # mutant rows become changes relative to their reference
+        for first, last in zip(row_offsets[:-1], row_offsets[1:]):
+            predictions[first + 1 : last] -= predictions[first]
+        elapsed = time.perf_counter() - start
+        METRICS.observe("inference", elapsed)
+        METRICS.add("sequences", len(seqs_ids))
+        print(
+            f"Predicted {len(predictions) - len(seqs_ids)} mutants of "
+            f"{len(seqs_ids)} sequences in {elapsed:.2f}s"
+        )
+        return seqs_ids, predictions, row_offsets
+    except Exception as e:
+        return str(e)
+
+
+def chunk_size_for(
+    seq_length: int, n_outputs: int, memory_bytes: int = INFERENCE_MEMORY_BYTES
+) -> int:
+    """
+    Returns how many sequences of `seq_length` bases fit in one inference chunk of `memory_bytes`.
+    """
+    # joined string, its ASCII bytes and lookup codes (1 byte per base each),
+    # the float32 one-hot input (16 bytes per base) and the float32 output row
+    bytes_per_sequence = seq_length * (3 + 16) + n_outputs * 4
+    return max(1, memory_bytes // bytes_per_sequence)
+
+
+def predict_crested(
+    sequences: dict,
+    batcher=None,
+    cache=None,
+    memory_bytes=INFERENCE_MEMORY_BYTES,
+    client=None,
+    cancel_token=None,
+    model=None,
+) -> tuple[list, np.ndarray] | str:
+    """
+    Predicts {seq_id: sequence} and returns the sequence IDs with one (N, C) prediction matrix
+    whose rows follow those IDs, or the error message as a string. Sequences are encoded and
+    predicted in chunks of at most `memory_bytes`, each written into the preallocated output.
+    The batcher queues the chunks fairly per `client`, and `cancel_token` is checked between chunks.
+    `model` names the hosted model to run, the default one if None.
+    """
     try:
         # extract sequences from dict
-        seqs = list(sequences.values())
         seqs_ids = list(sequences.keys())
-        model = keras.models.load_model(saved_models_path, compile=False)
-        crested_predictions = crested.tl.predict(
-            input=seqs,
-            model=model,
-            genome=None,
-        )  # (N, C)
-        for i, seq_id in enumerate(seqs_ids):
-            predictions[seq_id] = crested_predictions[i]
+        n_outputs = len(get_cell_type_index(model))
+        predictions = np.empty((len(seqs_ids), n_outputs), dtype=np.float32)
+        # identical sequences within the request are only predicted once, into their first row
+        first_rows = {}
+        seq_rows = np.fromiter(
+            (
+                first_rows.setdefault(seq, row)
+                for row, seq in enumerate(sequences.values())
+            ),
+            dtype=np.int64,
+            count=len(seqs_ids),
+        )
+        unique_seqs = list(first_rows)
+        unique_rows = np.fromiter(
+            first_rows.values(), dtype=np.int64, count=len(unique_seqs)
+        )
+        del first_rows
+        chunk_size = chunk_size_for(
+            max(map(len, unique_seqs), default=0), n_outputs, memory_bytes
+        )
+
+        start = time.perf_counter()
+        n_predicted = 0
+        n_chunks = 0
+        for chunk_start in range(0, len(unique_seqs), chunk_size):
+            check_cancelled(cancel_token)
+            chunk_seqs = unique_seqs[chunk_start : chunk_start + chunk_size]
+            chunk_rows = unique_rows[chunk_start : chunk_start + chunk_size]
+            to_predict = list(range(len(chunk_seqs)))
+            if cache is not None:
+                keys = [cache.key(seq) for seq in chunk_seqs]
+                cached = cache.get_many(keys)
+                to_predict = [i for i, key in enumerate(keys) if key not in cached]
+                for i, key in enumerate(keys):
+                    if key in cached:
+                        predictions[chunk_rows[i]] = cached[key]
+            if to_predict:
+                seqs = [chunk_seqs[i] for i in to_predict]
+                if batcher is not None:
+                    # merge with the sequences of other pending requests
+                    chunk_predictions = batcher.submit(
+                        seqs, client, len(unique_seqs), cancel_token, model
+                    ).result()  # (n, C)
+                else:
+                    chunk_predictions = predict_sequences(seqs, model)  # (n, C)
+                predictions[chunk_rows[to_predict]] = chunk_predictions
+                if cache is not None:
+                    cache.put_many([keys[i] for i in to_predict], chunk_predictions)
+                n_predicted += len(to_predict)
+                # the chunk's encoded input is already freed, drop its outputs too
+                del seqs, chunk_predictions
+            n_chunks += 1
+        elapsed = time.perf_counter() - start
+        METRICS.observe("inference", elapsed)
+        METRICS.add("sequences", len(seqs_ids))
+        print(
+            f"Predicted {n_predicted} of {len(seqs_ids)} sequences "
+            f"({len(unique_seqs) - n_predicted} cached) in {n_chunks} chunks in {elapsed:.2f}s"
+        )
+
+        # copy predictions to the rows of repeated sequences
+        duplicates = np.flatnonzero(seq_rows != np.arange(len(seqs_ids)))
+        if duplicates.size:
+            predictions[duplicates] = predictions[seq_rows[duplicates]]
+        return seqs_ids, predictions
     except Exception as e:
-        predictions = str(e)
-    return predictions
+        return str(e)
@@ -1,13 +1,18 @@
 # Error checking functions
-import numpy as np
+from genome_utils import parse_region
+
+MANDATORY_KEYS = frozenset(["request", "readout", "prediction_tasks", "sequences"])
+PREDICTION_TASK_MANDATORY_KEYS = frozenset(["name", "type", "cell_type", "species"])
+PREDICTION_TASK_OPTIONS = ["accessibility"]
 
 
 # check the the mandatory_keys exsist in the .json files
 def check_mandatory_keys(evaluator_keys, json_return_error):
-    mandatory_keys = ["request", "readout", "prediction_tasks", "sequences"]
-    np.in1d(mandatory_keys, evaluator_keys).all()
-    missing = list(sorted(set(mandatory_keys) - set(evaluator_keys)))
-    print(missing)
+    missing = MANDATORY_KEYS - set(evaluator_keys)
+    # genome regions can be sent instead of sequences
+    if "regions" in evaluator_keys:
+        missing = missing - {"sequences"}
+    missing = list(sorted(missing))
     if not missing:
         pass
     else:
@@ -19,10 +24,12 @@ def check_mandatory_keys(evaluator_keys, json_return_error):
 
 # check the task requested is correct
 def check_request(request_types, json_return_error):
-    request_options = ["predict", "help"]
+    request_options = ["predict", "mutagenesis", "help"]
     if request_types not in request_options:
         json_return_error["bad_prediction_request"].append(
-            ("request is not recognized. Please choose from: 'predict','help'")
+            (
+                "request is not recognized. Please choose from: 'predict','mutagenesis','help'"
+            )
         )
 
     else:
@@ -72,78 +79,106 @@ def check_key_values_readout(readout_value, json_return_error):
     return json_return_error
 
 
-def check_prediction_task_mandatory_keys(prediction_tasks, json_return_error):
-    # loop through object to check each array
-    for prediction_task in prediction_tasks:
-        # first check that the mandatory keys exist
-        mandatory_keys = ["name", "type", "cell_type", "species"]
-        missing = list(sorted(set(mandatory_keys) - set(prediction_task.keys())))
-        if not missing:
-            pass
-        else:
-            json_return_error["bad_prediction_request"].append(
-                (
-                    "The following keys are missing from prediction_task: "
-                    + prediction_task["name"]
-                    + " "
-                    + str(missing)
-                )
+def check_task_mandatory_keys(prediction_task, errors):
+    # first check that the mandatory keys exist
+    missing = list(sorted(PREDICTION_TASK_MANDATORY_KEYS - set(prediction_task.keys())))
+    if not missing:
+        pass
+    else:
+        errors.append(
+            (
+                "The following keys are missing from prediction_task: "
+                + str(prediction_task.get("name", ""))
+                + " "
+                + str(missing)
             )
+        )
+    return errors
 
-    return json_return_error
 
+def check_task_name(prediction_task, errors):
+    if type(prediction_task["name"]) is list:
+        errors.append("'name' should only have 1 value")
+
+    else:
+        pass
+    if isinstance(prediction_task["name"], str):
+        pass
+    else:
+        errors.append("'name' value should be a string")
+    return errors
 
-def check_prediction_task_name(prediction_tasks, json_return_error):
-    # loop through object to check each array
-    for prediction_task in prediction_tasks:
-        if type(prediction_task["name"]) is list:
-            json_return_error["bad_prediction_request"].append(
-                "'name' should only have 1 value"
-            )
 
+def check_task_type(prediction_task, errors):
+    if type(prediction_task["type"]) is list:
+        errors.append("'type' should only have 1 value")
+
+    else:
+        if isinstance(prediction_task["type"], str):
+            if prediction_task["type"] in PREDICTION_TASK_OPTIONS or prediction_task[
+                "type"
+            ].startswith("binding_"):
+                pass
+            else:
+                errors.append(
+                    "prediction type "
+                    + str(prediction_task["type"])
+                    + " is not recognized for this predictor. Please choose from "
+                    + str(PREDICTION_TASK_OPTIONS)
+                )
+
+            pass
         else:
+            errors.append("'type' value should be a string")
+    return errors
+
+
+def check_task_cell_type(prediction_task, errors):
+    if type(prediction_task["cell_type"]) is list:
+        errors.append("'cell_type' should only have 1 value")
+
+    else:
+        if isinstance(prediction_task["cell_type"], str):
             pass
-        if isinstance(prediction_task["name"], str):
+        else:
+            errors.append("'cell_type' value should be a string")
+    return errors
+
+
+def check_task_species(prediction_task, errors):
+    if type(prediction_task["species"]) is list:
+        errors.append("'species' should only have 1 value")
+
+    else:
+        if isinstance(prediction_task["species"], str):
             pass
         else:
-            json_return_error["bad_prediction_request"].append(
-                "'name' value should be a string"
-            )
+            errors.append("'species' value should be a string")
+    return errors
+
+
+def check_prediction_task_mandatory_keys(prediction_tasks, json_return_error):
+    # loop through object to check each array
+    for prediction_task in prediction_tasks:
+        check_task_mandatory_keys(
+            prediction_task, json_return_error["bad_prediction_request"]
+        )
 
     return json_return_error
 
 
-def check_prediction_task_type(prediction_tasks, json_return_error):
+def check_prediction_task_name(prediction_tasks, json_return_error):
     # loop through object to check each array
     for prediction_task in prediction_tasks:
-        print(prediction_task)
-        prediction_task_options = ["accessibility"]
-        if type(prediction_task["type"]) is list:
-            json_return_error["bad_prediction_request"].append(
-                "'type' should only have 1 value"
-            )
+        check_task_name(prediction_task, json_return_error["bad_prediction_request"])
 
-        else:
-            if isinstance(prediction_task["type"], str):
-                if prediction_task[
-                    "type"
-                ] in prediction_task_options or prediction_task["type"].startswith(
-                    "binding_"
-                ):
-                    pass
-                else:
-                    json_return_error["bad_prediction_request"].append(
-                        "prediction type "
-                        + str(prediction_task["type"])
-                        + " is not recognized for this predictor. Please choose from "
-                        + str(prediction_task_options)
-                    )
+    return json_return_error
 
-                pass
-            else:
-                json_return_error["bad_prediction_request"].append(
-                    "'type' value should be a string"
-                )
+
+def check_prediction_task_type(prediction_tasks, json_return_error):
+    # loop through object to check each array
+    for prediction_task in prediction_tasks:
+        check_task_type(prediction_task, json_return_error["bad_prediction_request"])
 
     return json_return_error
 
@@ -151,18 +186,9 @@ def check_prediction_task_type(prediction_tasks, json_return_error):
 def check_prediction_task_cell_type(prediction_tasks, json_return_error):
     # loop through object to check each array
     for prediction_task in prediction_tasks:
-        if type(prediction_task["cell_type"]) is list:
-            json_return_error["bad_prediction_request"].append(
-                "'cell_type' should only have 1 value"
-            )
-
-        else:
-            if isinstance(prediction_task["cell_type"], str):
-                pass
-            else:
-                json_return_error["bad_prediction_request"].append(
-                    "'cell_type' value should be a string"
-                )
+        check_task_cell_type(
+            prediction_task, json_return_error["bad_prediction_request"]
+        )
 
     return json_return_error
 
@@ -170,18 +196,7 @@ def check_prediction_task_cell_type(prediction_tasks, json_return_error):
 def check_prediction_task_species(prediction_tasks, json_return_error):
     # loop through object to check each array
     for prediction_task in prediction_tasks:
-        if type(prediction_task["species"]) is list:
-            json_return_error["bad_prediction_request"].append(
-                "'species' should only have 1 value"
-            )
-
-        else:
-            if isinstance(prediction_task["species"], str):
-                pass
-            else:
-                json_return_error["bad_prediction_request"].append(
-                    "'species' value should be a string"
-                )
+        check_task_species(prediction_task, json_return_error["bad_prediction_request"])
 
     return json_return_error
 
@@ -303,3 +318,261 @@ def check_key_values_downstream_flank(downstream_seq, json_return_error):
             )
 
     return json_return_error
+
+
+def check_key_values_stream(stream_value, json_return_error):
+    if isinstance(stream_value, bool):
+        pass
+    else:
+        json_return_error["bad_prediction_request"].append(
+            "'stream' value should be a boolean"
+        )
+
+    return json_return_error
+
+
+def check_key_values_request_id(request_id, json_return_error):
+    # echoed in the responses so pipelined requests can be matched to them
+    if type(request_id) not in (str, int):
+        json_return_error["bad_prediction_request"].append(
+            "'request_id' value should be a string or an integer"
+        )
+
+    return json_return_error
+
+
+def check_key_values_deadline_ms(deadline_ms, json_return_error):
+    if type(deadline_ms) not in (int, float) or not deadline_ms > 0:
+        json_return_error["bad_prediction_request"].append(
+            "'deadline_ms' value should be a positive number of milliseconds"
+        )
+
+    return json_return_error
+
+
+def check_key_values_compression(compression, available_codecs, json_return_error):
+    # "none" switches a connection's compressed responses off again
+    if compression not in available_codecs + ["none"]:
+        json_return_error["bad_prediction_request"].append(
+            "'compression' value should be one of: "
+            + ",".join(f"'{codec}'" for codec in available_codecs + ["none"])
+        )
+
+    return json_return_error
+
+
+def check_key_values_model(model, available_models, json_return_error):
+    # names are matched case-insensitively, like the "model" of the help response
+    if not isinstance(model, str):
+        json_return_error["bad_prediction_request"].append(
+            "'model' value should be a string"
+        )
+    elif model.lower() not in [name.lower() for name in available_models]:
+        json_return_error["bad_prediction_request"].append(
+            f"model '{model}' is not hosted by this predictor. Please choose from: "
+            + ",".join(f"'{name}'" for name in available_models)
+        )
+
+    return json_return_error
+
+
+def check_key_values_tile_stride(evaluator_json, json_return_error):
+    tile_stride = evaluator_json["tile_stride"]
+    if type(tile_stride) is not int or tile_stride < 1:
+        json_return_error["bad_prediction_request"].append(
+            "'tile_stride' value should be a positive integer"
+        )
+    if "prediction_ranges" in evaluator_json.keys():
+        json_return_error["bad_prediction_request"].append(
+            "'tile_stride' cannot be combined with 'prediction_ranges'"
+        )
+    if evaluator_json.get("stream", False) is True:
+        json_return_error["bad_prediction_request"].append(
+            "'tile_stride' cannot be combined with 'stream'"
+        )
+
+    return json_return_error
+
+
+def check_key_values_regions(evaluator_json, json_return_error):
+    errors = json_return_error["bad_prediction_request"]
+    if "sequences" in evaluator_json.keys():
+        errors.append("only one of 'sequences' and 'regions' can be given")
+    regions = evaluator_json["regions"]
+    if not isinstance(regions, dict):
+        errors.append("'regions' should map sequence ids to 'chrom:start-end' regions")
+        return json_return_error
+    for seq_id, region in regions.items():
+        if parse_region(region) is None:
+            errors.append(
+                f"region of {seq_id} should look like 'chrom:start-end' or 'chrom:start-end:-' "
+                "with start < end"
+            )
+
+    return json_return_error
+
+
+def request_sequence_ids(evaluator_json):
+    # ids of the sequences, or of the regions that stand in for them
+    sequences = evaluator_json.get("sequences", evaluator_json.get("regions", {}))
+    return sequences if isinstance(sequences, dict) else {}
+
+
+def check_key_values_mutagenesis(evaluator_json, json_return_error):
+    errors = json_return_error["bad_prediction_request"]
+    is_mutagenesis = evaluator_json["request"] == "mutagenesis"
+    for key in ["mutagenesis_positions", "mutagenesis_variants"]:
+        if key in evaluator_json.keys() and not is_mutagenesis:
+            errors.append(f"'{key}' is only used by 'mutagenesis' requests")
+    if not is_mutagenesis:
+        return json_return_error
+
+    for key in ["tile_stride", "prediction_ranges"]:
+        if key in evaluator_json.keys():
+            errors.append(f"'{key}' cannot be combined with a 'mutagenesis' request")
+    if evaluator_json.get("stream", False) is True:
+        errors.append("'stream' cannot be combined with a 'mutagenesis' request")
+    if (
+        "mutagenesis_positions" in evaluator_json.keys()
+        and "mutagenesis_variants" in evaluator_json.keys()
+    ):
+        errors.append(
+            "only one of 'mutagenesis_positions' and 'mutagenesis_variants' can be given"
+        )
+
+    sequences = request_sequence_ids(evaluator_json)
+    positions = evaluator_json.get("mutagenesis_positions", {})
+    if not isinstance(positions, dict):
+        errors.append(
+            "'mutagenesis_positions' should map sequence ids to lists of positions"
+        )
+        positions = {}
+    for seq_id, seq_positions in positions.items():
+        if seq_id not in sequences:
+            errors.append(f"mutagenesis_positions has an unknown sequence id {seq_id}")
+        elif not isinstance(seq_positions, list) or not all(
+            type(position) is int for position in seq_positions
+        ):
+            errors.append(
+                f"mutagenesis_positions of {seq_id} should be a list of integers"
+            )
+
+    variants = evaluator_json.get("mutagenesis_variants", {})
+    if not isinstance(variants, dict):
+        errors.append(
+            "'mutagenesis_variants' should map sequence ids to lists of [position, base]"
+        )
+        variants = {}
+    for seq_id, seq_variants in variants.items():
+        if seq_id not in sequences:
+            errors.append(f"mutagenesis_variants has an unknown sequence id {seq_id}")
+        elif not isinstance(seq_variants, list) or not all(
+            isinstance(variant, list)
+            and len(variant) == 2
+            and type(variant[0]) is int
+            and variant[1] in ["A", "C", "G", "T"]
+            for variant in seq_variants
+        ):
+            errors.append(
+                f"mutagenesis_variants of {seq_id} should be a list of [position, base] "
+                "with base one of A, C, G or T"
+            )
+
+    return json_return_error
+
+
+def validate_request(
+    evaluator_json,
+    json_return_error,
+    supported_species=None,
+    available_models=None,
+    available_codecs=None,
+):
+    """
+    Runs all request checks in a single traversal of the prediction tasks. Errors come out in the
+    same order as calling the check_* functions one after another: if mandatory keys are missing
+    only those errors are returned, otherwise the errors of the value checks.
+    If `supported_species` (a name or a list of names) is given, the first task asking for another
+    species is reported. If `available_models` is given, a "model" field has to name one of them,
+    and if `available_codecs` is given, a "compression" field has to name one of those or "none".
+    """
+    if isinstance(supported_species, str):
+        supported_species = [supported_species]
+    mandatory_errors = json_return_error["bad_prediction_request"]
+    check_mandatory_keys(evaluator_json.keys(), json_return_error)
+    if "request" in evaluator_json:
+        check_request(evaluator_json["request"], json_return_error)
+
+    # per-check error lists, concatenated in the order the checks used to run
+    task_missing_errors = []
+    name_errors = []
+    type_errors = []
+    cell_type_errors = []
+    species_errors = []
+    unsupported_species_error = None
+    prediction_tasks = evaluator_json.get("prediction_tasks", [])
+    for prediction_task in prediction_tasks:
+        if not PREDICTION_TASK_MANDATORY_KEYS.issubset(prediction_task.keys()):
+            check_task_mandatory_keys(prediction_task, task_missing_errors)
+            continue
+        check_task_name(prediction_task, name_errors)
+        check_task_type(prediction_task, type_errors)
+        check_task_cell_type(prediction_task, cell_type_errors)
+        check_task_species(prediction_task, species_errors)
+        species = prediction_task["species"]
+        if (
+            supported_species is not None
+            and unsupported_species_error is None
+            and isinstance(species, str)
+            and species.lower() not in [name.lower() for name in supported_species]
+        ):
+            unsupported_species_error = f"This predictor only supports species: {', '.join(supported_species)}. Received '{species}' for task '{prediction_task['name']}'."
+
+    mandatory_errors.extend(task_missing_errors)
+    # if any of the mandatory keys are missing return only those errors
+    if mandatory_errors:
+        return json_return_error
+
+    check_key_values_readout(evaluator_json["readout"], json_return_error)
+    errors = json_return_error["bad_prediction_request"]
+    errors.extend(name_errors)
+    errors.extend(type_errors)
+    errors.extend(cell_type_errors)
+    errors.extend(species_errors)
+    if "prediction_ranges" in evaluator_json.keys():
+        check_seq_ids(
+            evaluator_json["prediction_ranges"],
+            request_sequence_ids(evaluator_json),
+            json_return_error,
+        )
+        check_prediction_ranges(evaluator_json["prediction_ranges"], json_return_error)
+    if "upstream_seq" in evaluator_json.keys():
+        check_key_values_upstream_flank(
+            evaluator_json["upstream_seq"], json_return_error
+        )
+    if "downstream_seq" in evaluator_json.keys():
+        check_key_values_downstream_flank(
+            evaluator_json["downstream_seq"], json_return_error
+        )
+    if "stream" in evaluator_json.keys():
+        check_key_values_stream(evaluator_json["stream"], json_return_error)
+    if "model" in evaluator_json.keys() and available_models is not None:
+        check_key_values_model(
+            evaluator_json["model"], available_models, json_return_error
+        )
+    if "compression" in evaluator_json.keys() and available_codecs is not None:
+        check_key_values_compression(
+            evaluator_json["compression"], available_codecs, json_return_error
+        )
+    if "request_id" in evaluator_json.keys():
+        check_key_values_request_id(evaluator_json["request_id"], json_return_error)
+    if "deadline_ms" in evaluator_json.keys():
+        check_key_values_deadline_ms(evaluator_json["deadline_ms"], json_return_error)
+    if "tile_stride" in evaluator_json.keys():
+        check_key_values_tile_stride(evaluator_json, json_return_error)
+    if "regions" in evaluator_json.keys():
+        check_key_values_regions(evaluator_json, json_return_error)
+    check_key_values_mutagenesis(evaluator_json, json_return_error)
+    if unsupported_species_error is not None:
+        errors.append(unsupported_species_error)
+    return json_return_error
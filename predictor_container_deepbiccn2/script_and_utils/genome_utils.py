@@ -0,0 +1,234 @@
+import os
+import re
+import mmap
+import struct
+
+import numpy as np
+
+# chrom:start-end with an optional :+ or :- strand, 0-based and end exclusive like BED and CREsted region names
+REGION_PATTERN = re.compile(r"^([^:\s]+):(\d+)-(\d+)(?::([+-]))?$")
+
+# byte lookup of the reverse strand base, other characters are kept as they are
+COMPLEMENT_LOOKUP = np.arange(256, dtype=np.uint8)
+COMPLEMENT_LOOKUP[np.frombuffer(b"ACGTNacgtn", dtype=np.uint8)] = np.frombuffer(
+    b"TGCANtgcan", dtype=np.uint8
+)
+
+NEWLINE_BYTES = np.frombuffer(b"\n\r", dtype=np.uint8)
+
+TWO_BIT_SIGNATURE = 0x1A412743
+# the four bases packed in every 2bit byte, most significant bits first (T=0, C=1, A=2, G=3)
+TWO_BIT_LOOKUP = np.frombuffer(b"TCAG", dtype=np.uint8)[
+    (np.arange(256)[:, None] >> np.array([6, 4, 2, 0])) & 3
+]
+
+
+def parse_region(region):
+    """
+    Returns (chrom, start, end, strand) of a "chrom:start-end[:strand]" region, or None if it is malformed.
+    """
+    if not isinstance(region, str):
+        return None
+    match = REGION_PATTERN.match(region)
+    if match is None:
+        return None
+    chrom, start, end, strand = match.groups()
+    start, end = int(start), int(end)
+    if start >= end:
+        return None
+    return chrom, start, end, strand or "+"
+
+
+class FastaGenome:
+    """
+    Reads regions of a FASTA genome through a read-only memory map. The .fai index gives every
+    chromosome's length, byte offset and line layout, so a region is one slice of the mapped
+    file with its line breaks dropped.
+    """
+
+    def __init__(self, fasta_path, fai_path=None):
+        self.path = fasta_path
+        fai_path = fai_path or fasta_path + ".fai"
+        with open(fasta_path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.bytes = np.frombuffer(self.data, dtype=np.uint8)
+        if os.path.exists(fai_path):
+            self.index = self._read_fai(fai_path)
+        else:
+            print(f"No index {fai_path}, indexing {fasta_path}")
+            self.index = self._build_index()
+        print(f"Opened genome {fasta_path} with {len(self.index)} sequences")
+
+    @staticmethod
+    def _read_fai(fai_path):
+        # name, length, offset of the first base, bases per line, bytes per line
+        index = {}
+        with open(fai_path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) >= 5:
+                    index[fields[0]] = tuple(int(value) for value in fields[1:5])
+        return index
+
+    def _build_index(self):
+        # same layout as samtools faidx, assumes every sequence has lines of equal length
+        index = {}
+        name = None
+        length = offset = line_bases = line_bytes = 0
+        position = 0
+        for line in iter(self.data.readline, b""):
+            if line.startswith(b">"):
+                if name is not None:
+                    index[name] = (length, offset, line_bases, line_bytes)
+                name = line[1:].split()[0].decode()
+                length = line_bases = line_bytes = 0
+                offset = position + len(line)
+            elif name is not None:
+                if line_bases == 0:
+                    line_bases = len(line.rstrip(b"\r\n"))
+                    line_bytes = len(line)
+                length += len(line.rstrip(b"\r\n"))
+            position += len(line)
+        if name is not None:
+            index[name] = (length, offset, line_bases, line_bytes)
+        self.data.seek(0)
+        return index
+
+    def chromosome_length(self, chrom):
+        return self.index[chrom][0] if chrom in self.index else None
+
+    def fetch(self, chrom, start, end):
+        """
+        Returns the forward strand bases [start, end) of `chrom` as uint8 ASCII codes.
+        """
+        _, offset, line_bases, line_bytes = self.index[chrom]
+        first = offset + start // line_bases * line_bytes + start % line_bases
+        last = offset + (end - 1) // line_bases * line_bytes + (end - 1) % line_bases
+        window = self.bytes[first : last + 1]
+        return window[~np.isin(window, NEWLINE_BYTES)]
+
+
+class TwoBitGenome:
+    """
+    Reads regions of a UCSC .2bit genome through a read-only memory map. Sequence records are
+    located from the file index, a region is unpacked from its packed bytes with a lookup table
+    and its N blocks are filled in. Soft-masking is ignored, it does not change the encoding.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.bytes = np.frombuffer(self.data, dtype=np.uint8)
+        signature = struct.unpack("<I", self.data[:4])[0]
+        self.endian = "<" if signature == TWO_BIT_SIGNATURE else ">"
+        signature, version, n_sequences, _ = struct.unpack(
+            self.endian + "IIII", self.data[:16]
+        )
+        if signature != TWO_BIT_SIGNATURE:
+            raise ValueError(f"{path} is not a 2bit file")
+        # version 1 files use 64-bit record offsets
+        offset_format = "Q" if version == 1 else "I"
+        offset_size = struct.calcsize(offset_format)
+        self.record_offsets = {}
+        position = 16
+        for _ in range(n_sequences):
+            name_size = self.data[position]
+            name = self.data[position + 1 : position + 1 + name_size].decode()
+            position += 1 + name_size
+            self.record_offsets[name] = struct.unpack(
+                self.endian + offset_format,
+                self.data[position : position + offset_size],
+            )[0]
+            position += offset_size
+        self.records = {}
+        print(f"Opened genome {path} with {len(self.record_offsets)} sequences")
+
+    def _read_uint32s(self, position, count):
+        values = np.frombuffer(
+            self.data, dtype=self.endian + "u4", count=count, offset=position
+        )
+        return values.astype(np.int64), position + 4 * count
+
+    def _record(self, chrom):
+        # dna size, N block starts and ends, offset of the packed bases, parsed once per chromosome
+        if chrom not in self.records:
+            position = self.record_offsets[chrom]
+            (dna_size,), position = self._read_uint32s(position, 1)
+            (n_blocks,), position = self._read_uint32s(position, 1)
+            n_starts, position = self._read_uint32s(position, n_blocks)
+            n_sizes, position = self._read_uint32s(position, n_blocks)
+            (mask_blocks,), position = self._read_uint32s(position, 1)
+            # mask block starts and sizes, then a reserved word
+            position += 8 * mask_blocks + 4
+            self.records[chrom] = (dna_size, n_starts, n_starts + n_sizes, position)
+        return self.records[chrom]
+
+    def chromosome_length(self, chrom):
+        if chrom not in self.record_offsets:
+            return None
+        return self._record(chrom)[0]
+
+    def fetch(self, chrom, start, end):
+        """
+        Returns the forward strand bases [start, end) of `chrom` as uint8 ASCII codes.
+        """
+        _, n_starts, n_ends, dna_offset = self._record(chrom)
+        packed = self.bytes[dna_offset + start // 4 : dna_offset + (end - 1) // 4 + 1]
+        bases = TWO_BIT_LOOKUP[packed].ravel()[start % 4 : start % 4 + end - start]
+        overlapping = np.flatnonzero((n_starts < end) & (n_ends > start))
+        if overlapping.size:
+            bases = bases.copy()
+            for block in overlapping:
+                bases[
+                    max(n_starts[block], start)
+                    - start : min(n_ends[block], end)
+                    - start
+                ] = ord("N")
+        return bases
+
+
+def open_genome(path):
+    """
+    Opens a .2bit genome, or a FASTA genome with its .fai index.
+    """
+    if path.endswith(".2bit"):
+        return TwoBitGenome(path)
+    return FastaGenome(path)
+
+
+def resolve_regions(
+    genome, regions, json_return_error_model, region_length=None, tiled=False
+):
+    """
+    Returns {seq_id: sequence} of {seq_id: region}, reverse complemented for "-" strand regions.
+    Regions that cannot be read are reported in `json_return_error_model`. If `region_length` is
+    given, regions of another length (shorter ones if `tiled`) are reported without being read.
+    """
+    sequences = {}
+    for seq_id, region in regions.items():
+        chrom, start, end, strand = parse_region(region)
+        chrom_length = genome.chromosome_length(chrom)
+        if chrom_length is None:
+            json_return_error_model["prediction_request_failed"].append(
+                f"region {region} of {seq_id} is on a sequence that is not in the genome"
+            )
+            continue
+        if end > chrom_length:
+            json_return_error_model["prediction_request_failed"].append(
+                f"region {region} of {seq_id} extends past the end of {chrom} ({chrom_length} bp)"
+            )
+            continue
+        if region_length is not None and (
+            end - start < region_length if tiled else end - start != region_length
+        ):
+            json_return_error_model["prediction_request_failed"].append(
+                f"region {region} of {seq_id} is {end - start} bp, it should be "
+                f"{'at least ' if tiled else ''}{region_length} bp"
+            )
+            continue
+        bases = genome.fetch(chrom, start, end)
+        if strand == "-":
+            bases = COMPLEMENT_LOOKUP[bases[::-1]]
+        sequences[seq_id] = bases.tobytes().decode("ascii")
+    return sequences
@@ -0,0 +1,324 @@
+import os
+import time
+import queue
+import atexit
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from metrics_utils import METRICS
+from crested_utils import (
+    INPUT_LENGTH,
+    MODEL_PATH,
+    DEFAULT_MODEL,
+    one_hot_encode,
+)
+
+
+def _worker_main(
+    models_dir,
+    default_model,
+    input_name,
+    output_name,
+    capacity,
+    n_outputs,
+    conn,
+    intra_op_threads,
+    inter_op_threads,
+    autotune=False,
+):
+    """
+    Inference worker process: loads its own copy of the default model (and tunes its batch size
+    up to `capacity` with `autotune`), then predicts the one-hot batches the server writes into its
+    input buffer with the model they name and writes the predictions into its output buffer.
+    Other hosted models are loaded on first use and unloaded within the model memory budget.
+    """
+    # thread settings have to be in place before TensorFlow starts its thread pools
+    if intra_op_threads:
+        os.environ["TF_NUM_INTRAOP_THREADS"] = str(intra_op_threads)
+        os.environ["OMP_NUM_THREADS"] = str(intra_op_threads)
+    if inter_op_threads:
+        os.environ["TF_NUM_INTEROP_THREADS"] = str(inter_op_threads)
+    from crested_utils import ModelCatalog
+
+    try:
+        import tensorflow as tf
+
+        if intra_op_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        if inter_op_threads:
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except ImportError:
+        pass
+
+    model_catalog = ModelCatalog(models_dir, default_model)
+    model_registry = model_catalog.load_default()
+    if autotune:
+        model_registry.autotune_batch_size(capacity)
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    inputs = np.ndarray(
+        (capacity * INPUT_LENGTH * 4,), dtype=np.float32, buffer=input_shm.buf
+    )
+    outputs = np.ndarray((capacity, n_outputs), dtype=np.float32, buffer=output_shm.buf)
+    conn.send(("ready", model_registry.timings()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        n_seqs, seq_length, model = message
+        one_hot = inputs[: n_seqs * seq_length * 4].reshape(n_seqs, seq_length, 4)
+        try:
+            with model_catalog.use(model) as registry:
+                predictions = registry.predict(one_hot)
+            # rows are as wide as the model's outputs, the buffer as the widest hosted model's
+            outputs[:n_seqs, : predictions.shape[1]] = predictions
+            conn.send(("ok", n_seqs))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _Worker:
+    """
+    One inference worker process with its shared input and output buffers.
+    """
+
+    def __init__(self, worker_id, capacity, n_outputs):
+        self.worker_id = worker_id
+        self.input_shm = shared_memory.SharedMemory(
+            create=True, size=capacity * INPUT_LENGTH * 4 * 4
+        )
+        self.output_shm = shared_memory.SharedMemory(
+            create=True, size=max(capacity, 1) * n_outputs * 4
+        )
+        self.inputs = np.ndarray(
+            (capacity * INPUT_LENGTH * 4,), dtype=np.float32, buffer=self.input_shm.buf
+        )
+        self.outputs = np.ndarray(
+            (capacity, n_outputs), dtype=np.float32, buffer=self.output_shm.buf
+        )
+        self.process = None
+        self.conn = None
+        self.ready = False
+
+
+class InferencePool:
+    """
+    Pool of worker processes that each hold a resident copy of the default model, and load
+    the other hosted models when a batch needs them. `n_outputs` maps every hosted model to
+    its number of outputs. Batches are
+    one-hot encoded straight into a worker's shared input buffer and the predictions are
+    read back from its shared output buffer, so no arrays are pickled between processes.
+    A worker that dies is restarted, the batch it was running fails.
+    """
+
+    def __init__(
+        self,
+        n_workers,
+        n_outputs,
+        max_batch_size=256,
+        models_dir=MODEL_PATH,
+        default_model=DEFAULT_MODEL,
+        intra_op_threads=0,
+        inter_op_threads=0,
+        autotune=False,
+    ):
+        self.n_workers = n_workers
+        self.n_outputs = n_outputs
+        # sequences of INPUT_LENGTH bases that fit in one worker's buffers
+        self.capacity = max_batch_size
+        self.models_dir = models_dir
+        self.default_model = default_model
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.autotune = autotune
+        # sequences per forward pass, the smallest one the workers tuned with `autotune`
+        self.batch_size = max_batch_size
+        # spawned workers start without the server's threads and TensorFlow state
+        self.context = mp.get_context("spawn")
+        self.workers = [
+            _Worker(worker_id, self.capacity, max(n_outputs.values()))
+            for worker_id in range(n_workers)
+        ]
+        self.idle_workers = queue.Queue()
+        self.restarts = 0
+        self.startup_time = None
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _start_worker(self, worker):
+        parent_conn, child_conn = self.context.Pipe()
+        worker.process = self.context.Process(
+            target=_worker_main,
+            args=(
+                self.models_dir,
+                self.default_model,
+                worker.input_shm.name,
+                worker.output_shm.name,
+                self.capacity,
+                max(self.n_outputs.values()),
+                child_conn,
+                self.intra_op_threads,
+                self.inter_op_threads,
+                self.autotune,
+            ),
+            name=f"inference-worker-{worker.worker_id}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+        worker.ready = False
+
+    def _restart_worker(self, worker):
+        exitcode = worker.process.exitcode
+        worker.conn.close()
+        worker.process.join()
+        with self.lock:
+            self.restarts += 1
+        METRICS.add("inference_worker_restarts")
+        print(
+            f"Inference worker {worker.worker_id} exited with code {exitcode}, restarting it"
+        )
+        self._start_worker(worker)
+        return exitcode
+
+    def _receive(self, worker):
+        # waits for the worker's reply, restarting it if it died instead of answering
+        wait([worker.conn, worker.process.sentinel])
+        try:
+            if worker.conn.poll():
+                return worker.conn.recv()
+        except (EOFError, OSError):
+            pass
+        exitcode = self._restart_worker(worker)
+        raise RuntimeError(
+            f"Inference worker {worker.worker_id} exited with code {exitcode}"
+        )
+
+    def _wait_ready(self, worker):
+        _, timings = self._receive(worker)
+        worker.ready = True
+        return timings
+
+    def start(self):
+        """
+        Starts the workers and waits until every one has loaded and warmed up its model.
+        """
+        start = time.perf_counter()
+        for worker in self.workers:
+            self._start_worker(worker)
+        for worker in self.workers:
+            timings = self._wait_ready(worker)
+            self.batch_size = min(
+                self.batch_size, timings.get("batch_size") or self.capacity
+            )
+            self.idle_workers.put(worker)
+        self.startup_time = time.perf_counter() - start
+        print(
+            f"Started {self.n_workers} inference workers in {self.startup_time:.2f}s "
+            f"(intra-op threads {self.intra_op_threads or 'default'}, "
+            f"inter-op threads {self.inter_op_threads or 'default'})"
+        )
+        return self
+
+    def _predict_on(self, worker, one_hot, out, model):
+        # the batch is already in the worker's input buffer
+        with METRICS.timer("model"):
+            try:
+                worker.conn.send(one_hot.shape[:2] + (model,))
+            except OSError:
+                exitcode = self._restart_worker(worker)
+                raise RuntimeError(
+                    f"Inference worker {worker.worker_id} exited with code {exitcode}"
+                )
+            status, result = self._receive(worker)
+        if status != "ok":
+            raise RuntimeError(result)
+        out[:] = worker.outputs[: len(out), : out.shape[1]]
+
+    def _predict_rows(self, n_seqs, seq_length, fill_rows, model=None):
+        # runs n_seqs sequences on the next idle worker, as many per call as its buffers hold;
+        # fill_rows(start, end, one_hot) writes rows start:end into the worker's input buffer
+        if seq_length > INPUT_LENGTH:
+            raise ValueError(
+                f"sequences longer than {INPUT_LENGTH} bases do not fit the inference workers"
+            )
+        model = model or self.default_model
+        predictions = np.empty((n_seqs, self.n_outputs[model]), dtype=np.float32)
+        # shorter sequences (prediction_ranges) fit more rows in the buffers
+        rows_per_call = min(
+            self.capacity * INPUT_LENGTH // max(seq_length, 1), self.capacity
+        )
+        worker = self.idle_workers.get()
+        try:
+            if not worker.process.is_alive():
+                # died while idle, replace it before giving it this batch
+                self._restart_worker(worker)
+            if not worker.ready:
+                self._wait_ready(worker)
+            for start in range(0, n_seqs, rows_per_call):
+                end = min(start + rows_per_call, n_seqs)
+                one_hot = worker.inputs[: (end - start) * seq_length * 4].reshape(
+                    end - start, seq_length, 4
+                )
+                fill_rows(start, end, one_hot)
+                self._predict_on(worker, one_hot, predictions[start:end], model)
+        finally:
+            self.idle_workers.put(worker)
+        return predictions
+
+    def predict(self, seqs: list, model=None) -> np.ndarray:
+        """
+        Predicts equal-length sequences with a hosted model (the default one if None) on the
+        next idle worker and returns the (N, C) predictions.
+        The sequences are one-hot encoded straight into the worker's input buffer.
+        """
+
+        def encode_rows(start, end, one_hot):
+            with METRICS.timer("encode"):
+                one_hot_encode(seqs[start:end], out=one_hot)
+
+        return self._predict_rows(
+            len(seqs), len(seqs[0]) if seqs else 0, encode_rows, model
+        )
+
+    def predict_encoded(self, one_hot: np.ndarray, model=None) -> np.ndarray:
+        """
+        Predicts an already encoded (N, L, 4) batch, e.g. strided window views, on the next
+        idle worker and returns the (N, C) predictions.
+        """
+
+        def copy_rows(start, end, out):
+            out[:] = one_hot[start:end]
+
+        return self._predict_rows(len(one_hot), one_hot.shape[1], copy_rows, model)
+
+    def idle_worker_count(self):
+        return self.idle_workers.qsize()
+
+    def close(self):
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            worker.process = None
+            # drop the views before closing the shared memory they point into
+            worker.inputs = worker.outputs = None
+            worker.input_shm.close()
+            worker.input_shm.unlink()
+            worker.output_shm.close()
+            worker.output_shm.unlink()
+        self.workers = []
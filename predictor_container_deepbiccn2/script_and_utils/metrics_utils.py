@@ -0,0 +1,225 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, roughly 3 per decade from 50 us to 10 min
+LATENCY_BUCKETS = [
+    round(mantissa * 10.0**exponent, 6)
+    for exponent in range(-5, 3)
+    for mantissa in (1, 2.5, 5)
+    if 5e-5 <= mantissa * 10.0**exponent <= 600
+]
+# Upper bounds of the compression ratio (uncompressed / compressed bytes) histogram buckets
+RATIO_BUCKETS = [1, 1.5, 2, 3, 4, 6, 8, 12, 16, 32, 64]
+
+# Request stages timed by the predictor, in the order a request goes through them
+STAGES = [
+    "receive",
+    "decompress",
+    "parse",
+    "validate",
+    "regions",
+    "flank",
+    "validate_sequences",
+    "encode",
+    "model",
+    "inference",
+    "format",
+    "compress",
+    "send",
+]
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram. Observing is a bisect and a few additions,
+    percentiles are estimated by interpolating inside the bucket they fall in.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max)
+            seen += bucket_count
+        return self.max
+
+    def summary(self, unit="_s"):
+        return {
+            "count": self.count,
+            f"sum{unit}": self.sum,
+            f"mean{unit}": self.sum / self.count if self.count else None,
+            f"p50{unit}": self.percentile(0.5),
+            f"p90{unit}": self.percentile(0.9),
+            f"p99{unit}": self.percentile(0.99),
+            f"max{unit}": self.max,
+        }
+
+
+class PredictorMetrics:
+    """
+    Per-stage timing histograms and counters of the predictor, shared by all connections,
+    plus per-message compression ratio histograms.
+    Gauges are either adjusted with `adjust_gauge` or read from callables registered with
+    `register_gauge` when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.stages = {stage: Histogram() for stage in STAGES}
+        self.counters = {
+            "requests": 0,
+            "prediction_requests": 0,
+            "failed_requests": 0,
+            "sequences": 0,
+            "model_sequences": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+        self.ratios = {}
+        self.gauges = {}
+        self.gauge_values = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    def observe_ratio(self, name, ratio):
+        with self.lock:
+            if name not in self.ratios:
+                self.ratios[name] = Histogram(RATIO_BUCKETS)
+            self.ratios[name].observe(ratio)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def add(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def adjust_gauge(self, name, delta):
+        with self.lock:
+            self.gauge_values[name] = self.gauge_values.get(name, 0) + delta
+
+    def register_gauge(self, name, read_fn):
+        self.gauges[name] = read_fn
+
+    def read_gauges(self):
+        with self.lock:
+            gauges = dict(self.gauge_values)
+        gauges.update({name: read_fn() for name, read_fn in self.gauges.items()})
+        return gauges
+
+    def snapshot(self):
+        with self.lock:
+            stages = {
+                stage: histogram.summary()
+                for stage, histogram in self.stages.items()
+                if histogram.count
+            }
+            ratios = {
+                name: histogram.summary(unit="")
+                for name, histogram in self.ratios.items()
+            }
+            counters = dict(self.counters)
+        uptime = time.time() - self.start_time
+        model_time = stages.get("model", {}).get("sum_s")
+        return {
+            "uptime_s": uptime,
+            "counters": counters,
+            "gauges": self.read_gauges(),
+            "throughput": {
+                # over the whole uptime, and over the time spent inside the model only
+                "sequences_per_s": counters["sequences"] / uptime if uptime else 0.0,
+                "model_sequences_per_s": (
+                    counters["model_sequences"] / model_time if model_time else None
+                ),
+            },
+            "stages": stages,
+            "compression_ratios": ratios,
+        }
+
+    def prometheus_text(self, extra_counters=None):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {
+                stage: (list(h.counts), h.count, h.sum)
+                for stage, h in self.stages.items()
+            }
+            ratios = {
+                name: (list(h.counts), h.count, h.sum)
+                for name, h in self.ratios.items()
+            }
+        counters.update(extra_counters or {})
+        for name, value in counters.items():
+            lines.append(f"# TYPE predictor_{name}_total counter")
+            lines.append(f"predictor_{name}_total {value}")
+        for name, value in self.read_gauges().items():
+            lines.append(f"# TYPE predictor_{name} gauge")
+            lines.append(f"predictor_{name} {value}")
+        lines.append("# TYPE predictor_stage_seconds histogram")
+        for stage, (counts, count, total) in histograms.items():
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'predictor_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'predictor_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}'
+            )
+            lines.append(f'predictor_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(f'predictor_stage_seconds_count{{stage="{stage}"}} {count}')
+        if ratios:
+            lines.append("# TYPE predictor_compression_ratio histogram")
+        for name, (counts, count, total) in ratios.items():
+            cumulative = 0
+            for bound, bucket_count in zip(RATIO_BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'predictor_compression_ratio_bucket{{message="{name}",le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'predictor_compression_ratio_bucket{{message="{name}",le="+Inf"}} {count}'
+            )
+            lines.append(f'predictor_compression_ratio_sum{{message="{name}"}} {total}')
+            lines.append(
+                f'predictor_compression_ratio_count{{message="{name}"}} {count}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of this predictor process
+METRICS = PredictorMetrics()
@@ -0,0 +1,165 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from protocol_utils import add_response_field
+
+
+class RequestReply:
+    """
+    Sends the responses of one request on its connection. Responses carry the request's
+    "request_id" when it sent one and go out as soon as they are ready; requests without an ID
+    reply in the order they arrived, after every earlier request without an ID has replied.
+    Responses are compressed with the codec the connection had negotiated when the request arrived.
+    """
+
+    def __init__(self, pipeline, request_id=None, turn=None, cancel_token=None):
+        self.pipeline = pipeline
+        self.request_id = request_id
+        self.client = pipeline.client
+        self.cancel_token = cancel_token
+        self.compression = pipeline.compression
+        # position among the connection's requests without an ID, None for requests with one
+        self.turn = turn
+        self.has_turn = turn is None
+
+    def _wait_turn(self):
+        if not self.has_turn:
+            self.pipeline._wait_turn(self.turn)
+            self.has_turn = True
+
+    def send(self, payload):
+        self._wait_turn()
+        if self.request_id is not None:
+            payload = add_response_field(payload, "request_id", self.request_id)
+        if self.compression is not None and self.pipeline.compress_fn is not None:
+            # compressed before taking the send lock, other responses go out meanwhile
+            payload = self.pipeline.compress_fn(payload, self.compression)
+        with self.pipeline.send_lock:
+            self.pipeline.send_fn(self.pipeline.client_socket, payload)
+
+    def finish(self):
+        """
+        Marks the request as answered, lets the next request without an ID reply.
+        """
+        if self.turn is not None:
+            self._wait_turn()
+            self.pipeline._next_turn()
+        self.pipeline._untrack(self)
+
+
+class ConnectionPipeline:
+    """
+    Processes the requests of one connection while the next ones are still being received.
+    Up to `window` requests are in flight at a time, the receiving thread blocks in `submit`
+    once the window is full. `send_fn(client_socket, payload)` sends one response message.
+    `client` identifies the connection for fair scheduling of its requests.
+    `compress_fn(payload, codec)` compresses responses once a request set `compression`.
+    """
+
+    def __init__(self, client_socket, window, send_fn, client=None, compress_fn=None):
+        self.client_socket = client_socket
+        self.send_fn = send_fn
+        self.client = client
+        self.compress_fn = compress_fn
+        # codec of the responses negotiated by the connection's requests, None sends them as is
+        self.compression = None
+        # requests that have not finished, cancelled when the connection is lost
+        self._in_flight = set()
+        self._in_flight_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self._window = threading.BoundedSemaphore(window)
+        self._executor = ThreadPoolExecutor(window, thread_name_prefix="request")
+        self._turns = threading.Condition()
+        self._issued_turns = 0
+        self._current_turn = 0
+        self.failed = threading.Event()
+
+    def reply(self, request_id=None, cancel_token=None):
+        """
+        Returns the RequestReply of the next received request.
+        """
+        if request_id is not None:
+            reply = RequestReply(self, request_id, cancel_token=cancel_token)
+        else:
+            reply = RequestReply(
+                self, turn=self._issued_turns, cancel_token=cancel_token
+            )
+            self._issued_turns += 1
+        with self._in_flight_lock:
+            self._in_flight.add(reply)
+        return reply
+
+    def _untrack(self, reply):
+        with self._in_flight_lock:
+            self._in_flight.discard(reply)
+
+    def cancel_all(self, reason):
+        """
+        Cancels the requests still in flight, they stop at their next inference chunk.
+        """
+        with self._in_flight_lock:
+            replies = list(self._in_flight)
+        for reply in replies:
+            if reply.cancel_token is not None:
+                reply.cancel_token.cancel(reason)
+
+    def _wait_turn(self, turn):
+        with self._turns:
+            self._turns.wait_for(lambda: self._current_turn == turn)
+
+    def _next_turn(self):
+        with self._turns:
+            self._current_turn += 1
+            self._turns.notify_all()
+
+    def send_now(self, payload, request_id=None):
+        """
+        Sends a response from the receiving thread, in order with the requests already in flight.
+        Returns False if the connection is lost.
+        """
+        reply = self.reply(request_id)
+        try:
+            reply.send(payload)
+            return True
+        except socket.error as e:
+            print(f"server_error: Error sending response: {e}")
+            return False
+        finally:
+            reply.finish()
+
+    def submit(self, serve_fn, reply, *args):
+        """
+        Runs serve_fn(reply, *args) on the pipeline once a window slot is free. serve_fn returns
+        False when the connection has to be closed, the receiving thread is then woken up.
+        """
+        self._window.acquire()
+        self._executor.submit(self._serve, serve_fn, reply, *args)
+
+    def _serve(self, serve_fn, reply, *args):
+        keep_open = False
+        try:
+            keep_open = serve_fn(reply, *args)
+        except Exception as e:
+            print(f"Error serving request: {e}")
+        finally:
+            reply.finish()
+            self._window.release()
+        if not keep_open:
+            self.fail()
+
+    def fail(self):
+        # stops the receiving thread, which may be blocked reading the next request,
+        # and the other requests in flight since their responses cannot be sent either
+        self.failed.set()
+        self.cancel_all("the connection to the Evaluator was lost")
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Waits for the requests in flight to send their responses.
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,415 @@
+import json
+import struct
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # fall back to the standard library parser
+    orjson = None
+
+
+def recv_into_buffer(client_socket, buffer, progress=None, progress_step=0):
+    """
+    Fills `buffer` from the socket without intermediate copies.
+    Returns the number of bytes received, which is less than len(buffer) if the connection closed early.
+    """
+    view = memoryview(buffer)
+    received = 0
+    reported = 0
+    while received < len(buffer):
+        n_bytes = client_socket.recv_into(view[received:])
+        if n_bytes == 0:
+            break
+        received += n_bytes
+        # only touch the progress bar every `progress_step` bytes
+        if progress is not None and received - reported >= progress_step:
+            progress.update(received - reported)
+            reported = received
+    if progress is not None and received > reported:
+        progress.update(received - reported)
+    view.release()
+    return received
+
+
+def loads_buffer(buffer):
+    """
+    Parses a JSON message straight from a received bytes-like buffer.
+    """
+    if orjson is not None:
+        # orjson reads bytearray/memoryview input without decoding it to a str first
+        return orjson.loads(buffer)
+    return json.loads(buffer)
+
+
+def dumps_bytes(obj):
+    """
+    Serializes an object to UTF-8 JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+# ---------------------- Incremental JSON parsing ----------------------
+# Bytes received per socket read by the incremental parser, the only payload buffer it keeps
+STREAM_PARSE_WINDOW = 1024 * 1024
+
+_WHITESPACE = frozenset(b" \t\n\r")
+# bytes that end a number or a true/false/null literal
+_SCALAR_END = frozenset(b" \t\n\r,]}")
+_QUOTE, _BACKSLASH, _COLON, _COMMA = b'"\\:,'
+_OPEN_OBJECT, _CLOSE_OBJECT, _OPEN_ARRAY, _CLOSE_ARRAY = b"{}[]"
+
+
+class IncrementalJsonReader:
+    """
+    Parses one JSON message while it is still arriving on the socket. The payload is received
+    into one reused window and parsed as it arrives, so it is never held as a whole: string
+    values such as sequences are decoded once, straight from the window, into the parsed object.
+    `client_socket` can be any object with recv_into, with `n_bytes` None it is read until it
+    returns 0, e.g. a DecompressingReader whose decompressed length is not known up front.
+    """
+
+    def __init__(
+        self,
+        client_socket,
+        n_bytes,
+        prefix=b"",
+        progress=None,
+        progress_step=0,
+        window=STREAM_PARSE_WINDOW,
+    ):
+        self.socket = client_socket
+        # bytes of the message still to be received, None if only the end of the source tells
+        self.remaining = n_bytes
+        self.received = 0
+        self.progress = progress
+        self.progress_step = progress_step
+        self.reported = 0
+        self.buffer = bytearray(max(window, len(prefix)))
+        self.view = memoryview(self.buffer)
+        self.buffer[: len(prefix)] = prefix
+        # unparsed bytes are buffer[pos:end]
+        self.pos = 0
+        self.end = len(prefix)
+        # offset of buffer[0] in the message, for error messages
+        self.offset = 0
+
+    def _fill(self):
+        # receives the next part of the message into the window, returns False at its end
+        if self.remaining == 0:
+            return False
+        self.offset += self.end
+        self.pos = self.end = 0
+        window = len(self.buffer)
+        if self.remaining is not None:
+            window = min(window, self.remaining)
+        n_bytes = self.socket.recv_into(self.view[:window])
+        if n_bytes == 0:
+            if self.remaining is None:
+                self.remaining = 0
+                return False
+            raise ConnectionError("connection closed before the request was complete")
+        self.end = n_bytes
+        if self.remaining is not None:
+            self.remaining -= n_bytes
+        self.received += n_bytes
+        if self.progress is not None and (
+            self.received - self.reported >= self.progress_step or self.remaining == 0
+        ):
+            self.progress.update(self.received - self.reported)
+            self.reported = self.received
+        return True
+
+    def _error(self, message):
+        return ValueError(f"{message} at byte {self.offset + self.pos}")
+
+    def _peek(self):
+        while self.pos == self.end:
+            if not self._fill():
+                raise self._error("unexpected end of the JSON message")
+        return self.buffer[self.pos]
+
+    def _skip_whitespace(self):
+        while True:
+            while self.pos < self.end and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < self.end or not self._fill():
+                return
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self._error(f"expected {chr(char)!r}")
+        self.pos += 1
+
+    def _string(self):
+        self._expect(_QUOTE)
+        # parts of a string that spans several windows
+        parts = []
+        while True:
+            end = self.buffer.find(b'"', self.pos, self.end)
+            if end == -1:
+                parts.append(bytes(self.view[self.pos : self.end]))
+                self.pos = self.end
+                if not self._fill():
+                    raise self._error("unterminated string")
+                continue
+            if parts or (end > self.pos and self.buffer[end - 1] == _BACKSLASH):
+                parts.append(bytes(self.view[self.pos : end]))
+                raw = b"".join(parts)
+                self.pos = end + 1
+                # a quote after an odd number of backslashes is part of the string
+                if (len(raw) - len(raw.rstrip(b"\\"))) % 2:
+                    parts = [raw + b'"']
+                    continue
+                if b"\\" in raw:
+                    return json.loads(b'"' + raw + b'"')
+                return raw.decode("utf-8")
+            # the common case, an unescaped string inside the window is decoded in place
+            start, self.pos = self.pos, end + 1
+            if self.buffer.find(b"\\", start, end) != -1:
+                return json.loads(b'"' + bytes(self.view[start:end]) + b'"')
+            return str(self.view[start:end], "utf-8")
+
+    def _scalar(self):
+        parts = []
+        while True:
+            start = self.pos
+            while self.pos < self.end and self.buffer[self.pos] not in _SCALAR_END:
+                self.pos += 1
+            parts.append(bytes(self.view[start : self.pos]))
+            if self.pos < self.end or not self._fill():
+                break
+        token = b"".join(parts)
+        try:
+            return json.loads(token)
+        except ValueError:
+            raise self._error(f"invalid value {token[:32]!r}") from None
+
+    def _object(self):
+        self.pos += 1
+        result = {}
+        self._skip_whitespace()
+        if self._peek() == _CLOSE_OBJECT:
+            self.pos += 1
+            return result
+        while True:
+            self._skip_whitespace()
+            key = self._string()
+            self._skip_whitespace()
+            self._expect(_COLON)
+            result[key] = self._value()
+            self._skip_whitespace()
+            char = self._peek()
+            self.pos += 1
+            if char == _CLOSE_OBJECT:
+                return result
+            if char != _COMMA:
+                self.pos -= 1
+                raise self._error("expected ',' or '}'")
+
+    def _array(self):
+        self.pos += 1
+        result = []
+        self._skip_whitespace()
+        if self._peek() == _CLOSE_ARRAY:
+            self.pos += 1
+            return result
+        while True:
+            result.append(self._value())
+            self._skip_whitespace()
+            char = self._peek()
+            self.pos += 1
+            if char == _CLOSE_ARRAY:
+                return result
+            if char != _COMMA:
+                self.pos -= 1
+                raise self._error("expected ',' or ']'")
+
+    def _value(self):
+        self._skip_whitespace()
+        char = self._peek()
+        if char == _QUOTE:
+            return self._string()
+        if char == _OPEN_OBJECT:
+            return self._object()
+        if char == _OPEN_ARRAY:
+            return self._array()
+        return self._scalar()
+
+    def parse(self):
+        """
+        Receives and parses the message. Raises ValueError for malformed JSON, call `drain`
+        afterwards so the connection stays at a message boundary.
+        """
+        value = self._value()
+        self._skip_whitespace()
+        if self.pos < self.end:
+            raise self._error("extra data after the JSON value")
+        return value
+
+    def drain(self):
+        """
+        Receives and drops the rest of the message.
+        """
+        while self._fill():
+            pass
+        self.pos = self.end
+
+
+# ---------------------- Binary protocol ----------------------
+# A binary message starts with BINARY_MAGIC and a version byte right after the 4-byte length prefix,
+# JSON messages start with "{" so both can be served on the same socket. Layout:
+#   magic (4) | version (1) | header length (4, big endian) | JSON header | body
+# Requests carry the usual envelope without "sequences" in the header, plus "seq_ids",
+# "seq_lengths" and "seq_encoding", and the packed sequences as body:
+#   "uint8": one code per base (A=0, C=1, G=2, T=3, N=4)
+#   "2bit":  four bases per byte, first base in the high bits, no N
+# Responses carry the prediction_tasks without "predictions" (each task has a "column" instead),
+# "seq_ids", "cell_types" and "shape" in the header, and a little endian float32 (N, C) matrix as body.
+# Errors are always returned as JSON.
+BINARY_MAGIC = b"CRBN"
+BINARY_VERSION = 1
+BINARY_SEQ_ENCODINGS = ["uint8", "2bit"]
+
+_CODE_TO_BASE = np.frombuffer(b"ACGTN", dtype=np.uint8)
+_BASE_TO_CODE = np.full(256, 255, dtype=np.uint8)
+_BASE_TO_CODE[np.frombuffer(b"ACGTN", dtype=np.uint8)] = np.arange(5)
+_BASE_TO_CODE[np.frombuffer(b"acgtn", dtype=np.uint8)] = np.arange(5)
+
+
+def is_binary_message(buffer):
+    return bytes(buffer[: len(BINARY_MAGIC)]) == BINARY_MAGIC
+
+
+def _pack_binary(header, body=b""):
+    header_bytes = json.dumps(header).encode("utf-8")
+    return b"".join(
+        [
+            BINARY_MAGIC,
+            struct.pack(">BI", BINARY_VERSION, len(header_bytes)),
+            header_bytes,
+            body,
+        ]
+    )
+
+
+def _unpack_binary(buffer):
+    if not is_binary_message(buffer):
+        raise ValueError("message does not start with the binary protocol magic")
+    offset = len(BINARY_MAGIC)
+    version, header_len = struct.unpack_from(">BI", buffer, offset)
+    if version != BINARY_VERSION:
+        raise ValueError(
+            f"binary protocol version {version} is not supported, expected {BINARY_VERSION}"
+        )
+    offset += 5
+    header = loads_buffer(memoryview(buffer)[offset : offset + header_len])
+    return header, memoryview(buffer)[offset + header_len :]
+
+
+def encode_binary_request(evaluator_json, seq_encoding="uint8"):
+    """
+    Packs a JSON-style request into the binary protocol, used by clients and benchmarks.
+    """
+    header = {k: v for k, v in evaluator_json.items() if k != "sequences"}
+    sequences = evaluator_json["sequences"]
+    header["seq_ids"] = list(sequences.keys())
+    header["seq_lengths"] = [len(seq) for seq in sequences.values()]
+    header["seq_encoding"] = seq_encoding
+    codes = _BASE_TO_CODE[
+        np.frombuffer("".join(sequences.values()).encode("ascii"), dtype=np.uint8)
+    ]
+    if (codes == 255).any():
+        raise ValueError("sequences may only contain A, C, G, T or N")
+    if seq_encoding == "2bit":
+        if (codes == 4).any():
+            raise ValueError("the 2bit encoding can not represent N")
+        padded = np.zeros(-(-len(codes) // 4) * 4, dtype=np.uint8)
+        padded[: len(codes)] = codes
+        quads = padded.reshape(-1, 4)
+        codes = (
+            (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+        )
+    elif seq_encoding != "uint8":
+        raise ValueError(
+            f"seq_encoding should be one of {BINARY_SEQ_ENCODINGS}, got {seq_encoding!r}"
+        )
+    return _pack_binary(header, codes.tobytes())
+
+
+def decode_binary_request(buffer):
+    """
+    Unpacks a binary request into the same dict a JSON request parses to, with "sequences" as strings.
+    """
+    header, body = _unpack_binary(buffer)
+    missing = [key for key in ["seq_ids", "seq_lengths"] if key not in header]
+    if missing:
+        raise ValueError(f"binary request header is missing {missing}")
+    seq_ids = header.pop("seq_ids")
+    seq_lengths = np.asarray(header.pop("seq_lengths"), dtype=np.int64)
+    seq_encoding = header.pop("seq_encoding", "uint8")
+    if len(seq_ids) != len(seq_lengths):
+        raise ValueError("'seq_ids' and 'seq_lengths' should have the same length")
+    n_bases = int(seq_lengths.sum())
+    codes = np.frombuffer(body, dtype=np.uint8)
+    if seq_encoding == "2bit":
+        if len(codes) != -(-n_bases // 4):
+            raise ValueError("binary sequence body does not match 'seq_lengths'")
+        shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+        codes = ((codes[:, None] >> shifts) & 3).reshape(-1)[:n_bases]
+    elif seq_encoding == "uint8":
+        if len(codes) != n_bases:
+            raise ValueError("binary sequence body does not match 'seq_lengths'")
+        if (codes > 4).any():
+            raise ValueError("uint8 sequence codes should be between 0 and 4")
+    else:
+        raise ValueError(
+            f"seq_encoding should be one of {BINARY_SEQ_ENCODINGS}, got {seq_encoding!r}"
+        )
+    bases = _CODE_TO_BASE[codes].tobytes().decode("ascii")
+    ends = np.cumsum(seq_lengths).tolist()
+    starts = [0] + ends[:-1]
+    header["sequences"] = {
+        seq_id: bases[start:end] for seq_id, start, end in zip(seq_ids, starts, ends)
+    }
+    return header
+
+
+def encode_binary_response(json_return, seq_ids, cell_types, predictions):
+    """
+    Packs a prediction response as a JSON header plus the raw float32 (N, C) prediction matrix.
+    """
+    predictions = np.ascontiguousarray(predictions, dtype="<f4")
+    header = dict(json_return)
+    header["seq_ids"] = list(seq_ids)
+    header["cell_types"] = list(cell_types)
+    header["shape"] = list(predictions.shape)
+    header["dtype"] = "float32"
+    return _pack_binary(header, predictions.tobytes())
+
+
+def add_response_field(payload, key, value):
+    """
+    Adds `key` as the first field of a serialized JSON object response, or to the header of a
+    binary response. Other payloads, e.g. Prometheus text, are returned unchanged.
+    """
+    if is_binary_message(payload):
+        header, body = _unpack_binary(payload)
+        return _pack_binary({key: value, **header}, body)
+    if payload[:1] != b"{":
+        return payload
+    separator = b"" if payload[1:].lstrip()[:1] == b"}" else b","
+    return b"".join(
+        [b"{", dumps_bytes(key), b":", dumps_bytes(value), separator, payload[1:]]
+    )
+
+
+def decode_binary_response(buffer):
+    """
+    Unpacks a binary response into its header and the (N, C) float32 prediction matrix.
+    """
+    header, body = _unpack_binary(buffer)
+    predictions = np.frombuffer(body, dtype="<f4").reshape(header["shape"])
+    return header, predictions
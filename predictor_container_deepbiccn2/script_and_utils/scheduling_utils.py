@@ -0,0 +1,97 @@
+import time
+import threading
+from collections import OrderedDict, deque
+
+
+class RequestCancelled(Exception):
+    """
+    Raised between inference chunks once a request's deadline passed or its Evaluator disconnected.
+    """
+
+
+class CancelToken:
+    """
+    Cancellation state of one request: an optional deadline in milliseconds after `start`
+    (time.perf_counter()) and an explicit cancel, e.g. when the Evaluator's connection closes.
+    """
+
+    def __init__(self, start=None):
+        # deadlines count from here, e.g. when the request started arriving
+        self.start = time.perf_counter() if start is None else start
+        self.deadline = None
+        self.deadline_ms = None
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def set_deadline(self, deadline_ms):
+        self.deadline_ms = deadline_ms
+        self.deadline = self.start + deadline_ms / 1000
+
+    def cancel(self, reason):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    def is_cancelled(self):
+        if self._cancelled.is_set():
+            return True
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.cancel(f"deadline of {self.deadline_ms:g} ms exceeded")
+            return True
+        return False
+
+    def check(self):
+        if self.is_cancelled():
+            raise RequestCancelled(f"request cancelled: {self.reason}")
+
+
+class FairScheduler:
+    """
+    Queue of pending batcher requests. Requests of at most `small_request_rows` sequences are
+    served first, in arrival order, so interactive requests are not stuck behind bulk jobs.
+    Larger requests are served round robin across clients, smallest request first within a
+    client, and a request that is only partly batched is put back so others get their turn.
+    Pending requests need `client`, `size` and `remaining()`.
+    """
+
+    def __init__(self, small_request_rows):
+        self.small_request_rows = small_request_rows
+        self._small = deque()
+        # client -> its pending bulk requests, the next client to serve first
+        self._clients = OrderedDict()
+        self._size = 0
+        self._condition = threading.Condition()
+
+    def put(self, pending, front=False):
+        with self._condition:
+            if pending.size <= self.small_request_rows:
+                if front:
+                    self._small.appendleft(pending)
+                else:
+                    self._small.append(pending)
+            else:
+                self._clients.setdefault(pending.client, []).append(pending)
+            self._size += 1
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the next pending request to batch, or None if there is none within `timeout` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._size > 0, timeout):
+                return None
+            self._size -= 1
+            if self._small:
+                return self._small.popleft()
+            client, pending_requests = next(iter(self._clients.items()))
+            pending = min(pending_requests, key=lambda p: p.remaining())
+            pending_requests.remove(pending)
+            if pending_requests:
+                self._clients.move_to_end(client)
+            else:
+                del self._clients[client]
+            return pending
+
+    def qsize(self):
+        return self._size